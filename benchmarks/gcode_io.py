@@ -0,0 +1,71 @@
+"""Compare file size and parse throughput of plain and compressed G-code of a random scene.
+
+Usage: python benchmarks/gcode_io.py [--paths N] [--points N] [--seed S]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pen.gcode import parse_ngc_words  # noqa: E402
+from pen.gcodeio import GCodeFile  # noqa: E402
+from pen.penviz import Pen  # noqa: E402
+from pen.penviz import PenViz  # noqa: E402
+
+
+def make_viz(path_count, point_count, seed):
+    rng = np.random.RandomState(seed)
+    viz = PenViz()
+    for _ in range(path_count):
+        start = rng.uniform(0, 200, size=2)
+        viz.draw_path(start + np.cumsum(rng.uniform(-2, 2, size=(point_count, 2)), axis=0))
+    return viz
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--paths', default=5000, type=int)
+    parser.add_argument('--points', default=40, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    viz = make_viz(args.paths, args.points, args.seed)
+    pen = Pen()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        baseline = None
+        for extension in ['', '.gz', '.xz', '.bz2']:
+            path = os.path.join(tmp_dir, 'job.gcode' + extension)
+            start_time = time.perf_counter()
+            viz.save_gcode(path, pen)
+            write_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            line_count = sum(1 for _ in GCodeFile(path))
+            read_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            for command in GCodeFile(path):
+                parse_ngc_words(command)
+            parse_time = time.perf_counter() - start_time
+
+            size = os.path.getsize(path)
+            if baseline is None:
+                baseline = size
+            print('{:<12} {:>8.2f} MB {:>5.1f}% write {:.2f} s, read {:>9.0f} lines/s, parse {:>9.0f} lines/s'.format(
+                'job.gcode' + extension,
+                size / 1e6,
+                100.0 * size / baseline,
+                write_time,
+                line_count / read_time,
+                line_count / parse_time,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Time hidden line removal on a scene of randomly overlapping squares and circles.
+
+Usage: python benchmarks/occlusion.py [--shapes N] [--seed S]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pen.occlusion import remove_hidden_lines  # noqa: E402
+from pen.penviz import PenViz  # noqa: E402
+
+
+def make_scene(shape_count, seed):
+    rng = np.random.RandomState(seed)
+    viz = PenViz()
+    # Grow the canvas with the shape count so each shape overlaps a handful of others.
+    canvas_size = 5.0 * np.sqrt(shape_count)
+    for _ in range(shape_count):
+        x, y = rng.uniform(0, canvas_size, size=2)
+        size = rng.uniform(2, 10)
+        if rng.rand() < 0.5:
+            viz.draw_path([[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]])
+        else:
+            viz.draw_circle(np.array([x, y]), 0.5 * size)
+    return viz
+
+
+def get_drawn_distance(viz):
+    distance = 0.0
+    for drawable in viz.drawables:
+        if hasattr(drawable, 'path'):
+            distance += drawable.path.get_line_distance()
+        elif hasattr(drawable, 'arcs'):
+            distance += drawable.arcs.get_lengths().sum()
+        else:
+            distance += drawable.arc.get_line_distance()
+    return distance
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shapes', default=20000, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    viz = make_scene(args.shapes, args.seed)
+    start_time = time.perf_counter()
+    visible = remove_hidden_lines(viz)
+    elapsed = time.perf_counter() - start_time
+
+    before = get_drawn_distance(viz)
+    after = get_drawn_distance(visible)
+    print('Shapes: {}'.format(args.shapes))
+    print('Time: {:.3f} s'.format(elapsed))
+    print('Pen down distance: {:.0f} -> {:.0f} ({:.0%} hidden)'.format(before, after, 1.0 - after / before))
+
+
+if __name__ == '__main__':
+    main()
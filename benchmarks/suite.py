@@ -0,0 +1,291 @@
+"""Time the hot paths of the pipeline on deterministic synthetic scenes, and compare runs.
+
+Usage:
+    python benchmarks/suite.py run [--out results.json] [--sizes 250 1000 4000] [--repeat 3] [--cases ...]
+    python benchmarks/suite.py compare base.json new.json [--threshold 0.1]
+
+compare exits with status 1 when any case slowed down by more than the threshold.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT_DIR)
+
+from pen import eleksdraw  # noqa: E402
+from pen.bezier import CubicBezier  # noqa: E402
+from pen.gcode import GCodeEmulator  # noqa: E402
+from pen.gcode import get_gcode_bounds  # noqa: E402
+from pen.optimizer import greedy_tsp  # noqa: E402
+from pen.penviz import Pen  # noqa: E402
+from pen.penviz import PenViz  # noqa: E402
+from pen.streaming import EncodedProgram  # noqa: E402
+from pen.streaming import GCodeStreamer  # noqa: E402
+from pen.svg import SVGPathDataParser  # noqa: E402
+from pen.svgimport import import_svg  # noqa: E402
+
+DEFAULT_SIZES = [250, 1000, 4000]
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_SEED = 0
+# What robopen.py up, down or move load before they touch the device.
+STARTUP_SCRIPT = 'import robopen\nfrom pen.plotter import run_commands\n'
+
+
+def make_random_strokes(count, seed=DEFAULT_SEED, points=20):
+    """Random walks scattered over the bed, like a hand drawn sketch."""
+    rng = np.random.RandomState(seed)
+    viz = PenViz()
+    for _ in range(count):
+        start = rng.uniform(10, 160, size=2)
+        viz.draw_path(start + np.cumsum(rng.uniform(-2, 2, size=(points, 2)), axis=0))
+    return viz
+
+
+def make_circle_pack(count, seed=DEFAULT_SEED):
+    """Circles of mixed sizes packed on a jittered grid."""
+    rng = np.random.RandomState(seed)
+    viz = PenViz()
+    side = int(np.ceil(np.sqrt(count)))
+    spacing = 150.0 / side
+    for index in range(count):
+        center = 10.0 + spacing * np.array([index % side, index // side]) + rng.uniform(-0.1, 0.1, size=2) * spacing
+        viz.draw_circle(center, rng.uniform(0.2, 0.5) * spacing)
+    return viz
+
+
+def make_bezier_data(count, seed=DEFAULT_SEED, curves=8):
+    """SVG path data of dense chains of cubic and quadratic curves."""
+    rng = np.random.RandomState(seed)
+    paths = []
+    for _ in range(count):
+        commands = ['M{:.3f},{:.3f}'.format(*rng.uniform(0, 500, size=2))]
+        for _ in range(curves):
+            if rng.rand() < 0.75:
+                commands.append('c' + ' '.join('{:.3f},{:.3f}'.format(*point) for point in rng.uniform(-30, 30, size=(3, 2))))
+            else:
+                commands.append('q' + ' '.join('{:.3f},{:.3f}'.format(*point) for point in rng.uniform(-30, 30, size=(2, 2))))
+        paths.append(' '.join(commands))
+    return paths
+
+
+def make_svg_document(count, seed=DEFAULT_SEED):
+    """A filled and stroked SVG of curved paths, rects and ellipses."""
+    rng = np.random.RandomState(seed)
+    elements = ['<path d="{}" fill="none" stroke="black"/>'.format(data) for data in make_bezier_data(count, seed)]
+    for _ in range(count // 4):
+        x, y = rng.uniform(0, 450, size=2)
+        elements.append('<rect x="{:.3f}" y="{:.3f}" width="{:.3f}" height="{:.3f}" fill="black"/>'.format(x, y, *rng.uniform(5, 40, size=2)))
+        elements.append('<ellipse cx="{:.3f}" cy="{:.3f}" rx="{:.3f}" ry="{:.3f}" stroke="black" fill="none"/>'.format(
+            *rng.uniform(0, 500, size=2), *rng.uniform(2, 20, size=2)))
+    return '<svg xmlns="http://www.w3.org/2000/svg" width="500" height="500">{}</svg>'.format(''.join(elements))
+
+
+# Each case builds its inputs for a size outside the timer and returns the function to time.
+
+def case_gcode_bounds(size):
+    commands = make_random_strokes(size).to_gcode(Pen())
+    return lambda: get_gcode_bounds(commands)
+
+
+def case_emulator(size):
+    commands = make_random_strokes(size).to_gcode(Pen())
+    return lambda: GCodeEmulator().run(commands)
+
+
+def case_greedy_tsp(size):
+    viz = make_random_strokes(size)
+    pen_paths = [drawable.get_pen_path() for drawable in viz.drawables]
+    return lambda: greedy_tsp(pen_paths)
+
+
+def case_bezier(size):
+    rng = np.random.RandomState(DEFAULT_SEED)
+    curves = [CubicBezier(*points, distance_tolerance=0.05) for points in rng.uniform(0, 100, size=(size, 4, 2))]
+
+    def run():
+        for curve in curves:
+            curve.points = None
+            curve.to_points()
+    return run
+
+
+def case_svg_path_data(size):
+    paths = make_bezier_data(size)
+
+    def run():
+        parser = SVGPathDataParser()
+        for data in paths:
+            parser.data_to_segments(data)
+    return run
+
+
+def case_svg_import(size):
+    tmp_dir = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp_dir.name, 'scene.svg')
+    with open(path, 'w') as w:
+        w.write(make_svg_document(size))
+
+    def run():
+        return import_svg(path, Pen())
+    run.cleanup = tmp_dir.cleanup
+    return run
+
+
+def case_to_gcode(size):
+    viz = make_random_strokes(size)
+    viz.drawables += make_circle_pack(size).drawables
+    pen = Pen()
+    return lambda: viz.to_gcode(pen)
+
+
+def case_to_gcode_optimized(size):
+    viz = make_random_strokes(size)
+    viz.drawables += make_circle_pack(size).drawables
+    pen = Pen()
+    return lambda: viz.to_gcode(pen, optimize=True)
+
+
+def case_to_svg(size):
+    viz = make_random_strokes(size)
+    viz.drawables += make_circle_pack(size).drawables
+    pen = Pen()
+    return lambda: viz.to_svg(pen)
+
+
+def case_streaming(size):
+    program = EncodedProgram.from_commands(make_random_strokes(size).to_gcode(Pen()))
+
+    def run():
+        with eleksdraw.open_device('fakegrbl://benchmark_suite') as device:
+            GCodeStreamer(device, program).run()
+    return run
+
+
+def case_startup(size):
+    # A fresh interpreter each time, startup doesn't depend on the size.
+    return lambda: subprocess.check_call([sys.executable, '-c', STARTUP_SCRIPT], cwd=ROOT_DIR)
+
+
+CASES = {
+    'gcode_bounds': case_gcode_bounds,
+    'emulator': case_emulator,
+    'greedy_tsp': case_greedy_tsp,
+    'bezier': case_bezier,
+    'svg_path_data': case_svg_path_data,
+    'svg_import': case_svg_import,
+    'to_gcode': case_to_gcode,
+    'to_gcode_optimized': case_to_gcode_optimized,
+    'to_svg': case_to_svg,
+    'streaming': case_streaming,
+    'startup': case_startup,
+}
+
+
+def time_case(run, repeat):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start_time = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start_time)
+    return times
+
+
+def run_main(args):
+    results = []
+    for name in args.cases:
+        for size in args.sizes:
+            run = CASES[name](size)
+            try:
+                times = time_case(run, args.repeat)
+            finally:
+                # Cases holding files on disk remove them once timed.
+                if hasattr(run, 'cleanup'):
+                    run.cleanup()
+            results.append({
+                'case': name,
+                'size': size,
+                'min': min(times),
+                'median': statistics.median(times),
+                'repeat': args.repeat,
+            })
+            print('{:<20} {:>7} {:>10.4f} s {:>10.4f} s'.format(name, size, min(times), statistics.median(times)))
+
+    report = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as w:
+            json.dump(report, w, indent=2)
+
+
+def load_results(path):
+    with open(path) as r:
+        report = json.load(r)
+    return {(result['case'], result['size']): result for result in report['results']}
+
+
+def compare_main(args):
+    base = load_results(args.base)
+    new = load_results(args.new)
+    slower = []
+    print('{:<20} {:>7} {:>10} {:>10} {:>8}'.format('case', 'size', 'base', 'new', 'ratio'))
+    for key in sorted(set(base) & set(new)):
+        # The fastest repeat is the least noisy estimate of the cost.
+        ratio = new[key]['min'] / max(base[key]['min'], 1e-9)
+        flag = ''
+        if ratio > 1.0 + args.threshold:
+            flag = ' SLOWER'
+            slower.append(key)
+        elif ratio < 1.0 - args.threshold:
+            flag = ' faster'
+        print('{:<20} {:>7} {:>9.4f}s {:>9.4f}s {:>7.2f}x{}'.format(key[0], key[1], base[key]['min'], new[key]['min'], ratio, flag))
+    for key in sorted(set(base) ^ set(new)):
+        print('{:<20} {:>7} only in {}'.format(key[0], key[1], args.base if key in base else args.new))
+    if len(slower) != 0:
+        print('{} case(s) slowed down by more than {:.0%}'.format(len(slower), args.threshold))
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers()
+
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--out', help='Write results to this JSON file')
+    run_parser.add_argument('--sizes', default=DEFAULT_SIZES, type=int, nargs='+')
+    run_parser.add_argument('--repeat', default=DEFAULT_REPEAT, type=int)
+    run_parser.add_argument('--cases', default=list(CASES), choices=list(CASES), nargs='+')
+    run_parser.set_defaults(main=run_main)
+
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', default=DEFAULT_THRESHOLD, type=float, help='Allowed slowdown, 0.1 is 10%%')
+    compare_parser.set_defaults(main=compare_main)
+
+    args = parser.parse_args()
+    if not hasattr(args, 'main'):
+        parser.print_help()
+        return -1
+    return args.main(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
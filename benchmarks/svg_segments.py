@@ -0,0 +1,56 @@
+"""Time batch SVG path flattening across worker counts on a map-like set of random paths.
+
+Usage: python benchmarks/svg_segments.py [--paths N] [--workers 1 2 4] [--seed S]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pen.svg import SVGPath  # noqa: E402
+from pen.svg import paths_to_segments  # noqa: E402
+
+
+def make_paths(path_count, seed):
+    rng = np.random.RandomState(seed)
+    paths = []
+    for _ in range(path_count):
+        x, y = rng.uniform(0, 1000, size=2)
+        commands = ['M {:.3f},{:.3f}'.format(x, y)]
+        for _ in range(rng.randint(1, 6)):
+            if rng.rand() < 0.5:
+                commands.append('c ' + ' '.join('{:.3f},{:.3f}'.format(*point) for point in rng.uniform(-20, 20, size=(3, 2))))
+            else:
+                commands.append('l ' + ' '.join('{:.3f},{:.3f}'.format(*point) for point in rng.uniform(-20, 20, size=(3, 2))))
+        commands.append('z')
+        paths.append(SVGPath(' '.join(commands)))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--paths', default=50000, type=int)
+    parser.add_argument('--workers', default=[1, 2, 4, os.cpu_count()], type=int, nargs='+')
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    paths = make_paths(args.paths, args.seed)
+    print('Paths: {} CPUs: {}'.format(args.paths, os.cpu_count()))
+
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        start_time = time.perf_counter()
+        points, offsets, path_offsets = paths_to_segments(paths, workers=workers)
+        elapsed = time.perf_counter() - start_time
+        if baseline is None:
+            baseline = elapsed
+        print('workers {:>3}: {:.3f} s, {:.0f} paths/s, {:.2f}x, {} points'.format(
+            workers, elapsed, args.paths / elapsed, baseline / elapsed, len(points)))
+
+
+if __name__ == '__main__':
+    main()
@@ -16,40 +16,49 @@ class CubicBezier:
         self.distance_tolerance = distance_tolerance ** 2
 
     def _recursive_segment(self, p1, p2, p3, p4, level):
-        # De Casteljau's algorithm
+        # De Casteljau's algorithm, on plain floats since numpy call overhead dominates for 2d points.
         if level > self.recursion_limit:
             return
+        x1, y1 = p1
+        x2, y2 = p2
+        x3, y3 = p3
+        x4, y4 = p4
 
         # Calculate mid points of line segments
-        p12 = (p1 + p2) / 2
-        p23 = (p2 + p3) / 2
-        p34 = (p3 + p4) / 2
-        p123 = (p12 + p23) / 2
-        p234 = (p23 + p34) / 2
-        p1234 = (p123 + p234) / 2
+        x12, y12 = (x1 + x2) / 2, (y1 + y2) / 2
+        x23, y23 = (x2 + x3) / 2, (y2 + y3) / 2
+        x34, y34 = (x3 + x4) / 2, (y3 + y4) / 2
+        x123, y123 = (x12 + x23) / 2, (y12 + y23) / 2
+        x234, y234 = (x23 + x34) / 2, (y23 + y34) / 2
+        x1234, y1234 = (x123 + x234) / 2, (y123 + y234) / 2
 
         # Approximate cubic curve by line segment
-        dp = p4 - p1
-        dx, dy = dp
+        dx = x4 - x1
+        dy = y4 - y1
 
-        d2 = np.abs((p2[0] - p4[0]) * dy - (p2[1] - p4[1]) * dx)
-        d3 = np.abs((p3[0] - p4[0]) * dy - (p3[1] - p4[1]) * dx)
+        d2 = abs((x2 - x4) * dy - (y2 - y4) * dx)
+        d3 = abs((x3 - x4) * dy - (y3 - y4) * dx)
         de = d2 + d3
 
-        if de ** 2 < self.distance_tolerance * (dp ** 2).sum():
-            point = p1234
-            self.points.append(point)
+        if de ** 2 < self.distance_tolerance * (dx * dx + dy * dy):
+            self.points.append((x1234, y1234))
             return
 
-        self._recursive_segment(p1, p12, p123, p1234, level + 1)
-        self._recursive_segment(p1234, p234, p34, p4, level + 1)
+        self._recursive_segment((x1, y1), (x12, y12), (x123, y123), (x1234, y1234), level + 1)
+        self._recursive_segment((x1234, y1234), (x234, y234), (x34, y34), (x4, y4), level + 1)
 
     def to_points(self):
         if self.points is not None:
             return np.array(self.points)
         self.points = []
         self.points.append(self.p1)
-        self._recursive_segment(self.p1, self.p2, self.p3, self.p4, level=0)
+        self._recursive_segment(
+            self.p1.astype(float).tolist(),
+            self.p2.astype(float).tolist(),
+            self.p3.astype(float).tolist(),
+            self.p4.astype(float).tolist(),
+            level=0,
+        )
         self.points.append(self.p4)
         return np.array(self.points)
 
@@ -0,0 +1,105 @@
+import collections
+import json
+import os
+import time
+
+from .gcode import GCodeState
+from .grbl import GRBL_PLANNER_BLOCKS
+
+# Lines GRBL acknowledges are only queued in its planner, so an alarm or reset can drop up to a
+# planner's worth of them. Redrawing a few lines is harmless, skipping them is not.
+DEFAULT_RESUME_MARGIN = GRBL_PLANNER_BLOCKS
+DEFAULT_SAVE_INTERVAL = 2.0
+
+
+def get_checkpoint_path(gcode_path):
+    return gcode_path + '.checkpoint'
+
+
+class JobCheckpoint:
+    """Persist how far a job got so an interrupted plot can be resumed.
+
+    The checkpoint is fed every acknowledged command of the sent program. Only commands in
+    [command_offset, command_offset + line_count) belong to the job itself, anything before is
+    preamble such as tracing the bounds.
+    """
+    def __init__(
+            self,
+            path,
+            gcode_path,
+            line_count,
+            line=0,
+            state=None,
+            command_offset=0,
+            margin=DEFAULT_RESUME_MARGIN,
+            save_interval=DEFAULT_SAVE_INTERVAL,
+    ):
+        self.path = path
+        self.gcode_path = gcode_path
+        self.line_count = line_count
+        self.line = line
+        self.command_offset = command_offset
+        self.save_interval = save_interval
+        if state is None:
+            state = GCodeState()
+        # The state lags the acknowledged line by the resume margin.
+        self.resume_state = state
+        self.resume_line = line
+        self.pending = collections.deque(maxlen=margin)
+        self.last_save_time = time.monotonic()
+
+    def ack(self, index, command):
+        index -= self.command_offset
+        if index < 0 or self.line >= self.line_count:
+            return
+        if len(self.pending) == self.pending.maxlen:
+            self.resume_state.handle_command(self.pending.popleft())
+            self.resume_line += 1
+        self.pending.append(command)
+        self.line += 1
+
+        now = time.monotonic()
+        if now - self.last_save_time > self.save_interval:
+            self.save()
+            self.last_save_time = now
+
+    def is_complete(self):
+        return self.line >= self.line_count
+
+    def save(self):
+        data = {
+            'gcode_path': os.path.abspath(self.gcode_path),
+            'line_count': self.line_count,
+            'acknowledged_line': self.line,
+            'resume_line': self.resume_line,
+            'state': self.resume_state.to_dict(),
+        }
+        # Write then rename so an interruption mid-save never corrupts the checkpoint.
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as w:
+            json.dump(data, w, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def get_resume_commands(self):
+        return self.resume_state.to_commands()
+
+    @classmethod
+    def load(cls, path, gcode_path, line_count, **kwargs):
+        with open(path) as r:
+            data = json.load(r)
+        if data['gcode_path'] != os.path.abspath(gcode_path):
+            raise RuntimeError('Checkpoint is for a different job: {}'.format(data['gcode_path']))
+        if data['line_count'] != line_count:
+            raise RuntimeError('Job changed since checkpoint: {} lines vs {}'.format(line_count, data['line_count']))
+        return cls(
+            path,
+            gcode_path,
+            line_count,
+            line=data['resume_line'],
+            state=GCodeState.from_dict(data['state']),
+            **kwargs
+        )
@@ -0,0 +1,378 @@
+import numpy as np
+
+from .gcode import ArcOperator
+from .gcode import GCode
+from .gcode import join_pauses
+from .gcode import split_gcode_strokes
+from .gcode import split_pauses
+from .mathscene import ArcArray
+from .mathscene import DISTANCE_EPSILON
+from .mathscene import Rectangle
+from .penviz import DrawArc
+from .penviz import DrawArcs
+from .penviz import DrawPath
+from .spatial import GridIndex
+from .spatial import get_segment_bounds
+
+# Parameter gaps below this are treated as a continuous stroke.
+PARAMETER_EPSILON = 1e-9
+# Cap on per-pair work arrays so huge scenes are processed in chunks.
+CHUNK_CELLS = 1 << 22
+
+
+class PolygonMask:
+    """A closed polygon given by its vertices, inside is decided by the even-odd rule."""
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(self.points) < 3:
+            raise RuntimeError('A polygon mask needs at least 3 points, got: {}'.format(len(self.points)))
+        self.edge_starts = self.points
+        self.edge_ends = np.roll(self.points, -1, axis=0)
+        self.index = GridIndex.from_segments(self.edge_starts, self.edge_ends)
+
+    def get_edge_pairs(self, bounds):
+        """(query index, edge index) for every edge whose box overlaps a query box."""
+        return self.index.query_boxes(bounds)
+
+    def contains_points(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        # Count edges crossed by a ray towards +x, only edges near the ray can cross it.
+        x_max = self.points[:, 0].max()
+        rays = np.stack([points[:, 0], np.maximum(points[:, 0], x_max), points[:, 1], points[:, 1]], axis=1)
+        queries, edges = self.get_edge_pairs(rays)
+        px, py = points[queries, 0], points[queries, 1]
+        ax, ay = self.edge_starts[edges, 0], self.edge_starts[edges, 1]
+        bx, by = self.edge_ends[edges, 0], self.edge_ends[edges, 1]
+        straddles = (ay > py) != (by > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x = ax + (py - ay) * (bx - ax) / (by - ay)
+        crossings = np.bincount(queries[straddles & (px < crossing_x)], minlength=len(points))
+        return crossings % 2 == 1
+
+
+def get_mask(mask):
+    """Accept a Rectangle, a PolygonMask or polygon vertices."""
+    if isinstance(mask, PolygonMask):
+        return mask
+    if isinstance(mask, Rectangle):
+        return PolygonMask([
+            [mask.x0, mask.y0],
+            [mask.x1, mask.y0],
+            [mask.x1, mask.y1],
+            [mask.x0, mask.y1],
+        ])
+    return PolygonMask(mask)
+
+
+def _split_intervals(count, cut_index, cut_params, get_midpoints, mask, invert):
+    """Turn cut parameters of N primitives into the (index, t0, t1) intervals to keep.
+
+    Cut j falls at cut_params[j] on primitive cut_index[j], 0 and 1 are implied. Pieces are kept
+    when their midpoint is inside the mask (outside if invert).
+    """
+    index = np.concatenate([np.arange(count), np.arange(count), cut_index]).astype(int)
+    params = np.concatenate([np.zeros(count), np.ones(count), cut_params])
+    order = np.lexsort([params, index])
+    index, params = index[order], params[order]
+    # Every primitive ends with its 1, so a piece never spans two primitives.
+    valid = (index[1:] == index[:-1]) & (params[1:] - params[:-1] > PARAMETER_EPSILON)
+    t0 = params[:-1][valid]
+    t1 = params[1:][valid]
+    index = index[:-1][valid]
+    inside = mask.contains_points(get_midpoints(index, 0.5 * (t0 + t1)))
+    keep = inside != invert
+    return index[keep], t0[keep], t1[keep]
+
+
+def liang_barsky(starts, ends, rect):
+    """Clip segments to a rectangle, returning (keep, t0, t1) for the visible part of each segment."""
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    deltas = np.asarray(ends, dtype=float).reshape(-1, 2) - starts
+    p = np.stack([-deltas[:, 0], deltas[:, 0], -deltas[:, 1], deltas[:, 1]], axis=1)
+    q = np.stack([
+        starts[:, 0] - rect.x0,
+        rect.x1 - starts[:, 0],
+        starts[:, 1] - rect.y0,
+        rect.y1 - starts[:, 1],
+    ], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = q / p
+    t0 = np.max(np.where(p < 0, r, 0.0), axis=1, initial=0.0)
+    t1 = np.min(np.where(p > 0, r, 1.0), axis=1, initial=1.0)
+    parallel_outside = np.any((p == 0) & (q < 0), axis=1)
+    keep = ~parallel_outside & (t0 <= t1)
+    return keep, t0, t1
+
+
+def clip_segment_intervals(starts, ends, mask, invert=False):
+    """Visible parameter intervals of N segments as (index, t0, t1) arrays sorted by index then t0."""
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+
+    if isinstance(mask, Rectangle) and not invert:
+        keep, t0, t1 = liang_barsky(starts, ends, mask)
+        keep &= t1 - t0 > PARAMETER_EPSILON
+        index = np.nonzero(keep)[0]
+        return index, t0[keep], t1[keep]
+
+    mask = get_mask(mask)
+    deltas = ends - starts
+
+    def get_midpoints(index, t):
+        return starts[index] + t[:, None] * deltas[index]
+
+    # Only segments and mask edges with overlapping boxes can cross.
+    index, edges = mask.get_edge_pairs(get_segment_bounds(starts, ends))
+    d = deltas[index]
+    f = mask.edge_starts[edges] - starts[index]
+    e = mask.edge_ends[edges] - mask.edge_starts[edges]
+    denom = d[:, 0] * e[:, 1] - d[:, 1] * e[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (f[:, 0] * e[:, 1] - f[:, 1] * e[:, 0]) / denom
+        s = (f[:, 0] * d[:, 1] - f[:, 1] * d[:, 0]) / denom
+    hits = (np.abs(denom) > DISTANCE_EPSILON) & (t > 0.0) & (t < 1.0) & (s >= 0.0) & (s <= 1.0)
+    return _split_intervals(len(starts), index[hits], t[hits], get_midpoints, mask, invert)
+
+
+def clip_arc_intervals(arcs, mask, invert=False):
+    """Visible fractions of the sweep of each arc in an ArcArray as (index, u0, u1) arrays."""
+    mask = get_mask(mask)
+
+    def get_midpoints(index, u):
+        thetas = arcs.start_thetas[index] + u * arcs.widths[index]
+        return arcs.centers[index] + arcs.radii[index, None] * np.stack([np.cos(thetas), np.sin(thetas)], axis=1)
+
+    index, edges = mask.get_edge_pairs(arcs.get_bounds())
+    f = mask.edge_starts[edges] - arcs.centers[index]
+    e = mask.edge_ends[edges] - mask.edge_starts[edges]
+    # Solve |f + s e| = r for the edge parameter s.
+    a = np.sum(e * e, axis=1)
+    b = 2.0 * np.sum(f * e, axis=1)
+    c = np.sum(f * f, axis=1) - arcs.radii[index] ** 2
+    discriminant = b ** 2 - 4.0 * a * c
+    root = np.sqrt(np.maximum(discriminant, 0.0))
+    cut_index = []
+    cut_params = []
+    for sign in [-1.0, 1.0]:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = (-b + sign * root) / (2.0 * a)
+        points = f + s[:, None] * e
+        thetas = np.arctan2(points[:, 1], points[:, 0])
+        u = np.mod(thetas - arcs.start_thetas[index], 2.0 * np.pi) / arcs.widths[index]
+        hits = (discriminant >= 0.0) & (s >= 0.0) & (s <= 1.0) & (u > 0.0) & (u < 1.0)
+        cut_index.append(index[hits])
+        cut_params.append(u[hits])
+    return _split_intervals(len(arcs), np.concatenate(cut_index), np.concatenate(cut_params), get_midpoints, mask, invert)
+
+
+def concatenate_intervals(results):
+    if len(results) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0), np.zeros(0)
+    return tuple(np.concatenate(values) for values in zip(*results))
+
+
+def complement_intervals(count, index, t0, t1):
+    """Complement in [0, 1] of the covered intervals of count primitives, as (index, t0, t1) sorted by index."""
+    order = np.lexsort([t0, index])
+    index = index[order]
+    # Offset primitive i into [2i, 2i + 1] so a single running max tracks coverage for every primitive.
+    starts = 2 * index + t0[order]
+    covered = np.maximum.accumulate(2 * index + t1[order])
+
+    first = np.ones(len(index), dtype=bool)
+    first[1:] = index[1:] != index[:-1]
+    last = np.ones(len(index), dtype=bool)
+    last[:-1] = first[1:]
+    previous = np.where(first, 2 * index, np.concatenate([[0.0], covered[:-1]]))
+
+    untouched = np.setdiff1d(np.arange(count), index)
+    visible_index = np.concatenate([index, index[last], untouched])
+    visible_t0 = np.concatenate([previous, covered[last], 2 * untouched]) - 2 * visible_index
+    visible_t1 = np.concatenate([starts, 2 * index[last] + 1, 2 * untouched + 1]) - 2 * visible_index
+    keep = visible_t1 - visible_t0 > PARAMETER_EPSILON
+    visible_index, visible_t0, visible_t1 = visible_index[keep], visible_t0[keep], visible_t1[keep]
+    order = np.lexsort([visible_t0, visible_index])
+    return visible_index[order], visible_t0[order], visible_t1[order]
+
+
+def _get_continuations(index, t0, t1, groups):
+    # An interval continues the previous one if it picks up where it left off in the next primitive of a stroke.
+    continues = np.zeros(len(index), dtype=bool)
+    continues[1:] = (
+        (index[1:] == index[:-1] + 1) &
+        (groups[index[1:]] == groups[index[:-1]]) &
+        (t1[:-1] >= 1.0 - PARAMETER_EPSILON) &
+        (t0[1:] <= PARAMETER_EPSILON)
+    )
+    return continues
+
+
+def clip_polylines(points, offsets, mask, invert=False):
+    """Clip polylines held as a point buffer and offsets, splitting them where they cross the mask.
+
+    Polyline i is points[offsets[i]:offsets[i + 1]], the result uses the same layout.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=int)
+    # Segments join consecutive points that belong to the same polyline.
+    polyline_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    segment_starts = np.nonzero(polyline_ids[:-1] == polyline_ids[1:])[0]
+    starts = points[segment_starts]
+    ends = points[segment_starts + 1]
+
+    index, t0, t1 = clip_segment_intervals(starts, ends, mask, invert=invert)
+    points, offsets, _ = intervals_to_polylines(starts, ends, index, t0, t1, polyline_ids[segment_starts])
+    return points, offsets
+
+
+def intervals_to_polylines(starts, ends, index, t0, t1, groups):
+    """Build polylines from kept segment intervals, joining consecutive segments of the same group.
+
+    Returns the point buffer, offsets and the group of each polyline.
+    """
+    continues = _get_continuations(index, t0, t1, groups)
+    deltas = ends[index] - starts[index]
+    clipped_starts = starts[index] + t0[:, None] * deltas
+    clipped_ends = starts[index] + t1[:, None] * deltas
+
+    # Each interval adds its end point, plus its start point when it begins a new polyline.
+    counts = 1 + (~continues).astype(int)
+    positions = np.cumsum(counts) - counts
+    output = np.zeros((counts.sum(), 2))
+    output[positions[~continues]] = clipped_starts[~continues]
+    output[positions + counts - 1] = clipped_ends
+    output_offsets = np.concatenate([positions[~continues], [len(output)]]).astype(int)
+    return output, output_offsets, groups[index[~continues]]
+
+
+def clip_arcs(arcs, mask, invert=False):
+    """Clip an ArcArray to a mask, returning the visible sub-arcs as a new ArcArray."""
+    index, u0, u1 = clip_arc_intervals(arcs, mask, invert=invert)
+    return ArcArray(
+        centers=arcs.centers[index],
+        radii=arcs.radii[index],
+        start_thetas=arcs.start_thetas[index] + u0 * arcs.widths[index],
+        widths=(u1 - u0) * arcs.widths[index],
+    )
+
+
+def clip_penviz(viz, mask, invert=False):
+    """Return a new PenViz with every path and arc clipped to the mask.
+
+    Paths and arcs are clipped in two batches per layer, so the clipped scene draws all paths of a
+    layer before its arcs.
+    """
+    layers = viz.get_layers()
+    if len(layers) > 1:
+        return viz.with_drawables([
+            drawable for layer in layers for drawable in clip_penviz(viz.get_layer(layer), mask, invert=invert).drawables
+        ])
+
+    paths = []
+    arcs = []
+    others = []
+    for drawable in viz.drawables:
+        if type(drawable) == DrawPath:
+            paths.append(np.asarray(drawable.path.points, dtype=float).reshape(-1, 2))
+        elif type(drawable) == DrawArc:
+            arcs.append(ArcArray.from_arcs([drawable.arc]))
+        elif type(drawable) == DrawArcs:
+            arcs.append(drawable.arcs)
+        else:
+            others.append(drawable)
+    if len(others) != 0:
+        raise NotImplementedError('Unsupported drawable for clipping: {}'.format(type(others[0]).__name__))
+
+    clipped = viz.with_drawables([])
+    clipped.layer = layers[0] if len(layers) != 0 else None
+    if len(paths) != 0:
+        offsets = np.concatenate([[0], np.cumsum([len(path) for path in paths])])
+        points, offsets = clip_polylines(np.concatenate(paths), offsets, mask, invert=invert)
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            clipped.draw_path(points[start:end])
+    if len(arcs) != 0:
+        arcs = ArcArray(
+            centers=np.concatenate([a.centers for a in arcs]),
+            radii=np.concatenate([a.radii for a in arcs]),
+            start_thetas=np.concatenate([a.start_thetas for a in arcs]),
+            widths=np.concatenate([a.widths for a in arcs]),
+        )
+        arcs = clip_arcs(arcs, mask, invert=invert)
+        if len(arcs) != 0:
+            clipped.add(DrawArcs(arcs))
+    clipped.layer = viz.layer
+    return clipped
+
+
+class GCodePrimitives:
+    """The line and arc ops of a program's pen-down strokes, gathered into arrays for batch work."""
+    def __init__(self, commands):
+        self.strokes = split_gcode_strokes(commands)
+        self.ops = [op for stroke in self.strokes for op in stroke.ops]
+        self.stroke_ids = np.array([i for i, stroke in enumerate(self.strokes) for _ in stroke.ops], dtype=int)
+        is_arc = np.array([type(op) == ArcOperator for op in self.ops], dtype=bool)
+        self.line_ids = np.nonzero(~is_arc)[0]
+        self.arc_ids = np.nonzero(is_arc)[0]
+        self.starts = np.array([self.ops[i].start_position for i in self.line_ids], dtype=float).reshape(-1, 2)
+        self.ends = np.array([self.ops[i].end_position for i in self.line_ids], dtype=float).reshape(-1, 2)
+        self.arcs = ArcArray.from_arcs([self.ops[i].arc for i in self.arc_ids])
+        self.clockwise = np.array([self.ops[i].clockwise for i in self.arc_ids], dtype=bool)
+
+    def to_gcode(self, line_intervals, arc_intervals):
+        """Emit the kept (index, t0, t1) intervals of the lines and arcs as a program.
+
+        Arc intervals are fractions of the counter clockwise sweep, like clip_arc_intervals returns.
+        Pen-up travel is rebuilt between the kept pieces like optimize_gcode.
+        """
+        line_index, line_t0, line_t1 = line_intervals
+        arc_index, arc_u0, arc_u1 = arc_intervals
+        # Clockwise ops run through their counter clockwise arc backwards.
+        clockwise = self.clockwise[arc_index]
+        arc_t0 = np.where(clockwise, 1.0 - arc_u1, arc_u0)
+        arc_t1 = np.where(clockwise, 1.0 - arc_u0, arc_u1)
+
+        index = np.concatenate([self.line_ids[line_index], self.arc_ids[arc_index]])
+        t0 = np.concatenate([line_t0, arc_t0])
+        t1 = np.concatenate([line_t1, arc_t1])
+        order = np.lexsort([t0, index])
+        index, t0, t1 = index[order], t0[order], t1[order]
+        continues = _get_continuations(index, t0, t1, self.stroke_ids)
+
+        def get_point(op, t):
+            if type(op) == ArcOperator:
+                arc = op.arc
+                u = 1.0 - t if op.clockwise else t
+                theta = arc.radian_range.start_theta + u * arc.radian_range.get_width()
+                return arc.center_position + arc.radius * np.array([np.cos(theta), np.sin(theta)])
+            start_position = np.asarray(op.start_position, dtype=float)
+            return start_position + t * (np.asarray(op.end_position, dtype=float) - start_position)
+
+        output = []
+        for i, op_t0, op_t1, continued in zip(index.tolist(), t0.tolist(), t1.tolist(), continues.tolist()):
+            op = self.ops[i]
+            start_pt = op.start_position if op_t0 <= PARAMETER_EPSILON else get_point(op, op_t0)
+            end_pt = op.end_position if op_t1 >= 1.0 - PARAMETER_EPSILON else get_point(op, op_t1)
+            if not continued:
+                if len(output) != 0:
+                    output.append(GCode.pen_up())
+                output += [GCode.move_fast(start_pt), self.strokes[self.stroke_ids[i]].pen_down_command]
+            if type(op) == ArcOperator:
+                move_arc = GCode.move_arc_cw if op.clockwise else GCode.move_arc
+                output.append(move_arc(start_pt, end_pt, op.arc.center_position, feed_rate=op.rate_eu))
+            else:
+                output.append(GCode.move_linear(end_pt, feed_rate=op.rate_eu))
+        if len(output) != 0:
+            output = [GCode.pen_up()] + output + [GCode.pen_up()]
+        return output
+
+
+def clip_gcode(commands, mask, invert=False):
+    """Clip the pen-down strokes of a program to a mask, dropping pen-up travel like optimize_gcode."""
+    sections = split_pauses(commands)
+    if len(sections) > 1:
+        return join_pauses([clip_gcode(section, mask, invert=invert) for section in sections])
+    primitives = GCodePrimitives(commands)
+    return primitives.to_gcode(
+        clip_segment_intervals(primitives.starts, primitives.ends, mask, invert=invert),
+        clip_arc_intervals(primitives.arcs, mask, invert=invert),
+    )
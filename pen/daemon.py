@@ -0,0 +1,424 @@
+import itertools
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from . import eleksdraw
+from . import plotter
+from .gcodewords import GCode
+from .grbl import GRBL
+
+# One daemon per plotter, the socket path is its address. Without a per-user runtime directory the
+# socket goes in /tmp under a per-user name.
+if 'XDG_RUNTIME_DIR' in os.environ:
+    DEFAULT_DAEMON_SOCKET = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'robopen.sock')
+else:
+    DEFAULT_DAEMON_SOCKET = os.path.join('/tmp', 'robopen-{}.sock'.format(os.getuid()))
+PROGRESS_INTERVAL = 0.1
+# Lines a client sends per job message, so neither side holds a whole program.
+JOB_CHUNK_LINES = 4096
+
+
+class JobCancelled(RuntimeError):
+    pass
+
+
+class DeviceDaemon:
+    """Own one plotter connection, initialized once, and run commands and jobs for many clients.
+
+    Opening the serial port resets the Arduino, so a process per command pays for the reset and the
+    GRBL setup every time. Commands and jobs take turns on the device under a lock, while real-time
+    commands and cancelling a job go straight through.
+    """
+    def __init__(self, port):
+        self.port = port
+        self.device = None
+        self.lock = threading.Lock()
+        self.cancel_requested = threading.Event()
+        self.resume_requested = threading.Event()
+        self.job = None
+        self.paused = False
+
+    def start(self):
+        self.device = eleksdraw.EleksDrawDevice(serial_port=self.port)
+        self.device.start()
+        plotter.start_device(self.device)
+
+    def stop(self):
+        if self.device is not None:
+            self.device.stop()
+            self.device = None
+
+    def run_commands(self, commands, wait=True):
+        with self.lock:
+            for command in commands:
+                self.device.run_command(command)
+            if not wait:
+                return {}
+            plotter.wait_for_idle(self.device, interval=0.01)
+            return {'state': self.device.get_state().name}
+
+    def run_job(self, commands, on_progress=None, on_pause=None):
+        """Stream a program, calling on_progress(acked) every so often and once at the end.
+
+        At an M0 pause on_pause(index) is called and the job waits for resume or cancel. A job that
+        pauses without on_pause fails rather than drawing on with the wrong pen.
+        """
+        from . import streaming
+
+        with self.lock:
+            state = self.device.get_state()
+            if state != eleksdraw.State.IDLE:
+                raise RuntimeError('Device not ready to draw in state: {}'.format(state))
+            self.cancel_requested.clear()
+            program = streaming.ProgramWindow(commands, chunk_size=JOB_CHUNK_LINES)
+            streamer = streaming.GCodeStreamer(self.device, program)
+            self.job = streamer
+            last_progress_time = time.monotonic()
+
+            def on_ack(index):
+                nonlocal last_progress_time
+                if on_progress is not None and time.monotonic() - last_progress_time > PROGRESS_INTERVAL:
+                    last_progress_time = time.monotonic()
+                    on_progress(streamer.acked)
+                if self.cancel_requested.is_set():
+                    raise JobCancelled('Job cancelled')
+
+            def on_job_pause(index):
+                self.resume_requested.clear()
+                self.paused = True
+                try:
+                    on_pause(index)
+                    while not self.resume_requested.wait(PROGRESS_INTERVAL):
+                        if self.cancel_requested.is_set():
+                            raise JobCancelled('Job cancelled')
+                finally:
+                    self.paused = False
+
+            start_time = time.monotonic()
+            cancelled = False
+            try:
+                streamer.run(on_ack=on_ack, on_pause=on_job_pause if on_pause is not None else None)
+            except JobCancelled:
+                # Like an interrupted run_gcode: finish what GRBL already has, then lift the pen and go home.
+                cancelled = True
+                self.device.send_realtime(GRBL.cycle_start())
+                streamer.drain()
+                self.device.run_command(GCode.pen_up())
+                self.device.run_command(GCode.move_fast((0, 0)))
+            except Exception:
+                # A GRBL error or alarm, or a client gone mid-job, leaves lines in flight and maybe the pen
+                # down. Don't hand the device to the next client like that.
+                self.recover()
+                raise
+            finally:
+                self.job = None
+            plotter.wait_for_idle(self.device, interval=0.05)
+            if on_progress is not None:
+                on_progress(streamer.acked)
+            return {
+                'lines': program.get_line_count(),
+                'acked': streamer.acked,
+                'cancelled': cancelled,
+                'duration': time.monotonic() - start_time,
+                'state': self.device.get_state().name,
+            }
+
+    def recover(self):
+        """Get the device ready for the next client after a job failed part way through.
+
+        A soft reset throws away whatever GRBL still holds of the job, including a pause, and the
+        responses to the job's lines are dropped so none of them answers the next client's commands.
+        """
+        self.device.send_realtime(GRBL.soft_reset())
+        self.device.wait_for_reset()
+        if self.device.get_state() == eleksdraw.State.ALARM:
+            self.device.run_command(GRBL.unlock())
+        plotter.start_device(self.device)
+        self.device.run_command(GCode.pen_up())
+
+    def cancel(self):
+        self.cancel_requested.set()
+        return {'running': self.job is not None}
+
+    def resume(self):
+        """Carry on with a job paused for a pen change."""
+        self.resume_requested.set()
+        return {'resumed': self.paused}
+
+    def send_realtime(self, command):
+        self.device.send_realtime(command)
+        return {}
+
+    def get_status(self):
+        if not self.lock.acquire(blocking=False):
+            # Whoever holds the device owns its response stream, asking GRBL now would steal their
+            # acknowledgements. Report the job's progress instead.
+            job = self.job
+            job = None if job is None else {'lines': job.program.get_line_count(), 'acked': job.acked}
+            state = eleksdraw.State.HOLD if self.paused else eleksdraw.State.RUN
+            return {'state': state.name, 'position': None, 'planner_free': None, 'rx_free': None, 'job': job}
+        try:
+            status = self.device.get_status()
+        finally:
+            self.lock.release()
+        return {
+            'state': status.state.name,
+            'position': status.position,
+            'planner_free': status.planner_free,
+            'rx_free': status.rx_free,
+            'job': None,
+        }
+
+    def reset(self):
+        """Soft reset and set GRBL up again, e.g. after an alarm."""
+        with self.lock:
+            self.device.run_command(GRBL.soft_reset(), soft_error=True)
+            if self.device.get_state() == eleksdraw.State.ALARM:
+                self.device.run_command(GRBL.unlock())
+            plotter.start_device(self.device)
+            return {'state': self.device.get_state().name}
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """One JSON object per line each way: {"op": ..., ...} answered by {"ok": true, ...} or {"ok": false, "error": ...}.
+
+    A job pulls its program a chunk at a time: the daemon sends {"more": true} whenever streaming needs
+    more lines and the client answers {"commands": [...]}, an empty list ending the program. Jobs also
+    send {"progress": acked} lines before their answer, and {"paused": index} at a pen change, which
+    waits for a resume request.
+    """
+    def _send(self, data):
+        self.wfile.write((json.dumps(data) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def iter_job_commands(self):
+        while True:
+            self._send({'more': True})
+            line = self.rfile.readline()
+            if line == b'':
+                raise RuntimeError('Client closed the connection during a job')
+            commands = json.loads(line.decode('utf-8'))['commands']
+            if len(commands) == 0:
+                return
+            yield from commands
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b'':
+                continue
+            try:
+                response = self.dispatch(json.loads(line.decode('utf-8')))
+                response['ok'] = True
+            except (RuntimeError, ValueError, KeyError, OSError) as e:
+                response = {'ok': False, 'error': str(e)}
+            try:
+                self._send(response)
+            except OSError:
+                # The client is gone, e.g. it went away during a job.
+                return
+
+    def dispatch(self, request):
+        daemon = self.server.device_daemon
+        op = request['op']
+        if op == 'commands':
+            return daemon.run_commands(request['commands'], wait=request.get('wait', True))
+        elif op == 'job':
+            return daemon.run_job(
+                self.iter_job_commands(),
+                on_progress=lambda acked: self._send({'progress': acked}),
+                on_pause=lambda index: self._send({'paused': index}),
+            )
+        elif op == 'status':
+            return daemon.get_status()
+        elif op == 'realtime':
+            return daemon.send_realtime(request['command'])
+        elif op == 'cancel':
+            return daemon.cancel()
+        elif op == 'resume':
+            return daemon.resume()
+        elif op == 'reset':
+            return daemon.reset()
+        elif op == 'shutdown':
+            # shutdown waits for serve_forever to return, so it can't run on a request thread.
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return {}
+        raise RuntimeError('Unknown op: {}'.format(op))
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, daemon, path=DEFAULT_DAEMON_SOCKET):
+        if os.path.exists(path):
+            client = connect_daemon(path)
+            if client is not None:
+                client.close()
+                raise RuntimeError('A daemon is already running on {}'.format(path))
+            # Left behind by a daemon that didn't shut down cleanly.
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, DaemonRequestHandler)
+        self.device_daemon = daemon
+        self.path = path
+
+    def server_bind(self):
+        # Whoever can connect can drive the plotter, so only its owner may, from the moment it exists.
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class DaemonClient:
+    def __init__(self, sock, path):
+        self.sock = sock
+        self.path = path
+        self.reader = sock.makefile('rb')
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, request):
+        self.sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+
+    def receive(self, on_progress=None, on_pause=None, on_more=None):
+        unhandled_pause = None
+        while True:
+            line = self.reader.readline()
+            if line == b'':
+                raise RuntimeError('Daemon on {} closed the connection'.format(self.path))
+            response = json.loads(line.decode('utf-8'))
+            if 'more' in response:
+                self.send({'commands': on_more() if on_more is not None else []})
+                continue
+            if 'progress' in response:
+                if on_progress is not None:
+                    on_progress(response['progress'])
+                continue
+            if 'paused' in response:
+                if on_pause is not None:
+                    on_pause(response['paused'])
+                # This connection is busy with the job, so resume it on another one. Without anyone to
+                # change the pen, stop rather than draw on with the wrong one.
+                with connect_daemon(self.path) as client:
+                    if on_pause is not None:
+                        client.resume()
+                    else:
+                        unhandled_pause = response['paused']
+                        client.cancel()
+                continue
+            if not response.pop('ok'):
+                raise RuntimeError(response['error'])
+            if unhandled_pause is not None:
+                raise RuntimeError('Job paused at line {} with nothing to resume it and was cancelled'.format(unhandled_pause))
+            return response
+
+    def request(self, op, **kwargs):
+        kwargs['op'] = op
+        self.send(kwargs)
+        return self.receive()
+
+    def run_commands(self, commands, wait=True):
+        return self.request('commands', commands=list(commands), wait=wait)
+
+    def run_job(self, commands, on_progress=None, on_pause=None):
+        """Stream a program through the daemon, calling on_pause(index) at each pen change before resuming.
+
+        Commands are read and sent a chunk at a time as the daemon asks for them. Ctrl-C cancels the
+        job rather than leaving it running.
+        """
+        commands = iter(commands)
+
+        def on_more():
+            return list(itertools.islice(commands, JOB_CHUNK_LINES))
+
+        self.send({'op': 'job'})
+        try:
+            return self.receive(on_progress, on_pause, on_more)
+        except KeyboardInterrupt:
+            with connect_daemon(self.path) as client:
+                client.cancel()
+            return self.receive(on_progress, on_more=on_more)
+
+    def get_status(self):
+        return self.request('status')
+
+    def send_realtime(self, command):
+        return self.request('realtime', command=command)
+
+    def cancel(self):
+        return self.request('cancel')
+
+    def resume(self):
+        return self.request('resume')
+
+    def reset(self):
+        return self.request('reset')
+
+    def shutdown(self):
+        return self.request('shutdown')
+
+
+class DaemonDevice:
+    """The EleksDrawDevice calls a Jogger makes, sent through a daemon."""
+    def __init__(self, client):
+        self.client = client
+
+    def run_command(self, command):
+        return self.client.run_commands([command], wait=False)
+
+    def send_realtime(self, command):
+        self.client.send_realtime(command)
+
+    def get_status(self):
+        status = self.client.get_status()
+        return eleksdraw.Status(
+            eleksdraw.State[status['state']],
+            position=status['position'],
+            planner_free=status['planner_free'],
+            rx_free=status['rx_free'],
+        )
+
+    def get_state(self):
+        return self.get_status().state
+
+
+def connect_daemon(path=DEFAULT_DAEMON_SOCKET):
+    """A client of the daemon listening on path, or None when none is running."""
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        sock.close()
+        return None
+    return DaemonClient(sock, path)
+
+
+def serve_device(port, path=DEFAULT_DAEMON_SOCKET):
+    """Hold the device open and serve clients on path until shut down."""
+    daemon = DeviceDaemon(port)
+    server = DaemonServer(daemon, path)
+    try:
+        daemon.start()
+        server.serve_forever()
+    finally:
+        server.server_close()
+        daemon.stop()
@@ -0,0 +1,217 @@
+import numpy as np
+
+from .clipping import GCodePrimitives
+from .clipping import PARAMETER_EPSILON
+from .clipping import complement_intervals
+from .clipping import concatenate_intervals
+from .clipping import intervals_to_polylines
+from .defaults import DEFAULT_DEDUP_TOLERANCE
+from .gcode import RESOLUTION_EU
+from .gcode import join_pauses
+from .gcode import split_pauses
+from .mathscene import ArcArray
+from .mathscene import DISTANCE_EPSILON
+from .penviz import DrawArc
+from .penviz import DrawArcs
+from .penviz import DrawPath
+from .spatial import GridIndex
+from .spatial import get_segment_bounds
+
+def _get_repeats(keys):
+    """Rows whose key already appeared in an earlier row."""
+    _, first = np.unique(keys, axis=0, return_index=True)
+    repeated = np.ones(len(keys), dtype=bool)
+    repeated[first] = False
+    return np.nonzero(repeated)[0]
+
+
+def _get_whole_intervals(index):
+    return index, np.zeros(len(index)), np.ones(len(index))
+
+
+def _get_saved_distance(lengths, visible):
+    index, t0, t1 = visible
+    return float(lengths.sum() - np.sum((t1 - t0) * lengths[index]))
+
+
+def get_redundant_segment_intervals(starts, ends, tolerance=DEFAULT_DEDUP_TOLERANCE):
+    """Parameter intervals of each segment that an earlier segment already draws, as (index, t0, t1).
+
+    Segments equal forward or reversed at RESOLUTION_EU are matched by hashing. The rest are compared
+    with earlier segments found through a spatial index, a part is redundant when it runs along an
+    earlier segment within tolerance.
+    """
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    if len(starts) == 0:
+        return concatenate_intervals([])
+
+    # Order the quantized ends of each segment so a reversed copy hashes the same.
+    q_starts = np.round(starts / RESOLUTION_EU).astype(np.int64)
+    q_ends = np.round(ends / RESOLUTION_EU).astype(np.int64)
+    swap = (q_starts[:, 0] > q_ends[:, 0]) | ((q_starts[:, 0] == q_ends[:, 0]) & (q_starts[:, 1] > q_ends[:, 1]))
+    keys = np.concatenate([
+        np.where(swap[:, None], q_ends, q_starts),
+        np.where(swap[:, None], q_starts, q_ends),
+    ], axis=1)
+    repeats = _get_repeats(keys)
+
+    ids = np.setdiff1d(np.arange(len(starts)), repeats)
+    starts, ends = starts[ids], ends[ids]
+    bounds = get_segment_bounds(starts, ends) + np.array([-tolerance, tolerance, -tolerance, tolerance])
+    later, earlier = GridIndex.from_segments(starts, ends).query_boxes(bounds)
+    keep = earlier < later
+    later, earlier = later[keep], earlier[keep]
+
+    deltas = ends[earlier] - starts[earlier]
+    lengths_squared = np.sum(deltas * deltas, axis=1)
+    keep = lengths_squared > RESOLUTION_EU ** 2
+    later, earlier, deltas, lengths_squared = later[keep], earlier[keep], deltas[keep], lengths_squared[keep]
+    start_offsets = starts[later] - starts[earlier]
+    end_offsets = ends[later] - starts[earlier]
+
+    # Both ends of the later segment must sit within tolerance of the earlier segment's line.
+    normals = np.stack([-deltas[:, 1], deltas[:, 0]], axis=1) / np.sqrt(lengths_squared)[:, None]
+    near = (
+        (np.abs(np.sum(start_offsets * normals, axis=1)) <= tolerance) &
+        (np.abs(np.sum(end_offsets * normals, axis=1)) <= tolerance)
+    )
+    # Where the later segment's ends fall along the earlier one, which spans [0, 1].
+    a = np.sum(start_offsets * deltas, axis=1) / lengths_squared
+    b = np.sum(end_offsets * deltas, axis=1) / lengths_squared
+    slope = b - a
+    moving = np.abs(slope) > PARAMETER_EPSILON
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_lo = np.where(moving, (0.0 - a) / slope, 0.0)
+        t_hi = np.where(moving, (1.0 - a) / slope, 1.0)
+    # A later segment that doesn't move along the earlier one is covered whole or not at all.
+    within = (a >= 0.0) & (a <= 1.0)
+    t0 = np.clip(np.where(moving, np.minimum(t_lo, t_hi), np.where(within, 0.0, 1.0)), 0.0, 1.0)
+    t1 = np.clip(np.where(moving, np.maximum(t_lo, t_hi), np.where(within, 1.0, 0.0)), 0.0, 1.0)
+    keep = near & (t1 - t0 > PARAMETER_EPSILON)
+
+    return concatenate_intervals([
+        _get_whole_intervals(repeats),
+        (ids[later[keep]], t0[keep], t1[keep]),
+    ])
+
+
+def get_redundant_arc_intervals(arcs, tolerance=DEFAULT_DEDUP_TOLERANCE):
+    """Fractions of the sweep of each arc in an ArcArray that an earlier arc already draws, as (index, u0, u1).
+
+    Arcs equal at RESOLUTION_EU are matched by hashing. The rest are compared with earlier arcs on the
+    same circle within tolerance, found through a spatial index over the centers.
+    """
+    if len(arcs) == 0:
+        return concatenate_intervals([])
+    circles = arcs.widths >= 2.0 * np.pi - DISTANCE_EPSILON
+    # Where a full circle starts doesn't matter.
+    ends = np.where(circles[:, None], 0.0, np.concatenate([arcs.get_start_points(), arcs.get_end_points()], axis=1))
+    keys = np.round(np.concatenate([arcs.centers, arcs.radii[:, None], ends], axis=1) / RESOLUTION_EU).astype(np.int64)
+    repeats = _get_repeats(keys)
+
+    ids = np.setdiff1d(np.arange(len(arcs)), repeats)
+    centers = arcs.centers[ids]
+    later, earlier = GridIndex.from_points(centers).query_radius_pairs(centers, tolerance)
+    keep = (earlier < later) & (np.abs(arcs.radii[ids[later]] - arcs.radii[ids[earlier]]) <= tolerance)
+    later, earlier = ids[later[keep]], ids[earlier[keep]]
+
+    # The earlier sweep measured from the later arc's start, once around and once wrapped back.
+    offsets = np.mod(arcs.start_thetas[earlier] - arcs.start_thetas[later], 2.0 * np.pi)
+    results = [_get_whole_intervals(repeats)]
+    for shift in [0.0, -2.0 * np.pi]:
+        u0 = np.clip((offsets + shift) / arcs.widths[later], 0.0, 1.0)
+        u1 = np.clip((offsets + shift + arcs.widths[earlier]) / arcs.widths[later], 0.0, 1.0)
+        keep = u1 - u0 > PARAMETER_EPSILON
+        results.append((later[keep], u0[keep], u1[keep]))
+    return concatenate_intervals(results)
+
+
+def dedup_penviz(viz, tolerance=DEFAULT_DEDUP_TOLERANCE):
+    """Return a new PenViz without strokes that retrace earlier ones, and the pen down distance saved.
+
+    The first drawable to cover a stretch keeps it, drawables stay in their original order. Layers
+    are drawn with different pens, so only strokes on the same layer retrace each other.
+    """
+    layers = viz.get_layers()
+    if len(layers) > 1:
+        results = [dedup_penviz(viz.get_layer(layer), tolerance=tolerance) for layer in layers]
+        deduped = viz.with_drawables([drawable for layer_viz, _ in results for drawable in layer_viz.drawables])
+        return deduped, sum(saved for _, saved in results)
+
+    starts, ends, segment_groups, group_drawables = [], [], [], []
+    arcs, arc_drawables = [], []
+    for drawable_index, drawable in enumerate(viz.drawables):
+        if type(drawable) == DrawPath:
+            points = np.asarray(drawable.path.points, dtype=float).reshape(-1, 2)
+            starts.append(points[:-1])
+            ends.append(points[1:])
+            segment_groups.append(np.full(len(points) - 1, len(group_drawables)))
+            group_drawables.append(drawable_index)
+        elif type(drawable) == DrawArc:
+            arcs.append(ArcArray.from_arcs([drawable.arc]))
+            arc_drawables.append([drawable_index])
+        elif type(drawable) == DrawArcs:
+            arcs.append(drawable.arcs)
+            arc_drawables.append(np.full(len(drawable.arcs), drawable_index))
+        else:
+            raise NotImplementedError('Unsupported drawable for dedup: {}'.format(type(drawable).__name__))
+
+    output = [[] for _ in viz.drawables]
+    saved = 0.0
+
+    if len(starts) != 0:
+        starts = np.concatenate(starts)
+        ends = np.concatenate(ends)
+        segment_groups = np.concatenate(segment_groups)
+        index, t0, t1 = complement_intervals(len(starts), *get_redundant_segment_intervals(starts, ends, tolerance))
+        saved += _get_saved_distance(np.hypot(*(ends - starts).T), (index, t0, t1))
+        points, offsets, groups = intervals_to_polylines(starts, ends, index, t0, t1, segment_groups)
+        for start, end, group in zip(offsets[:-1], offsets[1:], groups):
+            output[group_drawables[group]].append(DrawPath(points[start:end]))
+
+    if len(arcs) != 0:
+        arcs = ArcArray(
+            centers=np.concatenate([a.centers for a in arcs]),
+            radii=np.concatenate([a.radii for a in arcs]),
+            start_thetas=np.concatenate([a.start_thetas for a in arcs]),
+            widths=np.concatenate([a.widths for a in arcs]),
+        )
+        arc_drawables = np.concatenate(arc_drawables).astype(int)
+        index, u0, u1 = complement_intervals(len(arcs), *get_redundant_arc_intervals(arcs, tolerance))
+        saved += _get_saved_distance(arcs.get_lengths(), (index, u0, u1))
+        for drawable_index in np.unique(arc_drawables[index]):
+            pieces = arc_drawables[index] == drawable_index
+            output[drawable_index].append(DrawArcs(ArcArray(
+                centers=arcs.centers[index[pieces]],
+                radii=arcs.radii[index[pieces]],
+                start_thetas=arcs.start_thetas[index[pieces]] + u0[pieces] * arcs.widths[index[pieces]],
+                widths=(u1[pieces] - u0[pieces]) * arcs.widths[index[pieces]],
+            )))
+
+    for drawable, pieces in zip(viz.drawables, output):
+        for piece in pieces:
+            piece.layer = drawable.layer
+    deduped = viz.with_drawables([drawable for drawables in output for drawable in drawables])
+    return deduped, saved
+
+
+def dedup_gcode(commands, tolerance=DEFAULT_DEDUP_TOLERANCE):
+    """Drop pen-down moves that retrace earlier ones, returning the program and the distance saved.
+
+    Layers between pauses are drawn with different pens, so they are deduplicated separately.
+    """
+    sections = split_pauses(commands)
+    if len(sections) > 1:
+        results = [dedup_gcode(section, tolerance=tolerance) for section in sections]
+        return join_pauses([section for section, _ in results]), sum(saved for _, saved in results)
+    primitives = GCodePrimitives(commands)
+    line_visible = complement_intervals(
+        len(primitives.starts), *get_redundant_segment_intervals(primitives.starts, primitives.ends, tolerance))
+    arc_visible = complement_intervals(
+        len(primitives.arcs), *get_redundant_arc_intervals(primitives.arcs, tolerance))
+    saved = (
+        _get_saved_distance(np.hypot(*(primitives.ends - primitives.starts).T), line_visible) +
+        _get_saved_distance(primitives.arcs.get_lengths(), arc_visible)
+    )
+    return primitives.to_gcode(line_visible, arc_visible), saved
@@ -0,0 +1,12 @@
+# Tunables shared by the library and the command line. Kept free of numpy and other heavy imports
+# so robopen.py can show them as argument defaults without loading the modules that use them.
+
+# Strokes closer than this land on top of each other, well under a pen stroke width.
+DEFAULT_DEDUP_TOLERANCE = 0.05
+
+DEFAULT_SIMPLIFY_TOLERANCE = 0.01
+DEFAULT_JOIN_TOLERANCE = 0.01
+
+DEFAULT_HATCH_ANGLE = 45.0
+
+DEFAULT_API_PORT = 8765
@@ -1,10 +1,21 @@
+import re
 import serial
 import time
 import enum
 from contextlib import contextmanager
 
+from .grbl import GRBL
+from .grbl import GRBL_PLANNER_BLOCKS
+from .grbl import GRBL_RX_BUFFER_SIZE
+
 DEFAULT_SERIAL_PORT = '/dev/ttyUSB0'
 DEFAULT_BAUD_RATE = 115200
+# GRBL prints its banner well within this after a soft reset.
+RESET_TIMEOUT = 5.0
+
+# Lets tests and benchmarks open simulated devices such as 'fakegrbl://name'.
+if 'pen' not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append('pen')
 
 # TODO(emmett): Get real boundaries
 # TODO(emmett): eleksdraw units to mm
@@ -36,13 +47,58 @@ STATE_MAP = {
 }
 
 
+class Status:
+    """A parsed GRBL status report, e.g. '<Run|MPos:1.000,2.000,0.000|Bf:12,100>'."""
+    def __init__(self, state, position=None, planner_free=None, rx_free=None):
+        self.state = state
+        self.position = position
+        self.planner_free = planner_free
+        self.rx_free = rx_free
+
+    def get_planner_fill(self):
+        if self.planner_free is None:
+            return None
+        return 1.0 - self.planner_free / float(GRBL_PLANNER_BLOCKS)
+
+    @classmethod
+    def parse(cls, status_str):
+        status_str = status_str.strip().strip('<>')
+        # GRBL 0.9 separates fields with ',' and GRBL 1.1 with '|'
+        full_state = re.split('[,|]', status_str)[0]
+        # Extract our state removing any substate info
+        state = full_state.partition(':')[0].lower()
+        if state not in STATE_MAP:
+            raise RuntimeError('Invalid state: {}'.format(state))
+
+        fields = {}
+        for key, value in re.findall(r'([A-Za-z]+):([-0-9.,]+)', status_str):
+            fields[key] = [float(v) for v in value.strip(',').split(',')]
+
+        position = None
+        if 'MPos' in fields:
+            position = fields['MPos'][:2]
+
+        planner_free = None
+        rx_free = None
+        if 'Bf' in fields:
+            planner_free, rx_free = [int(v) for v in fields['Bf']]
+        else:
+            # GRBL 0.9 reports how much of each buffer is in use.
+            if 'Buf' in fields:
+                planner_free = GRBL_PLANNER_BLOCKS - int(fields['Buf'][0])
+            if 'RX' in fields:
+                rx_free = GRBL_RX_BUFFER_SIZE - int(fields['RX'][0])
+
+        return cls(STATE_MAP[state], position=position, planner_free=planner_free, rx_free=rx_free)
+
+
 class EleksDrawDevice:
     def __init__(self, serial_port=DEFAULT_SERIAL_PORT):
         self.serial = None
         self.serial_port = serial_port
 
     def start(self):
-        self.serial = serial.Serial(self.serial_port, baudrate=DEFAULT_BAUD_RATE)
+        self.serial = serial.serial_for_url(self.serial_port, baudrate=DEFAULT_BAUD_RATE)
 
     def stop(self):
         self.serial.close()
@@ -70,20 +126,51 @@ class EleksDrawDevice:
                 has_response = True
                 if not soft_error:
                     raise RuntimeError(response[0])
+            elif b'ALARM' in buffer:
+                # An alarm resets GRBL and flushes its RX buffer, so this line will never be acknowledged.
+                has_response = True
+                if not soft_error:
+                    raise RuntimeError([line for line in response if line.startswith('ALARM')][0])
             elif command == '':
                 return response
 
         return response
 
+    def send_realtime(self, command):
+        # Real-time commands are single bytes, some above 0x7f, and are never acknowledged.
+        self.serial.write(command.encode('latin-1'))
+
+    def get_status(self):
+        # '?' is a real-time command, answered with a report and never an 'ok'. Sent on its own, it
+        # works even while GRBL is not reading lines, such as during a jog cancel.
+        self.send_realtime(GRBL.query_state())
+        buffer = b''
+        while True:
+            if self.serial.in_waiting == 0:
+                time.sleep(0.01)
+                continue
+            buffer += self.serial.read(self.serial.in_waiting)
+            for line in buffer.decode('utf-8').split('\r\n')[:-1]:
+                if line.startswith('<'):
+                    return Status.parse(line)
+
     def get_state(self):
-        status_str, _ = self.run_command('?')
-        status = status_str.strip('<>').split(',')
-        full_state = status[0]
-        # Extract our state removing any substate info
-        state = full_state.partition(':')[0].lower()
-        if state not in STATE_MAP:
-            raise RuntimeError('Invalid state: {}'.format(state))
-        return STATE_MAP[state]
+        return self.get_status().state
+
+    def wait_for_reset(self, timeout=RESET_TIMEOUT):
+        """Read up to GRBL's banner after a soft reset, dropping the responses before it, such as
+        the 'ok's of lines the reset threw away.
+        """
+        buffer = b''
+        deadline = time.monotonic() + timeout
+        while re.search(rb'Grbl[^\r\n]*\r\n', buffer) is None:
+            if time.monotonic() > deadline:
+                raise RuntimeError('No banner from GRBL after a soft reset')
+            if self.serial.in_waiting == 0:
+                time.sleep(0.01)
+                continue
+            buffer += self.serial.read(self.serial.in_waiting)
+        self.serial.reset_input_buffer()
 
 
 @contextmanager
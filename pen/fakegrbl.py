@@ -0,0 +1,339 @@
+import collections
+import threading
+import time
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import numpy as np
+import serial
+
+from .gcode import DEFAULT_MOVE_RATE
+from .gcode import NGC_WORD_RE
+from .gcode import GCodeState
+from .gcode import get_motion_mode
+from .gcode import parse_ngc_words
+from .gcodewords import is_pause_words
+from .grbl import GRBL_PLANNER_BLOCKS as PLANNER_BLOCKS
+from .grbl import GRBL_RX_BUFFER_SIZE as RX_BUFFER_SIZE
+
+VERSION_BANNER = "Grbl 1.1f ['$' for help]"
+
+SUPPORTED_G = {0, 1, 2, 3, 4, 20, 21, 28, 90, 91}
+SUPPORTED_M = {0, 2, 3, 5}
+# G words a $J= jog may carry.
+JOG_G = {20, 21, 90, 91}
+# Seconds a cancelled jog takes to stop, before time_scale, standing in for GRBL's deceleration.
+JOG_CANCEL_DURATION = 0.01
+
+
+class FakeGRBL:
+    """Simulate the serial protocol of a GRBL 1.1 controller for tests and benchmarks.
+
+    Lines are buffered in a 128 byte RX buffer and acknowledged once they fit in a 15 block planner.
+    With time_scale=0 motion completes instantly, otherwise blocks take their estimated duration
+    multiplied by time_scale.
+    """
+    def __init__(self, time_scale=0.0):
+        self.time_scale = time_scale
+        self.lock = threading.RLock()
+        self.reset()
+        self.lines = []
+        self.realtime = []
+        self.overflowed = False
+
+    def reset(self):
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.gcode_state = GCodeState()
+        self.position = self.gcode_state.position
+        self.planner = collections.deque()
+        self.block_start_time = None
+        self.jog_cancel_time = None
+        self.pause_pending = False
+        self.hold = False
+        self.alarm = False
+        self.feed_override = 100
+        self.rapid_override = 100
+
+    def get_state_name(self):
+        self._update()
+        if self.alarm:
+            return 'Alarm'
+        if self.hold:
+            return 'Hold'
+        if self.jog_cancel_time is not None:
+            return 'Jog'
+        if len(self.planner) != 0:
+            return 'Jog' if self.planner[0][2] else 'Run'
+        return 'Idle'
+
+    def get_status_report(self):
+        state = self.get_state_name()
+        x, y = self.position
+        return '<{}|MPos:{:.3f},{:.3f},0.000|Bf:{},{}|FS:{},0|Ov:{},{},100>'.format(
+            state,
+            x,
+            y,
+            PLANNER_BLOCKS - len(self.planner),
+            RX_BUFFER_SIZE - len(self.rx),
+            int(self.gcode_state.feed_rate),
+            self.feed_override,
+            self.rapid_override,
+        )
+
+    def trigger_alarm(self, code=1):
+        """Simulate a hard limit or similar, which flushes all queued motion."""
+        with self.lock:
+            self.alarm = True
+            self.planner.clear()
+            self.jog_cancel_time = None
+            self.pause_pending = False
+            self.rx = bytearray()
+            self._respond('ALARM:{}'.format(code))
+
+    def write(self, data):
+        with self.lock:
+            for byte in bytes(data):
+                if self._handle_realtime(byte):
+                    continue
+                if len(self.rx) >= RX_BUFFER_SIZE:
+                    # Real hardware silently drops the byte, which corrupts the stream.
+                    self.overflowed = True
+                    continue
+                self.rx.append(byte)
+            self._process_lines()
+
+    def read(self, size):
+        with self.lock:
+            self._update()
+            data = bytes(self.tx[:size])
+            del self.tx[:size]
+            return data
+
+    def in_waiting(self):
+        with self.lock:
+            self._update()
+            return len(self.tx)
+
+    def _respond(self, line):
+        self.tx += (line + '\r\n').encode('utf-8')
+
+    def _handle_realtime(self, byte):
+        if byte == 0x18:
+            self.realtime.append(byte)
+            self.reset()
+            self._respond('')
+            self._respond(VERSION_BANNER)
+        elif byte == ord('?'):
+            self._respond(self.get_status_report())
+        elif byte == ord('!'):
+            self.realtime.append(byte)
+            self._update()
+            self.hold = True
+        elif byte == ord('~'):
+            self.realtime.append(byte)
+            self._update()
+            self.hold = False
+            if self.pause_pending:
+                # The cycle start completes the M0, which is only now acknowledged.
+                self.pause_pending = False
+                self._respond('ok')
+                self._process_lines()
+        elif byte >= 0x80:
+            self.realtime.append(byte)
+            self._update()
+            if byte == 0x85:
+                self._cancel_jog()
+            elif byte == 0x90:
+                self.feed_override = 100
+            elif byte in (0x91, 0x92, 0x93, 0x94):
+                step = {0x91: 10, 0x92: -10, 0x93: 1, 0x94: -1}[byte]
+                self.feed_override = max(10, min(200, self.feed_override + step))
+            elif byte in (0x95, 0x96, 0x97):
+                self.rapid_override = {0x95: 100, 0x96: 50, 0x97: 25}[byte]
+        else:
+            return False
+        return True
+
+    def _cancel_jog(self):
+        if len(self.planner) == 0 or not self.planner[0][2]:
+            return
+        # Stop where the jog in progress has got to.
+        duration, end_position, _ = self.planner[0]
+        fraction = 1.0
+        if duration > 0.0 and self.block_start_time is not None:
+            fraction = min(1.0, (time.monotonic() - self.block_start_time) / duration)
+        self.position = self.position + fraction * (end_position - self.position)
+        self.gcode_state.position = self.position
+        self.planner.clear()
+        self.block_start_time = None
+        # GRBL stays in Jog while it decelerates, then flushes its whole RX buffer. Lines sent in the
+        # meantime are lost without a response.
+        self.jog_cancel_time = time.monotonic() + JOG_CANCEL_DURATION * self.time_scale
+
+    def _update(self):
+        if self.jog_cancel_time is not None and time.monotonic() >= self.jog_cancel_time:
+            self.jog_cancel_time = None
+            self.rx = bytearray()
+        # Retire planner blocks whose simulated motion has completed.
+        while len(self.planner) != 0 and not self.hold:
+            duration, position, _ = self.planner[0]
+            now = time.monotonic()
+            if self.block_start_time is None:
+                self.block_start_time = now
+            if now - self.block_start_time < duration:
+                break
+            self.planner.popleft()
+            self.position = position
+            self.block_start_time = self.block_start_time + duration if len(self.planner) != 0 else None
+        self._process_lines()
+
+    def _process_lines(self):
+        if self.jog_cancel_time is not None or self.pause_pending:
+            return
+        while b'\n' in self.rx:
+            index = self.rx.index(b'\n')
+            line = self.rx[:index].decode('utf-8').strip()
+            words = parse_ngc_words(line)
+            # Axis words without a G word move in the current motion mode.
+            motion_mode = get_motion_mode(words)
+            if motion_mode is None:
+                motion_mode = self.gcode_state.motion_mode
+            is_motion = motion_mode in (0, 1, 2, 3) and ('X' in words or 'Y' in words)
+            is_motion = is_motion or line.startswith('$J=')
+            if is_motion and len(self.planner) >= PLANNER_BLOCKS:
+                # GRBL stops reading the RX buffer until the planner has room.
+                break
+            if is_pause_words(words) and len(self.planner) != 0:
+                # M0 waits for the motion before it to finish.
+                break
+            del self.rx[:index + 1]
+            self.lines.append(line)
+            response = self._execute(line, words)
+            if response == 'ok' and is_pause_words(words):
+                # Program pause: GRBL holds inside M0 and reads nothing more until a cycle start.
+                self.hold = True
+                self.pause_pending = True
+                return
+            self._respond(response)
+
+    def _execute(self, line, words):
+        if line == '':
+            return 'ok'
+        if line.startswith('$J='):
+            return self._jog(line)
+        if line.startswith('$'):
+            if line == '$X':
+                self.alarm = False
+            elif line == '$$':
+                self._respond('$10=255')
+            return 'ok'
+        if self.alarm:
+            return 'error:9'
+        if any(g not in SUPPORTED_G for g in words.get('G', [])):
+            return 'error:20'
+        if 'M' in words and int(words['M']) not in SUPPORTED_M:
+            return 'error:20'
+        if len(words) == 0:
+            return 'error:1'
+        distance = self.gcode_state.handle_command(line)
+        if distance > 0.0:
+            self._plan(distance)
+        return 'ok'
+
+    def _jog(self, line):
+        if self.alarm:
+            return 'error:9'
+        words = {}
+        g_words = set()
+        for letter, value in NGC_WORD_RE.findall(line[3:].upper()):
+            if letter == 'G':
+                g_words.add(int(float(value)))
+            else:
+                words[letter] = float(value)
+        if not g_words <= JOG_G or not set(words) <= {'X', 'Y', 'F'} or 'X' not in words and 'Y' not in words:
+            return 'error:16'
+        if 'F' not in words:
+            return 'error:22'
+        start_position = self.gcode_state.position
+        if 91 in g_words:
+            end_position = start_position + np.array([words.get('X', 0.0), words.get('Y', 0.0)])
+        else:
+            end_position = np.array([words.get('X', start_position[0]), words.get('Y', start_position[1])])
+        # Only the position changes, the modal motion mode and feed rate are left as they were.
+        self.gcode_state.position = end_position
+        distance = float(np.hypot(*(end_position - start_position)))
+        if distance > 0.0:
+            self._plan(distance, rate=words['F'], jog=True)
+        return 'ok'
+
+    def _plan(self, distance, rate=None, jog=False):
+        if self.time_scale == 0.0:
+            self.position = self.gcode_state.position
+            return
+        if rate is None and self.gcode_state.motion_mode == 0:
+            rate = DEFAULT_MOVE_RATE * self.rapid_override / 100.0
+        elif rate is None:
+            rate = self.gcode_state.feed_rate * self.feed_override / 100.0
+        duration = self.time_scale * distance / (rate / 60.0)
+        self.planner.append((duration, self.gcode_state.position, jog))
+
+
+FAKE_DEVICES = {}
+
+
+def get_fake_grbl(name, time_scale=0.0):
+    """Return the simulated device for a name, so reopening a port talks to the same machine."""
+    if name not in FAKE_DEVICES:
+        FAKE_DEVICES[name] = FakeGRBL(time_scale=time_scale)
+    return FAKE_DEVICES[name]
+
+
+class FakeGRBLSerial(serial.SerialBase):
+    """pyserial backend for 'fakegrbl://<name>?time_scale=<scale>' urls."""
+    def open(self):
+        if self._port is None:
+            raise serial.SerialException('Port must be configured before it can be used.')
+        if self.is_open:
+            raise serial.SerialException('Port is already open.')
+        url = urlparse(self._port)
+        options = parse_qs(url.query)
+        time_scale = float(options.get('time_scale', ['0'])[0])
+        self.grbl = get_fake_grbl(url.netloc, time_scale=time_scale)
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def _reconfigure_port(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        return self.grbl.in_waiting()
+
+    def read(self, size=1):
+        data = bytearray()
+        start_time = time.monotonic()
+        while len(data) < size:
+            data += self.grbl.read(size - len(data))
+            if len(data) >= size:
+                break
+            if self._timeout is not None and time.monotonic() - start_time >= self._timeout:
+                break
+            time.sleep(0.001)
+        return bytes(data)
+
+    def write(self, data):
+        self.grbl.write(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self.grbl.lock:
+            self.grbl.tx = bytearray()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
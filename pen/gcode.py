@@ -1,81 +1,26 @@
-import re
 import enum
 
 import numpy as np
 
+from .gcodewords import DEFAULT_FEED_RATE
+from .gcodewords import DEFAULT_MOVE_RATE
+from .gcodewords import MOVE_RATE_SCALE
+from .gcodewords import NGC_WORD_RE  # noqa: F401
+from .gcodewords import RESOLUTION_EU
+from .gcodewords import GCode
+from .gcodewords import is_pause_words
+from .gcodewords import parse_ngc_words
 from .mathscene import AABB
 from .mathscene import Arc
 from .mathscene import euclidian_distance
 
 
-DEFAULT_MOVE_RATE = 2000
-DEFAULT_FEED_RATE = 1000
-DEFAULT_SERVO_DOWN = 60
-
-RESOLUTION_EU = 1e-5
-
-
-class GCode:
-    @staticmethod
-    def set_units_mm():
-        return 'G21'
-
-    @staticmethod
-    def move_home():
-        return 'G28'
-
-    @staticmethod
-    def set_coordinates_absolute():
-        return 'G90'
-
-    @staticmethod
-    def set_coordinates_relative():
-        return 'G91'
-
-    @staticmethod
-    def set_feed_rate(rate):
-        return 'F{}'.format(rate)
-
-    @staticmethod
-    def move_fast(end_pt):
-        x, y = end_pt
-        return 'G0X{}Y{}'.format(x, y)
-
-    @staticmethod
-    def move_linear(end_pt, feed_rate=DEFAULT_FEED_RATE):
-        x, y = end_pt
-        return 'G1X{}Y{}F{}'.format(x, y, feed_rate)
-
-    @staticmethod
-    def move_arc(start_pt, end_pt, center_pt, feed_rate=DEFAULT_FEED_RATE):
-        x, y = end_pt
-        # Relative arc distance mode to the start
-        i, j = np.array(center_pt) - np.array(start_pt)
-        return 'G3X{}Y{}I{}J{}F{}'.format(x, y, i, j, feed_rate)
-
-    @staticmethod
-    def pen_up():
-        return 'M5'
-
-    @staticmethod
-    def pen_down(servo=DEFAULT_SERVO_DOWN):
-        # Lazer power is S0
-        # TODO(remap pressure)
-        return 'M3S{}'.format(servo)
-
-    @staticmethod
-    def is_pen_down_command(gcode):
-        return gcode.lower().strip().startswith('m3')
-
-    @staticmethod
-    def dwell_milliseconds(milliseconds):
-        # Unknown support?
-        return 'G4 P{}'.format(milliseconds)
-
-    @staticmethod
-    def dwell_seconds(seconds):
-        # Unknown support?
-        return 'G4 S{}'.format(seconds)
+def get_motion_mode(words):
+    """The motion mode a line's G words set, or None."""
+    for g in reversed(words.get('G', [])):
+        if g in MOTION_MODES:
+            return g
+    return None
 
 
 class NGCParser:
@@ -88,31 +33,77 @@ class NGCParser:
     def __init__(self):
         self.state = self.WAIT_FOR_PATH
         self.commands = []
+        self.position = np.array([0.0, 0.0])
+        self.feed_rate = DEFAULT_FEED_RATE
+        self.motion_mode = None
 
     def handle_line(self, line):
+        for command in self.translate_line(line):
+            self.add_command(command)
+
+    def translate_line(self, line):
+        words = parse_ngc_words(line)
+        is_move = 'X' in words or 'Y' in words
+        if 'F' in words:
+            self.feed_rate = int(words['F'])
+        g = get_motion_mode(words)
+        if g is not None:
+            self.motion_mode = g
+        elif is_move or 'Z' in words:
+            # Axis words without a motion word continue the last motion mode.
+            g = self.motion_mode
+        if g is None:
+            return
+
         if self.state == self.WAIT_FOR_PATH:
-            if line.startswith('G00 Z'):
-                self.add_command(GCode.pen_up())
+            if g == 0 and 'Z' in words and not is_move:
+                yield GCode.pen_up()
                 self.state = self.START_PATH
         elif self.state == self.START_PATH:
-            if line.startswith('G00 '):
-                self.add_command(line)
+            if g == 0 and is_move:
+                yield GCode.move_fast(self._update_position(words))
                 self.state = self.START_DRAW
         elif self.state == self.START_DRAW:
-            if line.startswith('G01 Z'):
-                self.add_command(GCode.pen_down())
+            if g == 1 and 'Z' in words and not is_move:
+                yield GCode.pen_down()
                 self.state = self.DRAWING
         elif self.state == self.DRAWING:
-            if line.startswith('G00 Z'):
-                self.add_command(GCode.pen_up())
-                self.state = self.WAIT_FOR_PATH
-            else:
-                self.add_command(line)
+            if g == 0 and 'Z' in words and not is_move:
+                yield GCode.pen_up()
+                # The pen is already up, so the next rapid move starts a path.
+                self.state = self.START_PATH
+            elif is_move:
+                yield self._normalize_move(g, words)
+
+    def _update_position(self, words):
+        self.position = np.array([words.get('X', self.position[0]), words.get('Y', self.position[1])])
+        return self.position
+
+    def _normalize_move(self, g, words):
+        start_pt = self.position
+        end_pt = self._update_position(words)
+        if g == 0:
+            return GCode.move_fast(end_pt)
+        if g == 1:
+            return GCode.move_linear(end_pt, feed_rate=self.feed_rate)
+        if g in (2, 3):
+            center_pt = start_pt + np.array([words.get('I', 0.0), words.get('J', 0.0)])
+            if g == 2:
+                return GCode.move_arc_cw(start_pt, end_pt, center_pt, feed_rate=self.feed_rate)
+            return GCode.move_arc(start_pt, end_pt, center_pt, feed_rate=self.feed_rate)
+        raise NotImplementedError('Unsupported NGC motion: G{}'.format(g))
 
     def add_command(self, command):
         self.commands.append(command)
 
 
+def translate_ngc(lines):
+    """Lazily translate inkscape NGC lines into plotter commands."""
+    parser = NGCParser()
+    for line in lines:
+        yield from parser.translate_line(line)
+
+
 class GCodeOperator:
     def get_pen_distance(self):
         raise NotImplementedError()
@@ -132,11 +123,10 @@ class GCodeOperator:
 
 class MoveOperator(GCodeOperator):
     def __init__(self, start_position, end_position, rate_eu):
-        # Compensate for something off with eu to mm?
-        magic_scale = 0.75
         self.start_position = np.array(start_position)
         self.end_position = np.array(end_position)
-        self.rate = rate_eu * magic_scale / 60.0
+        self.rate_eu = rate_eu
+        self.rate = rate_eu * MOVE_RATE_SCALE / 60.0
 
     def get_aabb(self):
         return AABB([self.start_position, self.end_position])
@@ -152,9 +142,16 @@ class MoveOperator(GCodeOperator):
 
 
 class ArcOperator(MoveOperator):
-    def __init__(self, start_position, end_position, relative_center, rate_eu):
+    def __init__(self, start_position, end_position, relative_center, rate_eu, clockwise=False):
         super(ArcOperator, self).__init__(start_position, end_position, rate_eu)
-        self.arc = Arc.from_relative_points(start_position, end_position, relative_center)
+        self.relative_center = np.array(relative_center)
+        self.clockwise = clockwise
+        if clockwise:
+            # A clockwise arc covers the same points as the counter clockwise arc from end to start.
+            center_position = self.start_position + np.array(relative_center)
+            self.arc = Arc.from_absolute_points(self.end_position, self.start_position, center_position)
+        else:
+            self.arc = Arc.from_relative_points(start_position, end_position, relative_center)
 
     def get_aabb(self):
         return self.arc.get_aabb()
@@ -163,6 +160,10 @@ class ArcOperator(MoveOperator):
         return self.arc.get_line_distance()
 
 
+# Seconds estimated for the servo to raise or lower the pen.
+PEN_MODE_DURATION = 0.1
+
+
 class PenMode(enum.Enum):
     PEN_UP = 0
     PEN_DOWN = 1
@@ -174,7 +175,7 @@ class PenOperator(GCodeOperator):
         self.pen_mode = pen_mode
 
     def get_duration(self):
-        return 0.1
+        return PEN_MODE_DURATION
 
     def get_pen_distance(self):
         return 0.0
@@ -189,70 +190,333 @@ class PenOperator(GCodeOperator):
         return self.pen_mode
 
 
-def parse_gcode(command, current_position):
-    m = re.search('([mg])([0-9]+)', command.lower())
-    if not m:
-        return
-    g_command = m.group(1)
-    command_type = g_command[0]
-    if command_type == 'm':
-        pen_type = int(m.group(2))
-        if pen_type == 3:
-            return PenOperator(current_position, PenMode.PEN_DOWN)
-        elif pen_type == 5:
-            return PenOperator(current_position, PenMode.PEN_UP)
+MOTION_MODES = (0, 1, 2, 3)
+# Words that only set up the machine, and move nothing.
+SETUP_MODES = (4, 20, 21, 90, 91)
+MM_PER_INCH = 25.4
+
+
+def get_rate(value):
+    # Keep whole feed rates as ints so they are written back without a decimal point.
+    return int(value) if value == int(value) else value
+
+
+class GCodeParser:
+    """Turn program lines into operators.
+
+    The motion mode, feed rate and position carry over between lines like on the machine, so lines
+    may leave out words that did not change. Relative (G91) moves and inch (G20) values are turned
+    into absolute mm positions.
+    """
+    def __init__(self, position=(0.0, 0.0)):
+        self.position = np.array(position, dtype=float)
+        self.motion_mode = None
+        self.feed_rate = DEFAULT_FEED_RATE
+        self.absolute = True
+        # mm per program unit, MM_PER_INCH after G20.
+        self.unit_scale = 1.0
+
+    def parse(self, command):
+        op = self.parse_words(parse_ngc_words(command), command)
+        if op is not None:
+            self.position = op.get_end_position()
+        return op
+
+    def parse_words(self, words, command=''):
+        g_words = words.get('G', [])
+        # Units and distance mode apply to the rest of the line, including its F word.
+        for gcode in g_words:
+            if gcode == 20 or gcode == 21:
+                self.unit_scale = MM_PER_INCH if gcode == 20 else 1.0
+            elif gcode == 90 or gcode == 91:
+                self.absolute = gcode == 90
+        if 'F' in words:
+            self.feed_rate = get_rate(words['F'] * self.unit_scale)
+        if is_pause_words(words):
+            # A pause for a pen change, it takes however long the change does.
+            return None
+        if 'M' in words:
+            pen_type = int(words['M'])
+            if pen_type == 3:
+                return PenOperator(self.position, PenMode.PEN_DOWN)
+            elif pen_type == 5:
+                return PenOperator(self.position, PenMode.PEN_UP)
+            else:
+                raise RuntimeError('Unsupported pen type: {}'.format(pen_type))
+        for gcode in g_words:
+            if gcode in MOTION_MODES:
+                self.motion_mode = gcode
+            elif gcode == 28:
+                return MoveOperator(self.position, [0.0, 0.0], rate_eu=DEFAULT_MOVE_RATE)
+            elif gcode not in SETUP_MODES:
+                raise NotImplementedError('Unsupported gcode type: {} in: {}'.format(gcode, command))
+        if 'X' not in words and 'Y' not in words:
+            return None
+        if self.motion_mode is None:
+            raise RuntimeError('Move without a motion mode: {}'.format(command))
+
+        if self.absolute:
+            end_position = [
+                words['X'] * self.unit_scale if 'X' in words else self.position[0],
+                words['Y'] * self.unit_scale if 'Y' in words else self.position[1],
+            ]
         else:
-            raise RuntimeError('Unsupported pen type: {}'.format(pen_type))
-    elif command_type == 'g':
-        m = re.search('G([0-9]+)[ ]*', command)
-        if not m:
-            raise RuntimeError('Bug parsing command: {}'.format(command))
-        gcode = int(m.group(1))
-        if gcode == 0:
-            m = re.search('X[ ]*([^ ]*)[ ]*Y[ ]*([^ ]*)[ ]*', command)
-            x = float(m.group(1))
-            y = float(m.group(2))
-            return MoveOperator(current_position, [x, y], rate_eu=DEFAULT_MOVE_RATE)
-        elif gcode == 1:
-            m = re.search('X[ ]*([^ ]*)[ ]*Y[ ]*([^ ]*)[ ]*F[ ]*([^ ]*)[ ]*', command)
-            x = float(m.group(1))
-            y = float(m.group(2))
-            rate = int(m.group(3))
-            return MoveOperator(current_position, [x, y], rate_eu=rate)
-        elif gcode == 3:
-            m = re.search('X[ ]*([^ ]*)[ ]*Y[ ]*([^ ]*)[ ]*I[ ]*([^ ]*)[ ]*J[ ]*([^ ]*)[ ]*F[ ]*([^ ]*)[ ]*', command)
-            x = float(m.group(1))
-            y = float(m.group(2))
-            i = float(m.group(3))
-            j = float(m.group(4))
-            rate = int(m.group(5))
-            return ArcOperator(current_position, [x, y], [i, j], rate_eu=rate)
+            end_position = [
+                self.position[0] + words.get('X', 0.0) * self.unit_scale,
+                self.position[1] + words.get('Y', 0.0) * self.unit_scale,
+            ]
+        if self.motion_mode == 0:
+            return MoveOperator(self.position, end_position, rate_eu=DEFAULT_MOVE_RATE)
+        elif self.motion_mode == 1:
+            return MoveOperator(self.position, end_position, rate_eu=self.feed_rate)
+        return ArcOperator(
+            self.position,
+            end_position,
+            [words.get('I', 0.0) * self.unit_scale, words.get('J', 0.0) * self.unit_scale],
+            rate_eu=self.feed_rate,
+            clockwise=self.motion_mode == 2,
+        )
+
+
+def parse_gcode(command, current_position):
+    """Parse a single line that spells out its motion mode."""
+    return GCodeParser(current_position).parse(command)
+
+
+class GCodeStroke:
+    """A run of pen-down motion between a pen down and the following pen up."""
+    def __init__(self, pen_down_command, start_pt):
+        self.pen_down_command = pen_down_command
+        self.start_pt = np.array(start_pt, dtype=float)
+        self.ops = []
+
+    def add_op(self, op):
+        self.ops.append(op)
+
+    def get_end_pt(self):
+        if len(self.ops) == 0:
+            return self.start_pt
+        return np.array(self.ops[-1].get_end_position(), dtype=float)
+
+    def is_linear(self):
+        return all(type(op) == MoveOperator for op in self.ops)
+
+    def get_points(self):
+        return np.array([self.start_pt] + [op.get_end_position() for op in self.ops], dtype=float)
+
+    def get_feed_rates(self):
+        return np.array([op.rate_eu for op in self.ops])
+
+    def get_pen_distance(self):
+        return sum(op.get_pen_distance() for op in self.ops)
+
+    def reversed(self):
+        stroke = GCodeStroke(self.pen_down_command, self.get_end_pt())
+        for op in reversed(self.ops):
+            if type(op) == ArcOperator:
+                center = op.start_position + np.array(op.relative_center)
+                stroke.add_op(ArcOperator(
+                    op.end_position,
+                    op.start_position,
+                    center - op.end_position,
+                    rate_eu=op.rate_eu,
+                    clockwise=not op.clockwise,
+                ))
+            else:
+                stroke.add_op(MoveOperator(op.end_position, op.start_position, rate_eu=op.rate_eu))
+        return stroke
+
+    def to_gcode(self):
+        commands = []
+        for op in self.ops:
+            if type(op) == ArcOperator:
+                move_arc = GCode.move_arc_cw if op.clockwise else GCode.move_arc
+                commands.append(move_arc(
+                    start_pt=op.start_position,
+                    end_pt=op.end_position,
+                    center_pt=op.start_position + np.array(op.relative_center),
+                    feed_rate=op.rate_eu,
+                ))
+            else:
+                commands.append(GCode.move_linear(op.end_position, feed_rate=op.rate_eu))
+        return [
+            GCode.pen_up(),
+            GCode.move_fast(self.start_pt),
+            self.pen_down_command,
+            ] + commands + [
+            GCode.pen_up(),
+        ]
+
+    @classmethod
+    def from_points(cls, pen_down_command, points, feed_rates):
+        stroke = cls(pen_down_command, points[0])
+        for p0, p1, feed_rate in zip(points, points[1:], feed_rates):
+            stroke.add_op(MoveOperator(p0, p1, rate_eu=feed_rate))
+        return stroke
+
+
+def split_gcode_strokes(commands):
+    """Split a program into pen-down strokes, dropping pen-up travel and non-motion commands."""
+    parser = GCodeParser()
+    strokes = []
+    stroke = None
+
+    for command in commands:
+        position = parser.position
+        op = parser.parse(command)
+        if op is None:
+            continue
+        pen_mode = op.get_pen_mode_update()
+        if pen_mode == PenMode.PEN_DOWN:
+            if stroke is None:
+                stroke = GCodeStroke(command.strip(), position)
+        elif pen_mode == PenMode.PEN_UP:
+            if stroke is not None:
+                strokes.append(stroke)
+                stroke = None
+        elif stroke is not None:
+            stroke.add_op(op)
+
+    if stroke is not None:
+        strokes.append(stroke)
+
+    return strokes
+
+
+def split_pauses(commands):
+    """Split a program at its pauses, e.g. into the layers of a job drawn with several pens."""
+    sections = [[]]
+    for command in commands:
+        if GCode.is_pause_command(command):
+            sections.append([])
         else:
-            raise NotImplementedError('Unsupported gcode type: {} in: {}'.format(gcode, command))
+            sections[-1].append(command)
+    return sections
+
+
+def join_pauses(sections):
+    """Join programs with a pen change between each, lifting the pen and parking it at home to pause."""
+    commands = []
+    for i, section in enumerate(sections):
+        if i > 0:
+            commands += [GCode.pen_up(), GCode.move_home(), GCode.pause()]
+        commands += section
+    return commands
+
+
+class GCodeState:
+    """Modal machine state (units, distance mode, feed, pen, position) implied by the commands run so far."""
+    def __init__(self):
+        self.position = np.array([0.0, 0.0])
+        self.units_mm = True
+        self.absolute = True
+        self.feed_rate = DEFAULT_FEED_RATE
+        self.pen_down_command = None
+        self.motion_mode = 0
+
+    def handle_command(self, command):
+        """Update the state, returning the straight line distance moved by the command."""
+        start_position = self.position
+        words = parse_ngc_words(command)
+        if 'F' in words:
+            self.feed_rate = words['F']
+        # Lines without a G word move in the current motion mode.
+        moves = 'X' in words or 'Y' in words
+        for g in words.get('G', []):
+            if g == 20 or g == 21:
+                self.units_mm = g == 21
+            elif g == 90 or g == 91:
+                self.absolute = g == 90
+            elif g == 28:
+                self.position = np.array([0.0, 0.0])
+                moves = False
+            elif g in MOTION_MODES:
+                self.motion_mode = g
+        if moves:
+            if self.absolute:
+                self.position = np.array([words.get('X', self.position[0]), words.get('Y', self.position[1])])
+            else:
+                self.position = self.position + np.array([words.get('X', 0.0), words.get('Y', 0.0)])
+        if 'M' in words:
+            m = int(words['M'])
+            if m == 3:
+                self.pen_down_command = command.strip()
+            elif m == 5:
+                self.pen_down_command = None
+        return float(np.hypot(*(self.position - start_position)))
+
+    def is_pen_down(self):
+        return self.pen_down_command is not None
+
+    def to_commands(self):
+        """Commands that restore this state from anywhere, travelling with the pen up."""
+        commands = [
+            GCode.set_units_mm() if self.units_mm else GCode.set_units_inches(),
+            GCode.set_coordinates_absolute(),
+            GCode.set_feed_rate(self.feed_rate),
+            GCode.pen_up(),
+            GCode.move_fast(self.position),
+        ]
+        if self.is_pen_down():
+            commands.append(self.pen_down_command)
+        if self.motion_mode == 1:
+            # Compact programs leave G1 out of consecutive feed moves.
+            commands.append(GCode.set_motion_linear())
+        if not self.absolute:
+            commands.append(GCode.set_coordinates_relative())
+        return commands
+
+    def to_dict(self):
+        return {
+            'position': [float(v) for v in self.position],
+            'units_mm': self.units_mm,
+            'absolute': self.absolute,
+            'feed_rate': self.feed_rate,
+            'pen_down_command': self.pen_down_command,
+            'motion_mode': self.motion_mode,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.position = np.array(data['position'], dtype=float)
+        state.units_mm = data['units_mm']
+        state.absolute = data['absolute']
+        state.feed_rate = data['feed_rate']
+        state.pen_down_command = data['pen_down_command']
+        state.motion_mode = data.get('motion_mode', 0)
+        return state
 
 
 def get_gcode_bounds(commands):
-    position = np.array([0, 0])
+    """The rectangle a program moves in, or None for a program that doesn't move, e.g. an empty one."""
+    parser = GCodeParser()
     aabb = AABB()
 
     for command in commands:
-        op = parse_gcode(command, position)
+        op = parser.parse(command)
+        if op is None:
+            continue
         aabb.merge_aabb(op.get_aabb())
-        position = op.get_end_position()
 
+    if aabb.is_empty():
+        return None
     return aabb.get_rect()
 
 
 class GCodeEmulator:
     def __init__(self):
-        self.pen_position = np.array([0.0, 0.0])
+        self.parser = GCodeParser()
+        self.pen_position = self.parser.position
         self.pen_distance = 0.0
         self.pen_down_distance = 0.0
         self.time = 0.0
         self.pen_down = False
 
     def handle_command(self, command):
-        op = parse_gcode(command, self.pen_position)
+        op = self.parser.parse(command)
+        if op is None:
+            return
         pen_mode = op.get_pen_mode_update()
         if pen_mode is not None:
             self.pen_down = pen_mode == PenMode.PEN_DOWN
@@ -268,3 +532,156 @@ class GCodeEmulator:
             self.handle_command(command)
         efficiency = self.pen_down_distance / self.pen_distance
         return self.time, efficiency
+
+
+def get_resolution_decimals(resolution):
+    """The fewest decimals that write every multiple of the resolution exactly."""
+    for decimals in range(12):
+        if abs(round(resolution, decimals) - resolution) <= resolution * 1e-6:
+            return decimals
+    return 12
+
+
+def format_number(value, decimals):
+    """Shortest text for a value rounded to decimals, without trailing zeros or a leading zero."""
+    text = '{:.{}f}'.format(value, decimals)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text.startswith('0.'):
+        text = text[1:]
+    elif text.startswith('-0.'):
+        text = '-' + text[2:]
+    if text == '-0':
+        text = '0'
+    return text
+
+
+class GCodeCompactor:
+    """Rewrite program lines in as few bytes as possible for the serial link.
+
+    Coordinates are quantized to the resolution and written in their shortest form. Repeated G0 or G1
+    words, unchanged feed rates and unchanged X or Y are left out, and G0 or G1 moves that quantize to
+    no motion are dropped. Arcs keep their G word and both axes so every arc line stands on its own.
+    """
+    def __init__(self, resolution=RESOLUTION_EU):
+        self.resolution = resolution
+        self.decimals = get_resolution_decimals(resolution)
+        # The modal state the input program has set up.
+        self.input_motion_mode = None
+        self.input_position = [0.0, 0.0]
+        self.input_feed_rate = DEFAULT_FEED_RATE
+        self.absolute = True
+        # The modal state the output has set up, positions in units of the resolution.
+        self.motion_mode = None
+        self.feed_rate = None
+        self.position = None
+
+    def quantize(self, value):
+        return int(round(value / self.resolution))
+
+    def format_quantized(self, quantized):
+        return format_number(quantized * self.resolution, self.decimals)
+
+    def pass_through(self, command, words):
+        """A line kept as it is, such as a relative move, following what it does to the modal state."""
+        moves = 'X' in words or 'Y' in words
+        motion_mode = get_motion_mode(words)
+        for word in words.get('G', []):
+            if word == 28:
+                moves = False
+                self.input_position = [0.0, 0.0]
+                self.position = (0, 0)
+            elif word == 90 or word == 91:
+                self.absolute = word == 90
+        if motion_mode is not None:
+            self.input_motion_mode = motion_mode
+        parts = []
+        if moves:
+            if self.input_motion_mode is None:
+                raise RuntimeError('Move without a motion mode: {}'.format(command))
+            if self.absolute:
+                self.input_position = [words.get('X', self.input_position[0]), words.get('Y', self.input_position[1])]
+            else:
+                self.input_position = [self.input_position[0] + words.get('X', 0.0), self.input_position[1] + words.get('Y', 0.0)]
+            # GRBL moves in the motion mode and feed rate the output set, which may not be the program's.
+            if motion_mode is None and self.input_motion_mode != self.motion_mode:
+                parts.append('G{}'.format(self.input_motion_mode))
+            feed_rate = self.quantize(self.input_feed_rate)
+            if self.input_motion_mode != 0 and 'F' not in words and feed_rate != self.feed_rate:
+                parts.append('F' + self.format_quantized(feed_rate))
+                self.feed_rate = feed_rate
+            self.motion_mode = self.input_motion_mode
+            # Only GRBL knows where the line ends after rounding, so the next move writes both axes.
+            self.position = None
+        elif motion_mode is not None:
+            self.motion_mode = motion_mode
+        if 'F' in words:
+            self.feed_rate = self.quantize(words['F'])
+        return ''.join(parts) + command.strip()
+
+    def compact_command(self, command):
+        """The compact form of a line, or None when the line changes nothing."""
+        words = parse_ngc_words(command)
+        if len(words) == 0:
+            return None
+        if 'F' in words:
+            self.input_feed_rate = words['F']
+        g = get_motion_mode(words)
+        moves = 'X' in words or 'Y' in words
+
+        if 'M' in words or any(word not in MOTION_MODES for word in words.get('G', [])) or not self.absolute:
+            return self.pass_through(command, words)
+        if g is not None:
+            self.input_motion_mode = g
+
+        if not moves:
+            if 'F' not in words or self.quantize(words['F']) == self.feed_rate:
+                return None
+            self.feed_rate = self.quantize(words['F'])
+            return 'F' + self.format_quantized(self.feed_rate)
+        if self.input_motion_mode is None:
+            raise RuntimeError('Move without a motion mode: {}'.format(command))
+
+        start_position = self.input_position
+        self.input_position = [words.get('X', start_position[0]), words.get('Y', start_position[1])]
+        end = (self.quantize(self.input_position[0]), self.quantize(self.input_position[1]))
+        motion_mode = self.input_motion_mode
+        is_arc = motion_mode == 2 or motion_mode == 3
+        if not is_arc and end == self.position:
+            return None
+
+        parts = []
+        if is_arc or motion_mode != self.motion_mode:
+            parts.append('G{}'.format(motion_mode))
+        if is_arc or self.position is None or end[0] != self.position[0]:
+            parts.append('X' + self.format_quantized(end[0]))
+        if is_arc or self.position is None or end[1] != self.position[1]:
+            parts.append('Y' + self.format_quantized(end[1]))
+        if is_arc:
+            # Keep the arc center where it was, measured from the quantized start.
+            start = self.position if self.position is not None else (self.quantize(start_position[0]), self.quantize(start_position[1]))
+            i = self.quantize(start_position[0] + words.get('I', 0.0)) - start[0]
+            j = self.quantize(start_position[1] + words.get('J', 0.0)) - start[1]
+            if i != 0 or j == 0:
+                parts.append('I' + self.format_quantized(i))
+            if j != 0:
+                parts.append('J' + self.format_quantized(j))
+        if motion_mode != 0:
+            feed_rate = self.quantize(self.input_feed_rate)
+            if feed_rate != self.feed_rate:
+                parts.append('F' + self.format_quantized(feed_rate))
+                self.feed_rate = feed_rate
+
+        self.motion_mode = motion_mode
+        self.position = end
+        return ''.join(parts)
+
+
+def compact_gcode(commands, resolution=RESOLUTION_EU):
+    compactor = GCodeCompactor(resolution)
+    return [line for line in map(compactor.compact_command, commands) if line is not None]
+
+
+def get_gcode_bytes(commands):
+    """Bytes sent over the serial link, counting each line's newline."""
+    return sum(len(command) + 1 for command in commands)
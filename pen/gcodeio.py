@@ -0,0 +1,57 @@
+import bz2
+import gzip
+import itertools
+import lzma
+
+# Level 9 gzip is several times slower to write for a few percent on G-code.
+GZIP_COMPRESS_LEVEL = 6
+
+COMPRESSED_OPENERS = {
+    '.gz': lambda path, mode: gzip.open(path, mode, compresslevel=GZIP_COMPRESS_LEVEL),
+    '.xz': lambda path, mode: lzma.open(path, mode),
+    '.bz2': lambda path, mode: bz2.open(path, mode),
+}
+
+
+def get_compression(path):
+    for extension in COMPRESSED_OPENERS:
+        if path.endswith(extension):
+            return extension
+    return None
+
+
+def open_gcode(path, mode='r'):
+    """Open a text program, compressed by its .gz, .xz or .bz2 extension, decoding as it is read."""
+    compression = get_compression(path)
+    if compression is None:
+        return open(path, mode)
+    return COMPRESSED_OPENERS[compression](path, mode.replace('t', '') + 't')
+
+
+class GCodeFile:
+    """The stripped lines of a program on disk, streamed from the file each time they are iterated.
+
+    Nothing is held in memory beyond the line count, so bounds checks and sending are separate passes
+    over the (possibly compressed) file. Slices are views that skip lines as they stream.
+    """
+    def __init__(self, path, start=0, stop=None):
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.line_count = None
+
+    def __iter__(self):
+        with open_gcode(self.path) as r:
+            for line in itertools.islice(r, self.start, self.stop):
+                yield line.strip()
+
+    def __len__(self):
+        if self.line_count is None:
+            self.line_count = sum(1 for _ in self)
+        return self.line_count
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError('Program files only support contiguous slices')
+        start, stop, _ = index.indices(len(self))
+        return GCodeFile(self.path, self.start + start, self.start + max(start, stop))
@@ -0,0 +1,129 @@
+# G-code words and machine defaults. Nothing here imports numpy, so the small commands that only
+# send a word or two start quickly.
+import re
+
+DEFAULT_MOVE_RATE = 2000
+DEFAULT_FEED_RATE = 1000
+DEFAULT_SERVO_DOWN = 60
+
+RESOLUTION_EU = 1e-5
+
+# Compensate for something off with eu to mm?
+MOVE_RATE_SCALE = 0.75
+
+NGC_WORD_RE = re.compile(r'([A-Z])\s*([-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)')
+NGC_COMMENT_RE = re.compile(r'\([^)]*\)|;.*$')
+
+# Modal groups a line's G words apply in, as on GRBL: units, then distance mode, then the rest, such as
+# the motion.
+G_WORD_ORDER = {20: 0, 21: 0, 90: 1, 91: 1}
+
+
+def parse_ngc_words(line):
+    """Parse a line such as 'G01 X1.0 Y2.0 Z-0.1 F400 (comment)' into a {letter: value} dict.
+
+    A line may carry a G word from each modal group, as in 'G21 G91 G1 X1', so 'G' holds the list of
+    them in the order they apply.
+    """
+    line = NGC_COMMENT_RE.sub('', line.upper())
+    words = {}
+    g_words = []
+    for letter, value in NGC_WORD_RE.findall(line):
+        if letter == 'G':
+            g_words.append(int(float(value)))
+        else:
+            words[letter] = float(value)
+    if len(g_words) != 0:
+        words['G'] = sorted(g_words, key=lambda g: G_WORD_ORDER.get(g, 2))
+    return words
+
+
+def is_pause_words(words):
+    """Whether a parsed line pauses: any line with an M0 word, whatever comment or other words it has."""
+    return words.get('M') == 0
+
+
+class GCode:
+    @staticmethod
+    def set_units_mm():
+        return 'G21'
+
+    @staticmethod
+    def set_units_inches():
+        return 'G20'
+
+    @staticmethod
+    def move_home():
+        return 'G28'
+
+    @staticmethod
+    def set_coordinates_absolute():
+        return 'G90'
+
+    @staticmethod
+    def set_coordinates_relative():
+        return 'G91'
+
+    @staticmethod
+    def set_motion_linear():
+        return 'G1'
+
+    @staticmethod
+    def set_feed_rate(rate):
+        return 'F{}'.format(rate)
+
+    @staticmethod
+    def move_fast(end_pt):
+        x, y = end_pt
+        return 'G0X{}Y{}'.format(x, y)
+
+    @staticmethod
+    def move_linear(end_pt, feed_rate=DEFAULT_FEED_RATE):
+        x, y = end_pt
+        return 'G1X{}Y{}F{}'.format(x, y, feed_rate)
+
+    @staticmethod
+    def move_arc(start_pt, end_pt, center_pt, feed_rate=DEFAULT_FEED_RATE):
+        x, y = end_pt
+        # Relative arc distance mode to the start
+        i, j = center_pt[0] - start_pt[0], center_pt[1] - start_pt[1]
+        return 'G3X{}Y{}I{}J{}F{}'.format(x, y, i, j, feed_rate)
+
+    @staticmethod
+    def move_arc_cw(start_pt, end_pt, center_pt, feed_rate=DEFAULT_FEED_RATE):
+        x, y = end_pt
+        i, j = center_pt[0] - start_pt[0], center_pt[1] - start_pt[1]
+        return 'G2X{}Y{}I{}J{}F{}'.format(x, y, i, j, feed_rate)
+
+    @staticmethod
+    def pen_up():
+        return 'M5'
+
+    @staticmethod
+    def pen_down(servo=DEFAULT_SERVO_DOWN):
+        # Lazer power is S0
+        # TODO(remap pressure)
+        return 'M3S{}'.format(servo)
+
+    @staticmethod
+    def is_pen_down_command(gcode):
+        return gcode.lower().strip().startswith('m3')
+
+    @staticmethod
+    def pause():
+        # GRBL finishes the motion before it and holds until a cycle start, e.g. for a pen change.
+        return 'M0'
+
+    @staticmethod
+    def is_pause_command(gcode):
+        return is_pause_words(parse_ngc_words(gcode))
+
+    @staticmethod
+    def dwell_milliseconds(milliseconds):
+        # Unknown support?
+        return 'G4 P{}'.format(milliseconds)
+
+    @staticmethod
+    def dwell_seconds(seconds):
+        # Unknown support?
+        return 'G4 S{}'.format(seconds)
@@ -1,3 +1,11 @@
+# Buffer sizes of GRBL on an ATmega328p
+GRBL_PLANNER_BLOCKS = 15
+GRBL_RX_BUFFER_SIZE = 128
+
+FEED_OVERRIDE_MIN = 10
+FEED_OVERRIDE_MAX = 200
+
+
 class GRBL:
     @staticmethod
     def soft_reset():
@@ -14,3 +22,95 @@ class GRBL:
     @staticmethod
     def toggle_run():
         return '~'
+
+    @staticmethod
+    def unlock():
+        return '$X'
+
+    # Real-time commands (GRBL 1.1). These are picked out of the stream as soon as they arrive, are never
+    # acknowledged and must not be followed by a newline.
+
+    @staticmethod
+    def feed_hold():
+        return '!'
+
+    @staticmethod
+    def cycle_start():
+        return '~'
+
+    @staticmethod
+    def feed_override_reset():
+        return '\x90'
+
+    @staticmethod
+    def feed_override_coarse_plus():
+        return '\x91'
+
+    @staticmethod
+    def feed_override_coarse_minus():
+        return '\x92'
+
+    @staticmethod
+    def feed_override_fine_plus():
+        return '\x93'
+
+    @staticmethod
+    def feed_override_fine_minus():
+        return '\x94'
+
+    @staticmethod
+    def rapid_override(percent):
+        rapid_overrides = {
+            100: '\x95',
+            50: '\x96',
+            25: '\x97',
+        }
+        if percent not in rapid_overrides:
+            raise RuntimeError('Unsupported rapid override: {}'.format(percent))
+        return rapid_overrides[percent]
+
+    @staticmethod
+    def jog(delta, feed_rate):
+        # Jogs are planned like any motion but leave the G-code modal state alone, and can be cancelled.
+        x, y = delta
+        return '$J=G91X{}Y{}F{}'.format(x, y, feed_rate)
+
+    @staticmethod
+    def jog_to(end_pt, feed_rate):
+        x, y = end_pt
+        return '$J=G90X{}Y{}F{}'.format(x, y, feed_rate)
+
+    @staticmethod
+    def jog_cancel():
+        # Real-time: stops the jog in progress and flushes jogs still in the buffers.
+        return '\x85'
+
+    @staticmethod
+    def is_jog(command):
+        return command.startswith('$J=')
+
+    @staticmethod
+    def is_realtime(command):
+        return len(command) == 1 and (command in '!~?\x18' or ord(command) >= 0x80)
+
+    @staticmethod
+    def feed_override_steps(current_percent, target_percent):
+        """Real-time commands that move the feed override from current_percent to target_percent."""
+        target_percent = max(FEED_OVERRIDE_MIN, min(FEED_OVERRIDE_MAX, int(target_percent)))
+        if target_percent == current_percent:
+            return []
+        if target_percent == 100:
+            return [GRBL.feed_override_reset()]
+        delta = target_percent - current_percent
+        coarse = int(delta / 10)
+        fine = delta - 10 * coarse
+        steps = []
+        if coarse > 0:
+            steps += [GRBL.feed_override_coarse_plus()] * coarse
+        else:
+            steps += [GRBL.feed_override_coarse_minus()] * -coarse
+        if fine > 0:
+            steps += [GRBL.feed_override_fine_plus()] * fine
+        else:
+            steps += [GRBL.feed_override_fine_minus()] * -fine
+        return steps
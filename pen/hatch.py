@@ -0,0 +1,128 @@
+import numpy as np
+
+from .defaults import DEFAULT_HATCH_ANGLE
+from .mathscene import DISTANCE_EPSILON
+
+
+def get_hatch_spacing(pen, overlap=0.0):
+    """Spacing between hatch lines so strokes of the pen just touch, or overlap by a fraction."""
+    return pen.stroke_width_mm * (1.0 - overlap)
+
+
+def _get_local_offsets(counts):
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def _rotate(points, angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.stack([c * points[:, 0] - s * points[:, 1], s * points[:, 0] + c * points[:, 1]], axis=1)
+
+
+def get_hatch_spans(polygons, spacing, angle=0.0):
+    """Horizontal spans of the shape in a frame rotated by -angle degrees.
+
+    All rings of polygons form one shape under the even-odd rule, so inner rings are holes. Returns
+    (lines, x0, x1, ys) where span i covers x0[i] to x1[i] on scanline lines[i] at height ys[lines[i]],
+    sorted by line then x.
+    """
+    rings = [np.asarray(polygon, dtype=float).reshape(-1, 2) for polygon in polygons]
+    rings = [ring for ring in rings if len(ring) >= 3]
+    if len(rings) == 0 or spacing <= 0.0:
+        return np.zeros(0, dtype=int), np.zeros(0), np.zeros(0), np.zeros(0)
+    theta = -np.radians(angle)
+    edge_starts = _rotate(np.concatenate(rings), theta)
+    edge_ends = _rotate(np.concatenate([np.roll(ring, -1, axis=0) for ring in rings]), theta)
+
+    # Center the scanlines so the first and last sit about half a spacing in from the extremes.
+    y_min = edge_starts[:, 1].min()
+    y_max = edge_starts[:, 1].max()
+    line_count = max(1, int(np.ceil((y_max - y_min) / spacing)))
+    ys = y_min + 0.5 * (y_max - y_min - (line_count - 1) * spacing) + spacing * np.arange(line_count)
+
+    # Each edge crosses the scanlines in [y_lo, y_hi), which counts shared vertices exactly once.
+    ay, by = edge_starts[:, 1], edge_ends[:, 1]
+    y_lo = np.minimum(ay, by)
+    y_hi = np.maximum(ay, by)
+    first = np.ceil((y_lo - ys[0]) / spacing).astype(int)
+    last = np.ceil((y_hi - ys[0]) / spacing).astype(int) - 1
+    first = np.maximum(first, 0)
+    last = np.minimum(last, len(ys) - 1)
+    counts = np.maximum(last - first + 1, 0)
+    edges = np.repeat(np.arange(len(edge_starts)), counts)
+    lines = first[edges] + _get_local_offsets(counts)
+    y = ys[lines]
+    # Guard the ceil against rounding at the interval ends.
+    valid = (y >= y_lo[edges]) & (y < y_hi[edges])
+    edges, lines, y = edges[valid], lines[valid], y[valid]
+    t = (y - ay[edges]) / (by[edges] - ay[edges])
+    xs = edge_starts[edges, 0] + t * (edge_ends[edges, 0] - edge_starts[edges, 0])
+
+    # Pair up crossings along each scanline, even-odd.
+    order = np.lexsort([xs, lines])
+    lines, xs = lines[order], xs[order]
+    lines = lines[0::2]
+    x0 = xs[0::2]
+    x1 = xs[1::2]
+    keep = x1 - x0 > DISTANCE_EPSILON
+    return lines[keep], x0[keep], x1[keep], ys
+
+
+def _get_span_chains(lines, x0, x1):
+    """Order spans into serpentine chains, linking a span to the one below when they overlap one to one."""
+    count = len(lines)
+    if count == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    # A key that sorts spans by line then position, so a line's spans are found with searchsorted.
+    width = max(x1.max() - x0.min(), 1.0) * 2.0
+    key0 = lines * width + (x0 - x0.min())
+    key1 = lines * width + (x1 - x0.min())
+    # Spans on the next line overlapping [x0, x1] are those with x1' > x0 and x0' < x1.
+    below_first = np.searchsorted(key1, (lines + 1) * width + (x0 - x0.min()), side='right')
+    below_last = np.searchsorted(key0, (lines + 1) * width + (x1 - x0.min()), side='left')
+    below_count = below_last - below_first
+    above_first = np.searchsorted(key1, (lines - 1) * width + (x0 - x0.min()), side='right')
+    above_last = np.searchsorted(key0, (lines - 1) * width + (x1 - x0.min()), side='left')
+    above_count = above_last - above_first
+
+    linked = np.nonzero(below_count == 1)[0]
+    linked = linked[above_count[below_first[linked]] == 1]
+    parent = np.arange(count)
+    parent[below_first[linked]] = linked
+    depth = (parent != np.arange(count)).astype(int)
+    # Pointer jumping to find each span's chain head and its position in the chain.
+    while True:
+        grand_parent = parent[parent]
+        if np.all(grand_parent == parent):
+            break
+        depth = depth + depth[parent]
+        parent = grand_parent
+    return parent, depth
+
+
+def hatch_polygons(polygons, spacing, angle=DEFAULT_HATCH_ANGLE):
+    """Fill polygons with parallel hatch lines joined into serpentine strokes.
+
+    Returns a point buffer and offsets, stroke i is points[offsets[i]:offsets[i + 1]].
+    """
+    lines, x0, x1, ys = get_hatch_spans(polygons, spacing, angle=angle)
+    heads, depth = _get_span_chains(lines, x0, x1)
+    order = np.lexsort([depth, heads])
+    lines, x0, x1, heads, depth = lines[order], x0[order], x1[order], heads[order], depth[order]
+
+    # Alternate direction along each chain.
+    reverse = depth % 2 == 1
+    points = np.empty((2 * len(lines), 2))
+    points[0::2, 0] = np.where(reverse, x1, x0)
+    points[1::2, 0] = np.where(reverse, x0, x1)
+    points[0::2, 1] = ys[lines]
+    points[1::2, 1] = ys[lines]
+    starts = np.nonzero(depth == 0)[0]
+    offsets = np.concatenate([2 * starts, [len(points)]]).astype(int)
+    return _rotate(points, np.radians(angle)), offsets
+
+
+def fill_polygons(viz, polygons, pen, angle=DEFAULT_HATCH_ANGLE, overlap=0.0):
+    """Hatch polygons into a PenViz with spacing taken from the pen's stroke width."""
+    points, offsets = hatch_polygons(polygons, get_hatch_spacing(pen, overlap=overlap), angle=angle)
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        viz.draw_path(points[start:end])
@@ -0,0 +1,319 @@
+import numpy as np
+
+from .gcode import DEFAULT_FEED_RATE
+from .gcode import DEFAULT_MOVE_RATE
+from .gcode import MOTION_MODES
+from .gcode import MOVE_RATE_SCALE
+from .gcode import PEN_MODE_DURATION
+from .gcode import parse_ngc_words
+from .gcodewords import DEFAULT_SERVO_DOWN
+from .mathscene import AABB
+from .mathscene import ArcArray
+from .mathscene import Rectangle
+
+JOB_EXTENSION = '.rpj'
+JOB_MAGIC = b'ROBOPEN'
+JOB_VERSION = 1
+
+# Coordinates are float32, so a job on the plotter's bed keeps about 1e-4 of precision. Text is
+# written rounded to this many decimals so it reads back like the program that was saved.
+JOB_DECIMALS = 4
+
+JOB_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('record_count', '<u8'),
+    ('stroke_count', '<u8'),
+    ('bounds', '<f8', (4,)),
+    ('time', '<f8'),
+    ('pen_down_distance', '<f8'),
+    ('pen_up_distance', '<f8'),
+    ('draw_feed_rate', '<f4'),
+    ('move_feed_rate', '<f4'),
+    ('servo_down', '<f4'),
+    ('stroke_width_mm', '<f4'),
+    ('reserved', 'S28'),
+])
+
+# One fixed width record per command. Arcs keep I and J relative to their start like the G-code,
+# the feed column holds the feed rate, the pen down servo value or the dwell in milliseconds.
+JOB_RECORD_DTYPE = np.dtype([
+    ('op', 'u1'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('i', '<f4'),
+    ('j', '<f4'),
+    ('f', '<f4'),
+])
+
+DEFAULT_STREAM_CHUNK = 4096
+
+
+class JobOp:
+    PEN_UP = 0
+    PEN_DOWN = 1
+    MOVE_FAST = 2
+    MOVE_LINEAR = 3
+    ARC_CW = 4
+    ARC_CCW = 5
+    SET_FEED = 6
+    HOME = 7
+    UNITS_MM = 8
+    UNITS_INCHES = 9
+    ABSOLUTE = 10
+    DWELL = 11
+    PAUSE = 12
+
+
+MOTION_OPS = [JobOp.MOVE_FAST, JobOp.MOVE_LINEAR, JobOp.ARC_CW, JobOp.ARC_CCW, JobOp.HOME]
+PEN_OPS = [JobOp.PEN_UP, JobOp.PEN_DOWN]
+
+G_OPS = {
+    0: JobOp.MOVE_FAST,
+    1: JobOp.MOVE_LINEAR,
+    2: JobOp.ARC_CW,
+    3: JobOp.ARC_CCW,
+    4: JobOp.DWELL,
+    21: JobOp.UNITS_MM,
+    28: JobOp.HOME,
+    90: JobOp.ABSOLUTE,
+}
+
+
+def is_job_path(path):
+    return path.endswith(JOB_EXTENSION)
+
+
+def _format_number(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def gcode_to_records(commands):
+    """Encode absolute mm G-code, as written by PenViz and the optimizer, into job records.
+
+    Positions are stored as given and the header bounds are in mm, so relative (G91) and inch (G20)
+    programs are refused.
+    """
+    records = []
+    position = (0.0, 0.0)
+    feed_rate = DEFAULT_FEED_RATE
+    motion_mode = None
+    for command in commands:
+        words = parse_ngc_words(command)
+        if len(words) == 0:
+            continue
+        if 'F' in words:
+            feed_rate = words['F']
+        if 'M' in words:
+            m = int(words['M'])
+            if m == 3:
+                records.append((JobOp.PEN_DOWN, position[0], position[1], 0.0, 0.0, words.get('S', DEFAULT_SERVO_DOWN)))
+            elif m == 5:
+                records.append((JobOp.PEN_UP, position[0], position[1], 0.0, 0.0, 0.0))
+            elif m == 0:
+                records.append((JobOp.PAUSE, position[0], position[1], 0.0, 0.0, 0.0))
+            else:
+                raise RuntimeError('Unsupported command for a job: {}'.format(command))
+        elif 'G' in words or 'X' in words or 'Y' in words:
+            g_words = words.get('G', [])
+            # Axis words without a motion word move in the current motion mode, a G28 takes them as its
+            # intermediate point.
+            moves = ('X' in words or 'Y' in words) and 28 not in g_words
+            for g in g_words:
+                if g == 20:
+                    raise RuntimeError('Inch programs are not supported for a job, convert to mm first: {}'.format(command))
+                if g not in G_OPS:
+                    raise RuntimeError('Unsupported command for a job: {}'.format(command))
+                if g in MOTION_MODES:
+                    motion_mode = g
+                    moves = True
+                    continue
+                op = G_OPS[g]
+                if op == JobOp.HOME:
+                    position = (0.0, 0.0)
+                f = words.get('P', 1000.0 * words.get('S', 0.0)) if op == JobOp.DWELL else 0.0
+                records.append((op, position[0], position[1], 0.0, 0.0, f))
+            if moves:
+                if motion_mode is None:
+                    raise RuntimeError('Move without a motion mode: {}'.format(command))
+                op = G_OPS[motion_mode]
+                position = (words.get('X', position[0]), words.get('Y', position[1]))
+                f = feed_rate if op != JobOp.MOVE_FAST else 0.0
+                records.append((op, position[0], position[1], words.get('I', 0.0), words.get('J', 0.0), f))
+        elif 'F' in words:
+            records.append((JobOp.SET_FEED, position[0], position[1], 0.0, 0.0, feed_rate))
+        else:
+            raise RuntimeError('Unsupported command for a job: {}'.format(command))
+    return np.array(records, dtype=JOB_RECORD_DTYPE)
+
+
+def iter_records_gcode(records, chunk_size=DEFAULT_STREAM_CHUNK):
+    """Lazily decode job records into G-code text, a chunk of columns at a time."""
+    for chunk_start in range(0, len(records), chunk_size):
+        chunk = records[chunk_start:chunk_start + chunk_size]
+        columns = [np.round(chunk[name].astype(float), JOB_DECIMALS).tolist() for name in ['x', 'y', 'i', 'j', 'f']]
+        for op, x, y, i, j, f in zip(chunk['op'].tolist(), *columns):
+            if op == JobOp.MOVE_LINEAR:
+                yield 'G1X{}Y{}F{}'.format(_format_number(x), _format_number(y), _format_number(f))
+            elif op == JobOp.MOVE_FAST:
+                yield 'G0X{}Y{}'.format(_format_number(x), _format_number(y))
+            elif op == JobOp.ARC_CCW or op == JobOp.ARC_CW:
+                yield 'G{}X{}Y{}I{}J{}F{}'.format(
+                    3 if op == JobOp.ARC_CCW else 2,
+                    _format_number(x), _format_number(y), _format_number(i), _format_number(j), _format_number(f))
+            elif op == JobOp.PEN_UP:
+                yield 'M5'
+            elif op == JobOp.PEN_DOWN:
+                yield 'M3S{}'.format(_format_number(f))
+            elif op == JobOp.SET_FEED:
+                yield 'F{}'.format(_format_number(f))
+            elif op == JobOp.HOME:
+                yield 'G28'
+            elif op == JobOp.UNITS_MM:
+                yield 'G21'
+            elif op == JobOp.UNITS_INCHES:
+                yield 'G20'
+            elif op == JobOp.ABSOLUTE:
+                yield 'G90'
+            elif op == JobOp.DWELL:
+                yield 'G4 P{}'.format(_format_number(f))
+            elif op == JobOp.PAUSE:
+                yield 'M0'
+            else:
+                raise RuntimeError('Unknown job op: {}'.format(op))
+
+
+def get_records_stats(records):
+    """Bounds, distances and the estimated time of job records, like get_gcode_bounds and GCodeEmulator."""
+    ops = records['op']
+    if np.any(ops == JobOp.UNITS_INCHES):
+        raise RuntimeError('Job records in inches have no bounds in mm')
+    ends = np.stack([records['x'], records['y']], axis=1).astype(float)
+    moving = np.isin(ops, MOTION_OPS)
+    ends[ops == JobOp.HOME] = 0.0
+
+    # Every record starts where the last motion ended, the plotter starts at the origin.
+    last_motion = np.maximum.accumulate(np.where(moving, np.arange(len(records)), -1))
+    positions = np.where(last_motion[:, None] >= 0, ends[np.maximum(last_motion, 0)], 0.0)
+    starts = np.concatenate([np.zeros((1, 2)), positions[:-1]])
+
+    # The pen is down for a motion when the last pen record before it lowered it.
+    pen_ops = np.isin(ops, PEN_OPS)
+    last_pen = np.maximum.accumulate(np.where(pen_ops, np.arange(len(records)), -1))
+    pen_down = np.concatenate([[False], (last_pen >= 0) & (ops[np.maximum(last_pen, 0)] == JobOp.PEN_DOWN)])[:-1]
+
+    distances = np.where(moving, np.hypot(*(ends - starts).T), 0.0)
+    aabb = AABB(np.concatenate([np.zeros((1, 2)), positions]))
+    arc_ccw = ops == JobOp.ARC_CCW
+    arc_cw = ops == JobOp.ARC_CW
+    is_arc = arc_ccw | arc_cw
+    if np.any(is_arc):
+        centers = starts[is_arc] + np.stack([records['i'][is_arc], records['j'][is_arc]], axis=1)
+        # A clockwise arc covers the same points as the counter clockwise arc from end to start.
+        cw = arc_cw[is_arc][:, None]
+        arcs = ArcArray.from_absolute_points(
+            np.where(cw, ends[is_arc], starts[is_arc]),
+            np.where(cw, starts[is_arc], ends[is_arc]),
+            centers,
+        )
+        distances[is_arc] = arcs.get_lengths()
+        aabb.merge_aabb(arcs.get_aabb())
+
+    rates = np.where(np.isin(ops, [JobOp.MOVE_FAST, JobOp.HOME]), DEFAULT_MOVE_RATE, records['f'].astype(float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        durations = np.where(moving, distances / (rates * MOVE_RATE_SCALE / 60.0), 0.0)
+    time = (
+        durations.sum() +
+        PEN_MODE_DURATION * np.count_nonzero(pen_ops) +
+        records['f'][ops == JobOp.DWELL].astype(float).sum() / 1000.0
+    )
+    pen_down_distance = float(distances[pen_down].sum())
+    return {
+        'lines': len(records),
+        'strokes': int(np.count_nonzero(ops == JobOp.PEN_DOWN)),
+        'bounds': aabb.get_rect(),
+        'pen_up_distance': float(distances.sum()) - pen_down_distance,
+        'pen_down_distance': pen_down_distance,
+        'time': float(time),
+    }
+
+
+def write_job(path, commands, pen=None):
+    """Encode a G-code program into a job file, with its bounds, stats and the pen settings in the header."""
+    records = gcode_to_records(commands)
+    stats = get_records_stats(records)
+    header = np.zeros(1, dtype=JOB_HEADER_DTYPE)
+    header['magic'] = JOB_MAGIC
+    header['version'] = JOB_VERSION
+    header['record_count'] = len(records)
+    header['stroke_count'] = stats['strokes']
+    header['bounds'] = stats['bounds'].to_xxyy()
+    header['time'] = stats['time']
+    header['pen_down_distance'] = stats['pen_down_distance']
+    header['pen_up_distance'] = stats['pen_up_distance']
+    if pen is not None:
+        header['draw_feed_rate'] = pen.draw_feed_rate
+        header['move_feed_rate'] = pen.move_feed_rate
+        header['servo_down'] = pen.servo_down
+        header['stroke_width_mm'] = pen.stroke_width_mm
+    else:
+        header['draw_feed_rate'] = DEFAULT_FEED_RATE
+        header['move_feed_rate'] = DEFAULT_MOVE_RATE
+        header['servo_down'] = DEFAULT_SERVO_DOWN
+    with open(path, 'wb') as w:
+        w.write(header.tobytes())
+        w.write(records.tobytes())
+
+
+class JobCommands:
+    """A read only sequence of G-code lines decoded on demand from job records.
+
+    Slicing returns another view over the same (memory mapped) records, so resuming part way through
+    a job never decodes the lines it skips.
+    """
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter_records_gcode(self.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return JobCommands(self.records[index])
+        if index < 0:
+            index += len(self.records)
+        return next(iter_records_gcode(self.records[index:index + 1]))
+
+
+class JobFile(JobCommands):
+    """A job file opened with its records memory mapped, so nothing is read until it is streamed."""
+    def __init__(self, path):
+        self.path = path
+        header = np.fromfile(path, dtype=JOB_HEADER_DTYPE, count=1)
+        if len(header) != 1 or header['magic'][0] != JOB_MAGIC:
+            raise RuntimeError('Not a job file: {}'.format(path))
+        if header['version'][0] != JOB_VERSION:
+            raise RuntimeError('Unsupported job version {} in: {}'.format(header['version'][0], path))
+        self.header = header[0]
+        record_count = int(self.header['record_count'])
+        if record_count == 0:
+            records = np.zeros(0, dtype=JOB_RECORD_DTYPE)
+        else:
+            records = np.memmap(path, dtype=JOB_RECORD_DTYPE, mode='r', offset=JOB_HEADER_DTYPE.itemsize, shape=(record_count,))
+        super(JobFile, self).__init__(records)
+
+    def get_rect(self):
+        return Rectangle.from_xxyy(self.header['bounds'].tolist())
+
+    def get_stats(self):
+        return {
+            'lines': len(self),
+            'pen_up_distance': float(self.header['pen_up_distance']),
+            'pen_down_distance': float(self.header['pen_down_distance']),
+            'time': float(self.header['time']),
+        }
@@ -0,0 +1,87 @@
+import math
+import time
+
+from . import eleksdraw
+from .gcodewords import DEFAULT_MOVE_RATE
+from .grbl import GRBL
+from .grbl import GRBL_PLANNER_BLOCKS
+
+# Continuous jogging sends a short jog every interval and keeps at most this many queued in the
+# planner, so motion follows a change of direction within a couple of intervals.
+DEFAULT_JOG_INTERVAL = 0.02
+DEFAULT_JOG_QUEUED = 2
+# How often to ask whether a cancelled jog has stopped.
+CANCEL_POLL_INTERVAL = 0.005
+
+
+class Jogger:
+    """Move the pen with GRBL $J= jogs, which can be cancelled mid-motion unlike G0.
+
+    Works on anything with run_command, send_realtime and get_status, such as an EleksDrawDevice or
+    a DaemonDevice.
+    """
+    def __init__(self, device, feed_rate=DEFAULT_MOVE_RATE, interval=DEFAULT_JOG_INTERVAL, max_queued=DEFAULT_JOG_QUEUED):
+        self.device = device
+        self.feed_rate = feed_rate
+        self.interval = interval
+        self.max_queued = max_queued
+        self.direction = None
+
+    def jog(self, delta, feed_rate=None):
+        self.device.run_command(GRBL.jog(delta, self.feed_rate if feed_rate is None else feed_rate))
+
+    def jog_to(self, end_pt, feed_rate=None):
+        self.device.run_command(GRBL.jog_to(end_pt, self.feed_rate if feed_rate is None else feed_rate))
+
+    def cancel(self):
+        """Stop jogging and drop the queued jogs, returning once GRBL has stopped."""
+        self.device.send_realtime(GRBL.jog_cancel())
+        # GRBL flushes its RX buffer when the cancel completes, so a jog sent before then would never
+        # be acknowledged.
+        while self.device.get_status().state == eleksdraw.State.JOG:
+            time.sleep(CANCEL_POLL_INTERVAL)
+
+    def set_direction(self, direction):
+        """Jog continuously along direction, scaled to unit length, or stop for None or zero."""
+        if direction is not None:
+            length = math.hypot(*direction)
+            direction = (direction[0] / length, direction[1] / length) if length > 0.0 else None
+        if direction != self.direction and self.direction is not None:
+            # Drop what is queued for the old direction rather than finishing it.
+            self.cancel()
+        self.direction = direction
+
+    def get_queued(self, status):
+        if status.planner_free is None:
+            # GRBL 0.9 style reports without buffer fill, assume the worst while moving.
+            return 0 if status.state == eleksdraw.State.IDLE else self.max_queued
+        return GRBL_PLANNER_BLOCKS - status.planner_free
+
+    def step(self):
+        """Top the planner up with jogs for the current direction, returning how many were sent.
+
+        Call at least every interval while jogging, each jog covers one interval of motion.
+        """
+        if self.direction is None:
+            return 0
+        status = self.device.get_status()
+        if status.state not in (eleksdraw.State.IDLE, eleksdraw.State.JOG):
+            raise RuntimeError('Cannot jog in state: {}'.format(status.state))
+        distance = self.feed_rate / 60.0 * self.interval
+        delta = (round(distance * self.direction[0], 3), round(distance * self.direction[1], 3))
+        sent = 0
+        for _ in range(self.max_queued - self.get_queued(status)):
+            self.jog(delta)
+            sent += 1
+        return sent
+
+    def run(self, get_direction, should_stop=None):
+        """Jog following get_direction(), polled every interval, until should_stop() is True."""
+        try:
+            while should_stop is None or not should_stop():
+                start_time = time.monotonic()
+                self.set_direction(get_direction())
+                self.step()
+                time.sleep(max(0.0, self.interval - (time.monotonic() - start_time)))
+        finally:
+            self.set_direction(None)
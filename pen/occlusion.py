@@ -0,0 +1,248 @@
+import numpy as np
+
+from .clipping import CHUNK_CELLS
+from .clipping import PARAMETER_EPSILON
+from .clipping import complement_intervals
+from .clipping import concatenate_intervals
+from .clipping import intervals_to_polylines
+from .mathscene import ArcArray
+from .mathscene import DISTANCE_EPSILON
+from .penviz import DrawArc
+from .penviz import DrawArcs
+from .penviz import DrawPath
+from .spatial import GridIndex
+from .spatial import get_local_offsets
+
+# Well under a pen stroke width.
+DEFAULT_CIRCLE_TOLERANCE = 0.05
+
+
+class _Occluders:
+    """Opaque polygons flattened into one edge buffer."""
+    def __init__(self, polygons, seqs):
+        self.seqs = np.asarray(seqs, dtype=int)
+        self.edge_counts = np.array([len(polygon) for polygon in polygons], dtype=int)
+        self.edge_offsets = np.cumsum(self.edge_counts) - self.edge_counts
+        self.edge_starts = np.concatenate(polygons)
+        self.edge_ends = np.concatenate([np.roll(polygon, -1, axis=0) for polygon in polygons])
+        self.bounds = np.stack([
+            np.minimum.reduceat(self.edge_starts[:, 0], self.edge_offsets),
+            np.maximum.reduceat(self.edge_starts[:, 0], self.edge_offsets),
+            np.minimum.reduceat(self.edge_starts[:, 1], self.edge_offsets),
+            np.maximum.reduceat(self.edge_starts[:, 1], self.edge_offsets),
+        ], axis=1)
+
+    def expand_edges(self, occluder_ids):
+        """Repeat each entry once per edge of its occluder, returning (entry, edge) index arrays."""
+        counts = self.edge_counts[occluder_ids]
+        entries = np.repeat(np.arange(len(occluder_ids)), counts)
+        edges = np.repeat(self.edge_offsets[occluder_ids], counts) + get_local_offsets(counts)
+        return entries, edges
+
+    def contains(self, points, occluder_ids):
+        """Even-odd test of each point against its own occluder."""
+        entries, edges = self.expand_edges(occluder_ids)
+        px, py = points[entries, 0], points[entries, 1]
+        ax, ay = self.edge_starts[edges, 0], self.edge_starts[edges, 1]
+        bx, by = self.edge_ends[edges, 0], self.edge_ends[edges, 1]
+        straddles = (ay > py) != (by > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x = ax + (py - ay) * (bx - ax) / (by - ay)
+        crossings = np.bincount(entries, weights=straddles & (px < crossing_x), minlength=len(points))
+        return crossings % 2 == 1
+
+
+def _get_segment_cuts(starts, ends, segment_ids, occluder_ids, occluders):
+    entries, edges = occluders.expand_edges(occluder_ids)
+    p = starts[segment_ids[entries]]
+    d = ends[segment_ids[entries]] - p
+    e = occluders.edge_ends[edges] - occluders.edge_starts[edges]
+    f = occluders.edge_starts[edges] - p
+    denom = d[:, 0] * e[:, 1] - d[:, 1] * e[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (f[:, 0] * e[:, 1] - f[:, 1] * e[:, 0]) / denom
+        s = (f[:, 0] * d[:, 1] - f[:, 1] * d[:, 0]) / denom
+    hits = (np.abs(denom) > DISTANCE_EPSILON) & (t > 0.0) & (t < 1.0) & (s >= 0.0) & (s <= 1.0)
+    return entries[hits], t[hits]
+
+
+def _get_arc_cuts(arcs, arc_ids, occluder_ids, occluders):
+    entries, edges = occluders.expand_edges(occluder_ids)
+    index = arc_ids[entries]
+    e = occluders.edge_ends[edges] - occluders.edge_starts[edges]
+    f = occluders.edge_starts[edges] - arcs.centers[index]
+    # Solve |f + s e| = r for the edge parameter s.
+    a = np.einsum('ij,ij->i', e, e)
+    b = 2.0 * np.einsum('ij,ij->i', f, e)
+    c = np.einsum('ij,ij->i', f, f) - arcs.radii[index] ** 2
+    discriminant = b ** 2 - 4.0 * a * c
+    root = np.sqrt(np.maximum(discriminant, 0.0))
+    cut_entries = []
+    cut_params = []
+    for sign in [-1.0, 1.0]:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = (-b + sign * root) / (2.0 * a)
+        points = f + s[:, None] * e
+        thetas = np.arctan2(points[:, 1], points[:, 0])
+        u = np.mod(thetas - arcs.start_thetas[index], 2.0 * np.pi) / arcs.widths[index]
+        hits = (discriminant >= 0.0) & (s >= 0.0) & (s <= 1.0) & (u > 0.0) & (u < 1.0)
+        cut_entries.append(entries[hits])
+        cut_params.append(u[hits])
+    return np.concatenate(cut_entries), np.concatenate(cut_params)
+
+
+def _get_covered_intervals(primitive_ids, occluder_ids, cut_entries, cut_params, get_points, occluders):
+    """Parameter intervals of each (primitive, occluder) pair that lie inside the occluder."""
+    pair_count = len(primitive_ids)
+    entries = np.concatenate([np.arange(pair_count), np.arange(pair_count), cut_entries])
+    params = np.concatenate([np.zeros(pair_count), np.ones(pair_count), cut_params])
+    order = np.lexsort([params, entries])
+    entries = entries[order]
+    params = params[order]
+
+    valid = (entries[1:] == entries[:-1]) & (params[1:] - params[:-1] > PARAMETER_EPSILON)
+    entries = entries[:-1][valid]
+    t0 = params[:-1][valid]
+    t1 = params[1:][valid]
+    midpoints = get_points(primitive_ids[entries], 0.5 * (t0 + t1))
+    inside = occluders.contains(midpoints, occluder_ids[entries])
+    return primitive_ids[entries][inside], t0[inside], t1[inside]
+
+
+def _get_pair_chunks(occluder_ids, occluders):
+    # Bound the size of the (pair x occluder edge) arrays.
+    edge_totals = np.cumsum(occluders.edge_counts[occluder_ids])
+    start = 0
+    while start < len(occluder_ids):
+        base = edge_totals[start - 1] if start > 0 else 0
+        end = max(start + 1, int(np.searchsorted(edge_totals, base + CHUNK_CELLS, side='right')))
+        yield slice(start, end)
+        start = end
+
+
+def remove_hidden_lines(viz, circle_tolerance=DEFAULT_CIRCLE_TOLERANCE):
+    """Return a new PenViz where strokes covered by later closed shapes are removed.
+
+    Closed paths (first point equal to the last) and full circles are opaque, anything drawn before
+    them that falls inside is hidden. Circles occlude as polygons within circle_tolerance.
+    """
+    seq = 0
+    starts, ends, segment_seqs, segment_groups, group_drawables = [], [], [], [], []
+    arcs, arc_seqs, arc_drawables = [], [], []
+    polygons, polygon_seqs = [], []
+
+    for drawable_index, drawable in enumerate(viz.drawables):
+        if type(drawable) == DrawPath:
+            points = np.asarray(drawable.path.points, dtype=float).reshape(-1, 2)
+            starts.append(points[:-1])
+            ends.append(points[1:])
+            segment_seqs.append(np.full(len(points) - 1, seq))
+            segment_groups.append(np.full(len(points) - 1, len(group_drawables)))
+            group_drawables.append(drawable_index)
+            if len(points) >= 4 and np.all(np.abs(points[0] - points[-1]) < DISTANCE_EPSILON):
+                polygons.append(points[:-1])
+                polygon_seqs.append(seq)
+            seq += 1
+            continue
+
+        if type(drawable) == DrawArc:
+            drawable_arcs = ArcArray.from_arcs([drawable.arc])
+        elif type(drawable) == DrawArcs:
+            drawable_arcs = drawable.arcs
+        else:
+            raise NotImplementedError('Unsupported drawable for occlusion: {}'.format(type(drawable).__name__))
+        seqs = seq + np.arange(len(drawable_arcs))
+        arcs.append(drawable_arcs)
+        arc_seqs.append(seqs)
+        arc_drawables.append(np.full(len(drawable_arcs), drawable_index))
+        circles = np.nonzero(drawable_arcs.widths >= 2.0 * np.pi - DISTANCE_EPSILON)[0]
+        if len(circles) != 0:
+            points, offsets = ArcArray(
+                drawable_arcs.centers[circles],
+                drawable_arcs.radii[circles],
+                drawable_arcs.start_thetas[circles],
+                drawable_arcs.widths[circles],
+            ).to_polylines(tolerance=circle_tolerance)
+            # Drop the closing point, the polygon closes itself.
+            polygons += [points[start:end - 1] for start, end in zip(offsets[:-1], offsets[1:])]
+            polygon_seqs += seqs[circles].tolist()
+        seq += len(drawable_arcs)
+
+    output = [[] for _ in viz.drawables]
+    occluders = _Occluders(polygons, polygon_seqs) if len(polygons) != 0 else None
+
+    if len(starts) != 0:
+        starts = np.concatenate(starts)
+        ends = np.concatenate(ends)
+        segment_seqs = np.concatenate(segment_seqs)
+        segment_groups = np.concatenate(segment_groups)
+        if occluders is None:
+            index, t0, t1 = np.arange(len(starts)), np.zeros(len(starts)), np.ones(len(starts))
+        else:
+            bounds = np.stack([
+                np.minimum(starts[:, 0], ends[:, 0]),
+                np.maximum(starts[:, 0], ends[:, 0]),
+                np.minimum(starts[:, 1], ends[:, 1]),
+                np.maximum(starts[:, 1], ends[:, 1]),
+            ], axis=1)
+            segment_ids, occluder_ids = GridIndex.from_bounds(occluders.bounds).query_boxes(bounds)
+            later = occluders.seqs[occluder_ids] > segment_seqs[segment_ids]
+            segment_ids, occluder_ids = segment_ids[later], occluder_ids[later]
+
+            def get_segment_points(index, t):
+                return starts[index] + t[:, None] * (ends[index] - starts[index])
+
+            covered = []
+            for chunk in _get_pair_chunks(occluder_ids, occluders):
+                cut_entries, cut_params = _get_segment_cuts(starts, ends, segment_ids[chunk], occluder_ids[chunk], occluders)
+                covered.append(_get_covered_intervals(
+                    segment_ids[chunk], occluder_ids[chunk], cut_entries, cut_params, get_segment_points, occluders))
+            index, t0, t1 = concatenate_intervals(covered)
+            index, t0, t1 = complement_intervals(len(starts), index, t0, t1)
+        points, offsets, groups = intervals_to_polylines(starts, ends, index, t0, t1, segment_groups)
+        for start, end, group in zip(offsets[:-1], offsets[1:], groups):
+            output[group_drawables[group]].append(DrawPath(points[start:end]))
+
+    if len(arcs) != 0:
+        arcs = ArcArray(
+            centers=np.concatenate([a.centers for a in arcs]),
+            radii=np.concatenate([a.radii for a in arcs]),
+            start_thetas=np.concatenate([a.start_thetas for a in arcs]),
+            widths=np.concatenate([a.widths for a in arcs]),
+        )
+        arc_seqs = np.concatenate(arc_seqs)
+        arc_drawables = np.concatenate(arc_drawables)
+        if occluders is None:
+            index, u0, u1 = np.arange(len(arcs)), np.zeros(len(arcs)), np.ones(len(arcs))
+        else:
+            arc_ids, occluder_ids = GridIndex.from_bounds(occluders.bounds).query_boxes(arcs.get_bounds())
+            later = occluders.seqs[occluder_ids] > arc_seqs[arc_ids]
+            arc_ids, occluder_ids = arc_ids[later], occluder_ids[later]
+
+            def get_arc_points(index, u):
+                thetas = arcs.start_thetas[index] + u * arcs.widths[index]
+                return arcs.centers[index] + arcs.radii[index, None] * np.stack([np.cos(thetas), np.sin(thetas)], axis=1)
+
+            covered = []
+            for chunk in _get_pair_chunks(occluder_ids, occluders):
+                cut_entries, cut_params = _get_arc_cuts(arcs, arc_ids[chunk], occluder_ids[chunk], occluders)
+                covered.append(_get_covered_intervals(
+                    arc_ids[chunk], occluder_ids[chunk], cut_entries, cut_params, get_arc_points, occluders))
+            index, u0, u1 = concatenate_intervals(covered)
+            index, u0, u1 = complement_intervals(len(arcs), index, u0, u1)
+        for drawable_index in np.unique(arc_drawables[index]):
+            pieces = index[arc_drawables[index] == drawable_index]
+            piece_u0 = u0[arc_drawables[index] == drawable_index]
+            piece_u1 = u1[arc_drawables[index] == drawable_index]
+            output[drawable_index].append(DrawArcs(ArcArray(
+                centers=arcs.centers[pieces],
+                radii=arcs.radii[pieces],
+                start_thetas=arcs.start_thetas[pieces] + piece_u0 * arcs.widths[pieces],
+                widths=(piece_u1 - piece_u0) * arcs.widths[pieces],
+            )))
+
+    # What is left of a drawable stays on its layer, shapes hide strokes of any layer.
+    for drawable, pieces in zip(viz.drawables, output):
+        for piece in pieces:
+            piece.layer = drawable.layer
+    return viz.with_drawables([drawable for drawables in output for drawable in drawables])
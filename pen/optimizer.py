@@ -1,5 +1,18 @@
 import numpy as np
 
+from .defaults import DEFAULT_JOIN_TOLERANCE
+from .defaults import DEFAULT_SIMPLIFY_TOLERANCE
+from .gcode import DEFAULT_FEED_RATE
+from .gcode import GCodeEmulator
+from .gcode import MoveOperator
+from .gcode import GCodeStroke
+from .gcode import join_pauses
+from .gcode import split_gcode_strokes
+from .gcode import split_pauses
+from .profiling import profiled
+from .profiling import stage
+from .spatial import GridIndex
+
 # TODO(emmett):
 #  * Dynamic programming TSP
 #  * Explore algorithm that picks between reversed line order or forward line order
@@ -60,7 +73,7 @@ class PointSearch:
         # end to start (normal)
         # end to end (reverse second)
 
-        visited = np.zeros(len(self.draw_paths), dtype=np.int)
+        visited = np.zeros(len(self.draw_paths), dtype=int)
 
         max_value = 1e9
         search_matrix = np.array([
@@ -132,67 +145,27 @@ class PointSearch:
         return order, reverse
 
 
+@profiled('optimizer.greedy_tsp')
 def greedy_tsp(draw_paths):
     # TODO(emmett): refactor to allow reversal
     # TODO(emmett): coarsen to allow ~O(n^3) floyd-whatever shortest path traversal
-    cost_matrix = np.zeros((len(draw_paths), len(draw_paths)))
-
-    # O(n^2)
-    for i in range(len(draw_paths)):
-        xN, yN = draw_paths[i].end_pt
-
-        for j in range(len(draw_paths)):
-            if i == j:
-                continue
-            draw_path = draw_paths[j]
-            x0, y0 = draw_path.start_pt
-
-            dx = x0 - xN
-            dy = y0 - yN
+    if len(draw_paths) == 0:
+        return []
+    start_points = np.array([path.start_pt for path in draw_paths], dtype=float)
+    end_points = np.array([path.end_pt for path in draw_paths], dtype=float)
 
-            distance = np.sqrt(dx * dx + dy * dy)
-            cost_matrix[i, j] = distance
+    # Begin with the path starting nearest the origin, the last one on ties.
+    distance_to_origin = np.hypot(start_points[:, 0], start_points[:, 1])
+    current_node = int(np.nonzero(distance_to_origin == distance_to_origin.min())[0][-1])
 
-    min_i = 0
-    min_distance = cost_matrix.max()
-
-    for i in range(len(draw_paths)):
-        x0, y0 = draw_paths[i].start_pt
-        distance_to_origin = np.sqrt(x0 ** 2 + y0 ** 2)
-        if distance_to_origin <= min_distance:
-            min_i = i
-            min_distance = distance_to_origin
-
-    visited = np.zeros(cost_matrix.shape[0], dtype=np.int)  # pylint: disable=E1136
-
-    max_value = 1e9
-    search_matrix = cost_matrix + np.eye(cost_matrix.shape[0]) * max_value  # pylint: disable=E1136
-
-    current_node = min_i
+    index = GridIndex.from_points(start_points)
     order = []
-
-    total_cost = 0
-
-    while (visited == 0).any():
+    for _ in range(len(draw_paths) - 1):
         order.append(current_node)
-        visited[current_node] = 1
-
-        if not (visited == 0).any():
-            break
-
-        prior_node = current_node
-        while True:
-            # TODO(emmett): have reversal_search_matrix
-            # if reverse path beats normal path, then go the reverse route
-            # return reversal code with order
-            current_node = search_matrix[prior_node, :].argmin()
-            if visited[current_node] == 0:
-                break
-            search_matrix[prior_node, current_node] = max_value
-
-        # No one else can go to current node
-        total_cost += search_matrix[prior_node, current_node]
-        search_matrix[:, current_node] = max_value
+        index.remove([current_node])
+        ids, _ = index.query_knn(end_points[current_node], k=1)
+        current_node = int(ids[0])
+    order.append(current_node)
 
     return order
 
@@ -206,3 +179,155 @@ def remove_repeated_ops(gcode_ops):
         last_op = op
         output_ops.append(op)
     return output_ops
+
+
+@profiled('optimizer.greedy_tsp_reversible')
+def greedy_tsp_reversible(draw_paths, reversible=None, start_pt=(0.0, 0.0)):
+    """Nearest neighbour ordering that may enter a path from either end.
+
+    Returns the visiting order and, per visited path, whether it should be drawn reversed.
+    """
+    count = len(draw_paths)
+    if count == 0:
+        return [], []
+    start_points = np.array([path.start_pt for path in draw_paths], dtype=float)
+    end_points = np.array([path.end_pt for path in draw_paths], dtype=float)
+    if reversible is None:
+        reversible = np.ones(count, dtype=bool)
+    else:
+        reversible = np.array(reversible, dtype=bool)
+
+    # Index both ends of every path, id i is the start of path i and id count + i its end.
+    index = GridIndex.from_points(np.concatenate([start_points, end_points]))
+    index.remove(count + np.nonzero(~reversible)[0])
+    position = np.array(start_pt, dtype=float)
+    order = []
+    reverse = []
+
+    for _ in range(count):
+        ids, _ = index.query_knn(position, k=1)
+        path_index = int(ids[0]) % count
+        is_reversed = bool(ids[0] >= count)
+        order.append(path_index)
+        reverse.append(is_reversed)
+        position = start_points[path_index] if is_reversed else end_points[path_index]
+        index.remove([path_index, count + path_index])
+
+    return order, reverse
+
+
+def simplify_polyline(points, tolerance=DEFAULT_SIMPLIFY_TOLERANCE):
+    """Ramer-Douglas-Peucker simplification, returns the kept points."""
+    points = np.asarray(points, dtype=float)
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    stack = [(0, len(points) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        p0 = points[first]
+        chord = points[last] - p0
+        offsets = points[first + 1:last] - p0
+        chord_length = np.hypot(*chord)
+        if chord_length == 0.0:
+            distances = np.hypot(*offsets.T)
+        else:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / chord_length
+        index = distances.argmax()
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return points[keep]
+
+
+def simplify_stroke(stroke, tolerance=DEFAULT_SIMPLIFY_TOLERANCE):
+    # Mixed feed rates would be lost by merging segments, so leave those alone.
+    feed_rates = stroke.get_feed_rates()
+    if not stroke.is_linear() or len(feed_rates) < 2 or (feed_rates != feed_rates[0]).any():
+        return stroke
+    points = simplify_polyline(stroke.get_points(), tolerance=tolerance)
+    return GCodeStroke.from_points(stroke.pen_down_command, points, [feed_rates[0]] * (len(points) - 1))
+
+
+def join_strokes(strokes, tolerance=DEFAULT_JOIN_TOLERANCE):
+    """Merge consecutive strokes whose end and start touch, removing the pen lift between them."""
+    joined = []
+    for stroke in strokes:
+        if len(joined) != 0:
+            prior = joined[-1]
+            gap = np.hypot(*(stroke.start_pt - prior.get_end_pt()))
+            if gap <= tolerance and stroke.pen_down_command == prior.pen_down_command:
+                if gap > 0.0:
+                    feed_rates = [op.rate_eu for op in prior.ops + stroke.ops]
+                    feed_rate = feed_rates[0] if len(feed_rates) != 0 else DEFAULT_FEED_RATE
+                    prior.add_op(MoveOperator(prior.get_end_pt(), stroke.start_pt, rate_eu=feed_rate))
+                for op in stroke.ops:
+                    prior.add_op(op)
+                continue
+        merged = GCodeStroke(stroke.pen_down_command, stroke.start_pt)
+        for op in stroke.ops:
+            merged.add_op(op)
+        joined.append(merged)
+    return joined
+
+
+def optimize_gcode(
+        commands,
+        simplify_tolerance=DEFAULT_SIMPLIFY_TOLERANCE,
+        join_tolerance=DEFAULT_JOIN_TOLERANCE,
+):
+    """Reorder, reverse, join and simplify the pen-down strokes of an existing program.
+
+    A program with pauses for pen changes is optimized a layer at a time, so no stroke moves to another pen.
+    """
+    sections = split_pauses(commands)
+    if len(sections) > 1:
+        return join_pauses([optimize_gcode(section, simplify_tolerance, join_tolerance) for section in sections])
+    with stage('optimizer.optimize_gcode') as span:
+        with stage('optimizer.split_strokes'):
+            strokes = split_gcode_strokes(commands)
+        span.count('strokes_in', len(strokes))
+
+        pen_paths = [PenPath(start_pt=stroke.start_pt, end_pt=stroke.get_end_pt()) for stroke in strokes]
+        order, reverse = greedy_tsp_reversible(pen_paths)
+        strokes = [strokes[i].reversed() if r else strokes[i] for i, r in zip(order, reverse)]
+
+        with stage('optimizer.join_strokes'):
+            strokes = join_strokes(strokes, tolerance=join_tolerance)
+        if simplify_tolerance > 0.0:
+            with stage('optimizer.simplify') as simplify_span:
+                simplify_span.count('ops_in', sum(len(stroke.ops) for stroke in strokes))
+                strokes = [simplify_stroke(stroke, tolerance=simplify_tolerance) for stroke in strokes]
+                simplify_span.count('ops_out', sum(len(stroke.ops) for stroke in strokes))
+        span.count('strokes_out', len(strokes))
+
+        output = []
+        for stroke in strokes:
+            output += stroke.to_gcode()
+        output = remove_repeated_ops(output)
+        span.count('lines_out', len(output))
+    return output
+
+
+def get_gcode_stats(commands):
+    emulator = GCodeEmulator()
+    line_count = 0
+    for command in commands:
+        if command.strip() == '':
+            continue
+        emulator.handle_command(command)
+        line_count += 1
+    return {
+        'lines': line_count,
+        'pen_up_distance': emulator.pen_distance - emulator.pen_down_distance,
+        'pen_down_distance': emulator.pen_down_distance,
+        'time': emulator.time,
+    }
@@ -0,0 +1,103 @@
+import collections
+import time
+
+from .gcode import GCodeState
+from .grbl import FEED_OVERRIDE_MAX
+from .grbl import FEED_OVERRIDE_MIN
+from .grbl import GRBL
+from .grbl import GRBL_PLANNER_BLOCKS
+
+# Matches the GRBL planner depth so the window approximates the motion queued on the device.
+DEFAULT_QUEUE_SIZE = GRBL_PLANNER_BLOCKS
+DEFAULT_UPDATE_INTERVAL = 0.25
+
+
+class FeedOverridePolicy:
+    def get_override(self, segment_lengths):
+        """Return a feed override percentage for the pen-down segment lengths queued on the device."""
+        raise NotImplementedError()
+
+
+class SegmentLengthFeedPolicy(FeedOverridePolicy):
+    """Speed up long straight runs and slow down dense detail.
+
+    The override is interpolated between min_percent and max_percent by the mean queued segment length.
+    """
+    def __init__(self, short_length=0.5, long_length=10.0, min_percent=70, max_percent=150):
+        self.short_length = short_length
+        self.long_length = long_length
+        self.min_percent = min_percent
+        self.max_percent = max_percent
+
+    def get_override(self, segment_lengths):
+        if len(segment_lengths) == 0:
+            return 100
+        mean_length = sum(segment_lengths) / len(segment_lengths)
+        t = (mean_length - self.short_length) / (self.long_length - self.short_length)
+        t = max(0.0, min(1.0, t))
+        return int(round(self.min_percent + t * (self.max_percent - self.min_percent)))
+
+
+class FeedOverrideController:
+    """Adjust the GRBL feed override while streaming, and measure the effective speed."""
+    def __init__(
+            self,
+            device,
+            policy,
+            queue_size=DEFAULT_QUEUE_SIZE,
+            update_interval=DEFAULT_UPDATE_INTERVAL,
+            hysteresis=5,
+    ):
+        self.device = device
+        self.policy = policy
+        self.update_interval = update_interval
+        self.hysteresis = hysteresis
+        self.state = GCodeState()
+        self.queue = collections.deque(maxlen=queue_size)
+        self.override = 100
+        self.start_time = time.monotonic()
+        self.last_update_time = None
+        self.distance = 0.0
+        self.pen_down_distance = 0.0
+
+    def ack(self, command):
+        distance = self.state.handle_command(command)
+        if distance == 0.0:
+            return
+        self.distance += distance
+        # Rapid moves ignore the feed override, so only pen-down feed moves steer it.
+        if self.state.is_pen_down() and self.state.motion_mode != 0:
+            self.pen_down_distance += distance
+            self.queue.append(distance)
+
+        now = time.monotonic()
+        if self.policy is None:
+            return
+        if self.last_update_time is None or now - self.last_update_time > self.update_interval:
+            self.last_update_time = now
+            target = self.policy.get_override(list(self.queue))
+            if abs(target - self.override) >= self.hysteresis:
+                self.set_override(target)
+
+    def set_override(self, percent):
+        for step in GRBL.feed_override_steps(self.override, percent):
+            self.device.send_realtime(step)
+        self.override = max(FEED_OVERRIDE_MIN, min(FEED_OVERRIDE_MAX, int(percent)))
+
+    def reset(self):
+        self.set_override(100)
+
+    def get_elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def get_average_speed(self):
+        elapsed = self.get_elapsed()
+        if elapsed == 0.0:
+            return 0.0
+        return self.distance / elapsed
+
+    def get_average_pen_down_speed(self):
+        elapsed = self.get_elapsed()
+        if elapsed == 0.0:
+            return 0.0
+        return self.pen_down_distance / elapsed
@@ -6,11 +6,17 @@ from .mathscene import Path
 from .mathscene import Arc
 from .svg import SVGNode
 from .gcode import GCode
+from .gcode import join_pauses
+from .gcodeio import open_gcode
+from .jobfile import write_job
 from .mathscene import AABB
+from .mathscene import ArcArray
 from .mathscene import euclidian_distance
 from .optimizer import PenPath
+from .optimizer import get_gcode_stats
 from .optimizer import greedy_tsp
 from .optimizer import remove_repeated_ops
+from .profiling import stage
 from .eleksdraw import DRAW_WIDTH_EU
 from .eleksdraw import DRAW_HEIGHT_EU
 
@@ -68,6 +74,13 @@ class Pen:
             return tx
         raise NotImplementedError('Unsupported mode: {}'.format(self.origin_mode))
 
+    def translate_points_device(self, points):
+        if self.origin_mode == OriginMode.LOWER_RIGHT:
+            tx = np.array(points, dtype=float).reshape(-1, 2)
+            tx[:, 0] = self.draw_width - tx[:, 0]
+            return tx
+        raise NotImplementedError('Unsupported mode: {}'.format(self.origin_mode))
+
     def translate_point_svg(self, point):
         # SVG has the origin at the top left, we need to get to positive is up with y components.
         if self.origin_mode == OriginMode.LOWER_RIGHT:
@@ -76,8 +89,18 @@ class Pen:
             return tx
         raise NotImplementedError('Unsupported mode: {}'.format(self.origin_mode))
 
+    def translate_points_svg(self, points):
+        if self.origin_mode == OriginMode.LOWER_RIGHT:
+            tx = np.array(points, dtype=float).reshape(-1, 2)
+            tx[:, 1] = self.draw_height - tx[:, 1]
+            return tx
+        raise NotImplementedError('Unsupported mode: {}'.format(self.origin_mode))
+
 
 class Drawable:
+    # The pen layer the drawable belongs to, None for the default pen.
+    layer = None
+
     def to_gcode(self, pen):
         raise NotImplementedError()
 
@@ -90,6 +113,10 @@ class Drawable:
     def get_pen_path(self):
         raise NotImplementedError()
 
+    def split(self):
+        # Drawables holding many primitives split into one drawable per pen path for ordering.
+        return [self]
+
 
 class DrawPath(Drawable):
     def __init__(self, points):
@@ -211,25 +238,125 @@ class DrawArc(Drawable):
         )
 
 
+class DrawArcs(Drawable):
+    """Many arcs or circles held as one ArcArray, so bounds and output avoid per-arc objects."""
+    def __init__(self, arcs):
+        self.arcs = arcs
+
+    def get_aabb(self):
+        return self.arcs.get_aabb()
+
+    def to_svg_node(self, pen):
+        starts = pen.translate_points_svg(self.arcs.get_start_points()).tolist()
+        ends = pen.translate_points_svg(self.arcs.get_end_points()).tolist()
+        centers = pen.translate_points_svg(self.arcs.centers).tolist()
+        path_components = []
+        for (sx, sy), (ex, ey), (cx, cy), radius, width in zip(starts, ends, centers, self.arcs.radii.tolist(), self.arcs.widths.tolist()):
+            if width >= 2.0 * np.pi - 1e-7:
+                # A full circle is ambiguous as one SVG arc, draw it as two halves.
+                mx, my = 2.0 * cx - sx, 2.0 * cy - sy
+                path_components.append('M{} {} A {r} {r} 0 0 1 {} {} A {r} {r} 0 0 1 {} {}'.format(sx, sy, mx, my, sx, sy, r=radius))
+            else:
+                large_arc = 1 if width > np.pi else 0
+                path_components.append('M{} {} A {r} {r} 0 {} 1 {} {}'.format(sx, sy, large_arc, ex, ey, r=radius))
+        return SVGNode(
+            'path',
+            {
+                'd': ' '.join(path_components),
+                'stroke': pen.get_svg_stroke(),
+                'stroke-width': pen.get_svg_stroke_width(),
+                'fill': 'none',
+            },
+        )
+
+    def to_gcode(self, pen):
+        starts = pen.translate_points_device(self.arcs.get_start_points()).tolist()
+        ends = pen.translate_points_device(self.arcs.get_end_points()).tolist()
+        centers = pen.translate_points_device(self.arcs.centers).tolist()
+        commands = []
+        for start_pt, end_pt, center_pt in zip(starts, ends, centers):
+            commands += [
+                GCode.pen_up(),
+                GCode.move_fast(start_pt),
+                GCode.pen_down(pen.servo_down),
+                GCode.move_arc(
+                    start_pt=start_pt,
+                    end_pt=end_pt,
+                    center_pt=center_pt,
+                    feed_rate=pen.draw_feed_rate,
+                ),
+                GCode.pen_up(),
+            ]
+        return commands
+
+    def split(self):
+        starts = self.arcs.get_start_points()
+        ends = self.arcs.get_end_points()
+        parts = [DrawArc(start_pt, end_pt, center_pt) for start_pt, end_pt, center_pt in zip(starts, ends, self.arcs.centers)]
+        for part in parts:
+            part.layer = self.layer
+        return parts
+
+
 class PenViz:
+    """Drawables for the plotter, each on a pen layer.
+
+    Drawing goes to the current layer, see set_layer. A layer can have its own pen, e.g. another
+    colour, and layers are ordered and drawn one after the other with a pen change in between.
+    """
     def __init__(self):
         self.drawables = []
+        self.layer = None
+        self.pens = {}
+
+    def set_layer(self, layer, pen=None):
+        """Draw on layer from now on, with pen if given instead of the one passed to to_gcode."""
+        self.layer = layer
+        if pen is not None:
+            self.pens[layer] = pen
+
+    def get_pen(self, layer, pen):
+        return self.pens.get(layer, pen)
+
+    def add(self, drawable):
+        drawable.layer = self.layer
+        self.drawables.append(drawable)
 
     def draw_path(self, points):
-        self.drawables.append(DrawPath(points))
+        self.add(DrawPath(points))
 
     def draw_arc(self, start_pt, end_pt, center_pt):
-        self.drawables.append(DrawArc(start_pt, end_pt, center_pt))
+        self.add(DrawArc(start_pt, end_pt, center_pt))
 
     def draw_circle(self, center_pt, radius):
         point = center_pt + np.array([0, radius])
         self.draw_arc(point, point, center_pt)
 
-    def to_gcode(self, pen, optimize=False):
-        commands = []
-        drawables = self.drawables
+    def draw_arcs(self, start_pts, end_pts, center_pts):
+        self.add(DrawArcs(ArcArray.from_absolute_points(start_pts, end_pts, center_pts)))
 
+    def draw_circles(self, center_pts, radii):
+        self.add(DrawArcs(ArcArray.from_circles(center_pts, radii)))
+
+    def get_layers(self):
+        """Layers in the order they were first drawn on, which is the order they are plotted in."""
+        return list(dict.fromkeys(drawable.layer for drawable in self.drawables))
+
+    def get_layer(self, layer):
+        return self.with_drawables([drawable for drawable in self.drawables if drawable.layer == layer])
+
+    def with_drawables(self, drawables):
+        """A PenViz with the same layer pens holding drawables, which keep their layers."""
+        viz = PenViz()
+        viz.drawables = drawables
+        viz.layer = self.layer
+        viz.pens = dict(self.pens)
+        return viz
+
+    def _drawables_to_gcode(self, drawables, pen, optimize):
+        commands = []
         if optimize:
+            drawables = [part for drawable in drawables for part in drawable.split()]
             pen_paths = [drawable.get_pen_path() for drawable in drawables]
             order = greedy_tsp(pen_paths)
             drawables = [drawables[i] for i in order]
@@ -239,19 +366,56 @@ class PenViz:
 
         if optimize:
             commands = remove_repeated_ops(commands)
+        return commands, len(drawables)
+
+    def to_layer_gcode(self, pen, optimize=False):
+        """One program per layer as (layer, commands), each drawn with the layer's pen and ordered on its own."""
+        with stage('penviz.to_gcode') as span:
+            layer_drawables = {}
+            for drawable in self.drawables:
+                layer_drawables.setdefault(drawable.layer, []).append(drawable)
+            programs = []
+            for layer, drawables in layer_drawables.items():
+                commands, strokes = self._drawables_to_gcode(drawables, self.get_pen(layer, pen), optimize)
+                programs.append((layer, commands))
+                span.count('strokes', strokes)
+                span.count('lines', len(commands))
+            span.count('layers', len(programs))
+        return programs
 
-        return commands
+    def to_gcode(self, pen, optimize=False):
+        """A single program drawing every layer, pausing with M0 for a pen change between layers."""
+        return join_pauses([commands for _, commands in self.to_layer_gcode(pen, optimize=optimize)])
+
+    def get_layer_stats(self, pen, optimize=False):
+        """Per layer (layer, stats) with the line count, distances and estimated time of its program."""
+        return [(layer, get_gcode_stats(commands)) for layer, commands in self.to_layer_gcode(pen, optimize=optimize)]
 
     def get_aabb(self):
+        # Gather every path point and arc into arrays so the bounds are a few vectorized reductions.
         aabb = AABB()
+        paths = []
+        arcs = []
         for drawable in self.drawables:
-            aabb.merge_aabb(drawable.get_aabb())
+            if type(drawable) == DrawPath:
+                paths.append(np.asarray(drawable.path.points, dtype=float).reshape(-1, 2))
+            elif type(drawable) == DrawArc:
+                arcs.append(drawable.arc)
+            else:
+                aabb.merge_aabb(drawable.get_aabb())
+
+        if len(paths) != 0:
+            aabb.add_points(np.concatenate(paths))
+
+        if len(arcs) != 0:
+            aabb.merge_aabb(ArcArray.from_arcs(arcs).get_aabb())
+
         return aabb
 
     def to_svg(self, pen):
         width = pen.draw_width
         height = pen.draw_height
-        svg = '\n'.join([drawable.to_svg_node(pen).to_svg() for drawable in self.drawables])
+        svg = '\n'.join([drawable.to_svg_node(self.get_pen(drawable.layer, pen)).to_svg() for drawable in self.drawables])
         svg = f'<svg width="{width}mm" height="{height}mm" version="1.1" viewBox="0 0 {width} {height}">' + svg + '</svg>'
         return svg
 
@@ -260,5 +424,9 @@ class PenViz:
         display(HTML(self.to_svg(pen)))
 
     def save_gcode(self, out_path, pen, optimize=False):
-        with open(out_path, 'w') as w:
+        # A .gz, .xz or .bz2 path is compressed as it is written.
+        with open_gcode(out_path, 'w') as w:
             w.write('\n'.join(self.to_gcode(pen, optimize=optimize)))
+
+    def save_job(self, out_path, pen, optimize=False):
+        write_job(out_path, self.to_gcode(pen, optimize=optimize), pen)
@@ -1,11 +1,11 @@
 import time
 
-import halo
-import tqdm
-
 from . import eleksdraw
-from . import gcode
 from . import grbl
+from .gcodewords import GCode
+from .profiling import profiled
+from .profiling import stage
+
 
 class GCodeCommandWrapper:
     def __init__(self, device, gcode):
@@ -32,29 +32,116 @@ def soft_reset(device):
         device.run_command(grbl.GRBL.soft_reset())
 
 
-def run_gcode(gcodes, device):
+def start_device(device):
+    commands = GCodeCommandWrapper(device, GCode)
+    device.run_command('', soft_error=True)
+    if device.get_state() != eleksdraw.State.IDLE:
+        raise RuntimeError('Device not ready to draw in state: {}'.format(device.get_state()))
+    # GRBL recommends a soft reset on start.
+    device.run_command(grbl.GRBL.soft_reset())
+    commands.set_units_mm()  # pylint: disable=E1101
+    commands.set_coordinates_absolute()  # pylint: disable=E1101
+    commands.set_feed_rate(1000)  # pylint: disable=E1101
+
+
+def wait_for_idle(device, interval=1.0):
+    while device.get_state() in (eleksdraw.State.RUN, eleksdraw.State.JOG):
+        time.sleep(interval)
+
+
+def run_commands(commands, device):
+    """Send a few commands one at a time, without progress output or streaming."""
+    with eleksdraw.open_device(device) as device:
+        start_device(device)
+        for command in commands:
+            device.run_command(command)
+        wait_for_idle(device, interval=0.05)
+
+
+def prompt_pen_change(index):
+    """Wait at an M0 pause for someone to change the pen."""
+    input('Paused at line {} for a pen change, press Enter to continue...'.format(index + 1))
+
+
+@profiled('plotter.run_gcode')
+def run_gcode(gcodes, device, checkpoint=None, feed_policy=None, telemetry=None, on_pause=prompt_pen_change, line_count=None):
+    # These load numpy and take a while to import, which commands sending a word or two with
+    # run_commands shouldn't pay for.
+    import halo
+    import tqdm
+
+    from . import streaming
+    from .override import FeedOverrideController
+
     with eleksdraw.open_device(device) as device:
-        commands = GCodeCommandWrapper(device, gcode.GCode)
         with halo.Halo(text='Startup...', spinner='hearts'):
-            device.run_command('', soft_error=True)
-            if device.get_state() != eleksdraw.State.IDLE:
-                raise RuntimeError('Device not ready to draw in state: {}'.format(device.get_state()))
-            # GRBL recommends a soft reset on start.
-            device.run_command(grbl.GRBL.soft_reset())
-            commands.set_units_mm()  # pylint: disable=E1101
-            commands.set_coordinates_absolute()  # pylint: disable=E1101
-            commands.set_feed_rate(1000)  # pylint: disable=E1101
+            start_device(device)
+
+        speed = FeedOverrideController(device, feed_policy)
+        # Lines are encoded a chunk at a time as they are reached, so a program streamed from a file
+        # never sits in memory whole.
+        program = streaming.ProgramWindow(gcodes)
+        streamer = streaming.GCodeStreamer(device, program)
+        if line_count is None and hasattr(gcodes, '__len__'):
+            line_count = len(gcodes)
+        progress = tqdm.tqdm(total=line_count)
+        last_postfix_time = time.monotonic()
+
+        def on_send(index, rx_bytes):
+            telemetry.send_line(program.get_line(index), rx_bytes)
+
+        def on_ack(index):
+            nonlocal last_postfix_time
+            command = program.get_line(index)
+            if telemetry is not None:
+                telemetry.ack_line()
+            if checkpoint is not None:
+                checkpoint.ack(index, command)
+            speed.ack(command)
+            progress.update()
+            if time.monotonic() - last_postfix_time > 1.0:
+                last_postfix_time = time.monotonic()
+                progress.set_postfix_str('{:.1f} mm/s, feed {}%'.format(speed.get_average_speed(), speed.override))
+
+        def on_job_pause(index):
+            progress.clear()
+            on_pause(index)
+            progress.refresh()
 
         try:
-            for command in tqdm.tqdm(gcodes):
-                device.run_command(command)
+            with stage('streaming.run') as span:
+                streamer.run(
+                    on_send=on_send if telemetry is not None else None,
+                    on_ack=on_ack,
+                    wants_status=telemetry.wants_status if telemetry is not None else None,
+                    on_status=telemetry.record_status if telemetry is not None else None,
+                    on_pause=on_job_pause if on_pause is not None else None,
+                )
+                span.count('lines', program.end)
+                span.count('bytes', program.encoded_bytes)
         except KeyboardInterrupt:
             with halo.Halo(text='Terminating...', spinner='monkey'):
-                device.run_command(gcode.GCode.pen_up())
-                device.run_command(gcode.GCode.move_fast((0, 0)))
+                speed.reset()
+                # Interrupted at a pause, GRBL holds until a cycle start.
+                device.send_realtime(grbl.GRBL.cycle_start())
+                streamer.drain(on_ack)
+                device.run_command(GCode.pen_up())
+                device.run_command(GCode.move_fast((0, 0)))
+        finally:
+            progress.close()
+            if checkpoint is not None and not checkpoint.is_complete():
+                checkpoint.save()
+                print('Checkpoint at line {} of {}: {}'.format(checkpoint.line, checkpoint.line_count, checkpoint.path))
 
         with halo.Halo(text='Waiting for run to complete...', spinner='hearts'):
-            while device.get_state() == eleksdraw.State.RUN:
-                time.sleep(1.0)
+            wait_for_idle(device)
 
+        speed.reset()
+        if telemetry is not None:
+            telemetry.finish()
+            telemetry.print_summary()
+        print('Average speed: {:.1f} mm/s (pen down {:.1f} mm/s)'.format(
+            speed.get_average_speed(),
+            speed.get_average_pen_down_speed(),
+        ))
         print('Final state: {}'.format(device.get_state()))
@@ -0,0 +1,175 @@
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Set to an output path (or 1 for a summary only) to profile the command line tools.
+PROFILE_ENV = 'ROBOPEN_PROFILE'
+PSTATS_EXTENSIONS = ('.prof', '.pstats')
+TRACE_EXTENSIONS = ('.json',)
+
+_profiler = None
+
+
+class Span:
+    """One timed run of a stage, with the counters recorded while it was open."""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.counters = {}
+        self.start_time = None
+        self.duration = None
+        self.thread_id = threading.get_ident()
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self.start_time
+        self.profiler.spans.append(self)
+
+
+class NullSpan:
+    """Stands in for a Span when profiling is off, so instrumented code costs one call."""
+    def count(self, name, value=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Profiler:
+    """Collect stage spans, and optionally a cProfile of everything that ran while enabled."""
+    def __init__(self, use_cprofile=False):
+        self.spans = []
+        self.start_time = time.perf_counter()
+        self.cprofile = cProfile.Profile() if use_cprofile else None
+
+    def start(self):
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+    def get_totals(self):
+        """Per stage name: calls, total seconds and summed counters, in order of first use."""
+        totals = {}
+        for span in sorted(self.spans, key=lambda span: span.start_time):
+            total = totals.setdefault(span.name, {'calls': 0, 'seconds': 0.0, 'counters': {}})
+            total['calls'] += 1
+            total['seconds'] += span.duration
+            for name, value in span.counters.items():
+                total['counters'][name] = total['counters'].get(name, 0) + value
+        return totals
+
+    def to_trace(self):
+        """The spans as Chrome trace events, viewable in chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            events.append({
+                'name': span.name,
+                'cat': span.name.split('.')[0],
+                'ph': 'X',
+                'ts': 1e6 * (span.start_time - self.start_time),
+                'dur': 1e6 * span.duration,
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': span.counters,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        if path.endswith(PSTATS_EXTENSIONS):
+            if self.cprofile is None:
+                raise RuntimeError('Profiler was not started with cProfile, cannot write {}'.format(path))
+            self.cprofile.dump_stats(path)
+        elif path.endswith(TRACE_EXTENSIONS):
+            with open(path, 'w') as w:
+                json.dump(self.to_trace(), w)
+        else:
+            raise RuntimeError('Unknown profile format: {}'.format(path))
+
+    def print_summary(self, file=sys.stderr):
+        print('{:<32} {:>7} {:>10}  {}'.format('stage', 'calls', 'seconds', 'counters'), file=file)
+        for name, total in self.get_totals().items():
+            counters = ', '.join('{} {}'.format(key, value) for key, value in total['counters'].items())
+            print('{:<32} {:>7} {:>10.4f}  {}'.format(name, total['calls'], total['seconds'], counters), file=file)
+
+
+def enable(use_cprofile=False):
+    global _profiler
+    disable()
+    _profiler = Profiler(use_cprofile=use_cprofile)
+    _profiler.start()
+    return _profiler
+
+
+def disable():
+    """Stop profiling, returning the profiler that was running if any."""
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def stage(name):
+    """Time a block as a named stage: with stage('svg.parse') as span: span.count('paths', n)."""
+    if _profiler is None:
+        return NULL_SPAN
+    return Span(_profiler, name)
+
+
+def profiled(name):
+    """Decorator timing every call of a function as a stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with Span(_profiler, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def parse_profile_value(value):
+    """The profile output a --profile or ROBOPEN_PROFILE value asks for: None for no profiling, '' for
+    a summary only, or the path to write.
+
+    An unknown format is refused up front, not once the profiled run is over.
+    """
+    if not value or value == '0':
+        return None
+    if value == '1':
+        return ''
+    if not value.endswith(PSTATS_EXTENSIONS + TRACE_EXTENSIONS):
+        raise RuntimeError('Unknown profile format: {}, expected 1 or a path ending in {}'.format(
+            value, ', '.join(PSTATS_EXTENSIONS + TRACE_EXTENSIONS)))
+    return value
+
+
+def get_env_profile_path():
+    """The profile output requested through the environment, '' for a summary only, or None."""
+    return parse_profile_value(os.environ.get(PROFILE_ENV))
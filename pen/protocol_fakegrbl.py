@@ -0,0 +1,2 @@
+# pyserial looks up url handlers as <package>.protocol_<scheme>, see pen.eleksdraw.
+from .fakegrbl import FakeGRBLSerial as Serial  # noqa: F401
@@ -0,0 +1,322 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import serial
+import serial.tools.list_ports
+
+from . import eleksdraw
+from . import streaming
+from .defaults import DEFAULT_API_PORT
+from .gcode import GCode
+from .grbl import GRBL
+from .optimizer import get_gcode_stats
+
+# EleksDraw boards use a CH340 USB serial adapter.
+CH340_VID = 0x1A86
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def discover_devices():
+    ports = []
+    for port in serial.tools.list_ports.comports():
+        if port.vid == CH340_VID or 'USB' in port.device:
+            ports.append(port.device)
+    return sorted(ports)
+
+
+class PlotJob:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, job_id, commands, name=None):
+        self.job_id = job_id
+        self.name = name
+        self.commands = commands
+        # Nobody is at an unattended plotter to change the pen, so a layered job would be drawn with one.
+        for index, command in enumerate(commands):
+            if GCode.is_pause_command(command):
+                raise RuntimeError('Job pauses for a pen change at line {}, submit one job per layer, e.g. with robopen.py svg --split_layers'.format(index + 1))
+        self.estimated_duration = get_gcode_stats(commands)['time']
+        self.status = self.QUEUED
+        self.device = None
+        self.attempts = 0
+        self.lines_sent = 0
+        self.error = None
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+
+    def to_dict(self):
+        return {
+            'id': self.job_id,
+            'name': self.name,
+            'status': self.status,
+            'device': self.device,
+            'lines': len(self.commands),
+            'lines_sent': self.lines_sent,
+            'attempts': self.attempts,
+            'estimated_duration': self.estimated_duration,
+            'error': self.error,
+            'submit_time': self.submit_time,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+        }
+
+
+class DeviceWorker(threading.Thread):
+    IDLE = 'idle'
+    BUSY = 'busy'
+    ALARM = 'alarm'
+    OFFLINE = 'offline'
+
+    def __init__(self, scheduler, port):
+        super(DeviceWorker, self).__init__(daemon=True)
+        self.scheduler = scheduler
+        self.port = port
+        self.device = None
+        self.status = self.IDLE
+        self.job = None
+        self.unlock_requested = threading.Event()
+
+    def run(self):
+        while not self.scheduler.is_stopped():
+            if self.status == self.ALARM:
+                # An alarm needs a person to look at the plotter before it takes more work.
+                if not self.unlock_requested.wait(timeout=0.1):
+                    continue
+                self.unlock_requested.clear()
+                self._unlock()
+                continue
+            job = self.scheduler.next_job(self)
+            if job is None:
+                continue
+            self.job = job
+            self.status = self.BUSY
+            try:
+                self._stream(job)
+            except (RuntimeError, serial.SerialException) as e:
+                self.status = self._get_failure_status()
+                self.scheduler.job_failed(job, self, e)
+            else:
+                self.status = self.IDLE
+                self.scheduler.job_done(job)
+            finally:
+                self.job = None
+        self._close()
+
+    def _open(self):
+        if self.device is None:
+            self.device = eleksdraw.EleksDrawDevice(serial_port=self.port)
+            self.device.start()
+            self.device.run_command('', soft_error=True)
+        return self.device
+
+    def _close(self):
+        if self.device is not None:
+            self.device.stop()
+            self.device = None
+
+    def _get_failure_status(self):
+        try:
+            if self.device is not None and self.device.get_state() == eleksdraw.State.ALARM:
+                return self.ALARM
+        except (RuntimeError, serial.SerialException):
+            pass
+        self._close()
+        return self.OFFLINE
+
+    def _unlock(self):
+        try:
+            self._open().run_command(GRBL.unlock())
+            self.status = self.IDLE
+        except (RuntimeError, serial.SerialException):
+            self._close()
+
+    def _stream(self, job):
+        device = self._open()
+        state = device.get_state()
+        if state != eleksdraw.State.IDLE:
+            raise RuntimeError('Device not ready to draw in state: {}'.format(state))
+        for command in [GCode.set_units_mm(), GCode.set_coordinates_absolute()]:
+            device.run_command(command)
+        def on_ack(index):
+            job.lines_sent += 1
+
+        streaming.GCodeStreamer(device, job.commands).run(on_ack=on_ack)
+        while device.get_state() == eleksdraw.State.RUN:
+            time.sleep(0.1)
+        state = device.get_state()
+        if state != eleksdraw.State.IDLE:
+            raise RuntimeError('Job ended in state: {}'.format(state))
+
+    def to_dict(self):
+        return {
+            'port': self.port,
+            'status': self.status,
+            'job': None if self.job is None else self.job.job_id,
+        }
+
+
+class JobScheduler:
+    """Queue G-code jobs and stream them to a fleet of plotters concurrently.
+
+    Idle devices take the longest queued job first (LPT scheduling), which keeps the finishing times of
+    the fleet close using the GCodeEmulator duration estimates. A job that fails on a device, e.g. from an
+    alarm, goes back in the queue for another device.
+    """
+    def __init__(self, ports, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.condition = threading.Condition()
+        self.queue = []
+        self.jobs = {}
+        self.job_ids = itertools.count(1)
+        self.stopped = False
+        self.workers = [DeviceWorker(self, port) for port in ports]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+    def is_stopped(self):
+        return self.stopped
+
+    def submit(self, commands, name=None):
+        with self.condition:
+            job = PlotJob(next(self.job_ids), commands, name=name)
+            self.jobs[job.job_id] = job
+            self._enqueue(job)
+            return job
+
+    def _enqueue(self, job):
+        job.status = PlotJob.QUEUED
+        heapq.heappush(self.queue, (-job.estimated_duration, job.job_id))
+        self.condition.notify()
+
+    def next_job(self, worker, timeout=0.1):
+        with self.condition:
+            if len(self.queue) == 0 and not self.stopped:
+                self.condition.wait(timeout=timeout)
+            if len(self.queue) == 0 or self.stopped:
+                return None
+            _, job_id = heapq.heappop(self.queue)
+            job = self.jobs[job_id]
+            job.status = PlotJob.RUNNING
+            job.device = worker.port
+            job.attempts += 1
+            job.lines_sent = 0
+            job.start_time = time.time()
+            return job
+
+    def job_done(self, job):
+        with self.condition:
+            job.status = PlotJob.DONE
+            job.end_time = time.time()
+            job.error = None
+
+    def job_failed(self, job, worker, error):
+        with self.condition:
+            job.error = '{}: {}'.format(worker.port, error)
+            if job.attempts >= self.max_attempts:
+                job.status = PlotJob.FAILED
+                job.end_time = time.time()
+            else:
+                self._enqueue(job)
+
+    def unlock(self, port):
+        for worker in self.workers:
+            if worker.port == port:
+                worker.unlock_requested.set()
+                return True
+        return False
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def get_status(self):
+        with self.condition:
+            queued = sum(self.jobs[job_id].estimated_duration for _, job_id in self.queue)
+            return {
+                'devices': [worker.to_dict() for worker in self.workers],
+                'jobs': [job.to_dict() for job in self.jobs.values()],
+                'queued_duration': queued,
+            }
+
+
+class SchedulerRequestHandler(BaseHTTPRequestHandler):
+    """JSON API: POST /jobs, GET /jobs, GET /jobs/<id>, GET /devices, POST /devices/unlock?port=<port>"""
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        scheduler = self.server.scheduler
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if parts == ['jobs']:
+            self._send_json(scheduler.get_status()['jobs'])
+        elif len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            job = scheduler.get_job(int(parts[1]))
+            if job is None:
+                self._send_json({'error': 'Unknown job'}, status=404)
+            else:
+                self._send_json(job.to_dict())
+        elif parts == ['devices']:
+            self._send_json(scheduler.get_status()['devices'])
+        else:
+            self._send_json({'error': 'Not found'}, status=404)
+
+    def do_POST(self):
+        scheduler = self.server.scheduler
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split('/') if part]
+        if parts == ['jobs']:
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                text = self.rfile.read(length).decode('utf-8')
+                commands = [line.strip() for line in text.splitlines() if line.strip()]
+                job = scheduler.submit(commands, name=query.get('name', [None])[0])
+            except (RuntimeError, ValueError) as e:
+                # A program the estimator can't parse would fail on the plotter too.
+                self._send_json({'error': str(e)}, status=400)
+                return
+            self._send_json(job.to_dict(), status=201)
+        elif parts == ['devices', 'unlock'] and 'port' in query:
+            if scheduler.unlock(query['port'][0]):
+                self._send_json({'port': query['port'][0]})
+            else:
+                self._send_json({'error': 'Unknown device'}, status=404)
+        else:
+            self._send_json({'error': 'Not found'}, status=404)
+
+
+class SchedulerServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, scheduler, address):
+        HTTPServer.__init__(self, address, SchedulerRequestHandler)
+        self.scheduler = scheduler
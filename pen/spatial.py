@@ -0,0 +1,296 @@
+import math
+
+import numpy as np
+
+from .mathscene import DISTANCE_EPSILON
+
+# Cell coordinates are packed into one int64 key, offset so both halves stay positive without overflow.
+CELL_KEY_OFFSET = 1 << 30
+
+
+def get_local_offsets(counts):
+    """For runs of the given lengths laid end to end, the position of each element within its run."""
+    counts = np.asarray(counts, dtype=int)
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def get_segment_bounds(starts, ends):
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    return np.stack([
+        np.minimum(starts[:, 0], ends[:, 0]),
+        np.maximum(starts[:, 0], ends[:, 0]),
+        np.minimum(starts[:, 1], ends[:, 1]),
+        np.maximum(starts[:, 1], ends[:, 1]),
+    ], axis=1)
+
+
+def get_box_distances(bounds, point):
+    """Distance from a point to each [x0, x1, y0, y1] box, zero inside."""
+    dx = np.maximum(np.maximum(bounds[:, 0] - point[0], point[0] - bounds[:, 1]), 0.0)
+    dy = np.maximum(np.maximum(bounds[:, 2] - point[1], point[1] - bounds[:, 3]), 0.0)
+    return np.hypot(dx, dy)
+
+
+def get_default_cell_size(bounds):
+    # About one item per cell, but no smaller than a typical item.
+    if len(bounds) == 0:
+        return 1.0
+    width = bounds[:, 1].max() - bounds[:, 0].min()
+    height = bounds[:, 3].max() - bounds[:, 2].min()
+    area = max(width, DISTANCE_EPSILON) * max(height, DISTANCE_EPSILON)
+    sizes = np.maximum(bounds[:, 1] - bounds[:, 0], bounds[:, 3] - bounds[:, 2])
+    return max(float(np.median(sizes)), float(np.sqrt(area / len(bounds))), DISTANCE_EPSILON)
+
+
+class GridIndex:
+    """Uniform grid over axis aligned [x0, x1, y0, y1] boxes, with points and segments as special cases.
+
+    Items get consecutive ids in insertion order. Every query comes in a bulk form over arrays of
+    boxes so scene-wide passes stay in numpy. Removed items are skipped by queries but keep their id.
+    """
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.bounds = np.zeros((0, 4))
+        self.alive = np.zeros(0, dtype=bool)
+        self.live_count = 0
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=int)
+        self.pending = []
+        self.cells = {}
+        # Occupied cells and overall item bounds, which only ever grow.
+        self.cell_lo = None
+        self.cell_hi = None
+        self.extent = None
+
+    @classmethod
+    def from_bounds(cls, bounds, cell_size=None):
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        if cell_size is None:
+            cell_size = get_default_cell_size(bounds)
+        index = cls(cell_size)
+        index.insert(bounds)
+        return index
+
+    @classmethod
+    def from_points(cls, points, cell_size=None):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return cls.from_bounds(points[:, [0, 0, 1, 1]], cell_size=cell_size)
+
+    @classmethod
+    def from_segments(cls, starts, ends, cell_size=None):
+        return cls.from_bounds(get_segment_bounds(starts, ends), cell_size=cell_size)
+
+    def __len__(self):
+        return self.live_count
+
+    def insert(self, bounds):
+        """Add boxes and return their ids."""
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        ids = np.arange(len(self.bounds), len(self.bounds) + len(bounds))
+        self.bounds = np.concatenate([self.bounds, bounds])
+        self.alive = np.concatenate([self.alive, np.ones(len(bounds), dtype=bool)])
+        self.live_count += len(bounds)
+        if len(bounds) == 0:
+            return ids
+        self._add_cells(bounds, ids)
+        return ids
+
+    def _add_cells(self, bounds, ids):
+        cell_ids, keys = self._get_cells(bounds)
+        # Merged into the sorted cell table lazily on the next query.
+        self.pending.append((keys, ids[cell_ids]))
+
+        lo, hi = self._get_cell_ranges(bounds)
+        extent = np.array([bounds[:, 0].min(), bounds[:, 1].max(), bounds[:, 2].min(), bounds[:, 3].max()])
+        if self.extent is None:
+            self.cell_lo, self.cell_hi, self.extent = lo.min(axis=0), hi.max(axis=0), extent
+        else:
+            self.cell_lo = np.minimum(self.cell_lo, lo.min(axis=0))
+            self.cell_hi = np.maximum(self.cell_hi, hi.max(axis=0))
+            self.extent = np.array([
+                min(self.extent[0], extent[0]),
+                max(self.extent[1], extent[1]),
+                min(self.extent[2], extent[2]),
+                max(self.extent[3], extent[3]),
+            ])
+
+    def insert_points(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return self.insert(points[:, [0, 0, 1, 1]])
+
+    def insert_segments(self, starts, ends):
+        return self.insert(get_segment_bounds(starts, ends))
+
+    def remove(self, ids):
+        ids = np.unique(np.asarray(ids, dtype=int).reshape(-1))
+        self.live_count -= int(np.count_nonzero(self.alive[ids]))
+        self.alive[ids] = False
+        if 0 < 4 * self.live_count < len(self.bounds) and 8 * self.live_count < len(self.ids) + sum(len(ids) for _, ids in self.pending):
+            self._rebuild()
+
+    def _rebuild(self):
+        # Once most items are gone, regrid the survivors at a cell size matching their density so
+        # queries don't wade through dead entries and empty cells.
+        live = np.nonzero(self.alive)[0]
+        bounds = self.bounds[live]
+        self.cell_size = get_default_cell_size(bounds)
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=int)
+        self.pending = []
+        self.cells = {}
+        self.cell_lo = self.cell_hi = self.extent = None
+        self._add_cells(bounds, live)
+
+    def _flush(self):
+        if len(self.pending) == 0:
+            return
+        keys = np.concatenate([self.keys] + [keys for keys, _ in self.pending])
+        ids = np.concatenate([self.ids] + [ids for _, ids in self.pending])
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.ids = ids[order]
+        self.pending = []
+        # Slices of ids per cell, for single point queries that only touch a few cells.
+        cell_keys, starts, counts = np.unique(self.keys, return_index=True, return_counts=True)
+        self.cells = dict(zip(cell_keys.tolist(), zip(starts.tolist(), (starts + counts).tolist())))
+
+    def _get_cell_ranges(self, bounds):
+        lo = np.floor(bounds[:, [0, 2]] / self.cell_size).astype(np.int64)
+        hi = np.floor(bounds[:, [1, 3]] / self.cell_size).astype(np.int64)
+        return lo, hi
+
+    def _get_cells(self, bounds, clip_to=None):
+        lo, hi = self._get_cell_ranges(bounds)
+        if clip_to is not None:
+            # No need to visit cells beyond the occupied ones.
+            lo = np.maximum(lo, clip_to[0])
+            hi = np.minimum(hi, clip_to[1])
+        spans = np.maximum(hi - lo + 1, 0)
+        counts = spans[:, 0] * spans[:, 1]
+        box_ids = np.repeat(np.arange(len(bounds)), counts)
+        local = get_local_offsets(counts)
+        cx = lo[box_ids, 0] + local % spans[box_ids, 0]
+        cy = lo[box_ids, 1] + local // spans[box_ids, 0]
+        return box_ids, ((cx + CELL_KEY_OFFSET) << 32) + (cy + CELL_KEY_OFFSET)
+
+    def query_boxes(self, bounds):
+        """All (query index, item id) pairs where a query box overlaps a live item, sorted by query."""
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        self._flush()
+        if len(self.bounds) == 0 or len(bounds) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        query_ids, keys = self._get_cells(bounds, clip_to=(self.cell_lo, self.cell_hi))
+        lo = np.searchsorted(self.keys, keys, side='left')
+        hi = np.searchsorted(self.keys, keys, side='right')
+        counts = hi - lo
+        queries = np.repeat(query_ids, counts)
+        items = self.ids[np.repeat(lo, counts) + get_local_offsets(counts)]
+
+        # Boxes sharing several cells meet more than once.
+        pairs = np.unique(queries.astype(np.int64) * len(self.bounds) + items)
+        queries = pairs // len(self.bounds)
+        items = pairs % len(self.bounds)
+        a = bounds[queries]
+        b = self.bounds[items]
+        keep = self.alive[items] & (a[:, 0] <= b[:, 1]) & (a[:, 1] >= b[:, 0]) & (a[:, 2] <= b[:, 3]) & (a[:, 3] >= b[:, 2])
+        return queries[keep].astype(int), items[keep].astype(int)
+
+    def query_box(self, box):
+        """Ids of live items overlapping one [x0, x1, y0, y1] box."""
+        return self.query_boxes([box])[1]
+
+    def _get_point_candidates(self, point, radius):
+        # Scalar path for one query, numpy call overhead dominates when only a few cells are visited.
+        cx0 = math.floor((point[0] - radius) / self.cell_size)
+        cx1 = math.floor((point[0] + radius) / self.cell_size)
+        cy0 = math.floor((point[1] - radius) / self.cell_size)
+        cy1 = math.floor((point[1] + radius) / self.cell_size)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > max(16, self.live_count // 16):
+            # A vectorized pass over every item beats a python loop over many cells.
+            return np.nonzero(self.alive)[0]
+        chunks = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self.cells.get(((cx + CELL_KEY_OFFSET) << 32) + (cy + CELL_KEY_OFFSET))
+                if cell is not None:
+                    chunks.append(self.ids[cell[0]:cell[1]])
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=int)
+        ids = np.unique(np.concatenate(chunks))
+        return ids[self.alive[ids]]
+
+    def query_radius(self, point, radius):
+        """Ids of live items within radius of a point, nearest first, and their distances."""
+        point = np.asarray(point, dtype=float)
+        self._flush()
+        ids = self._get_point_candidates(point, radius)
+        distances = get_box_distances(self.bounds[ids], point)
+        keep = distances <= radius
+        ids, distances = ids[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return ids[order], distances[order]
+
+    def _get_ring_chunks(self, cx, cy, ring):
+        # Id slices of the occupied cells on the square ring at Chebyshev distance ring from (cx, cy).
+        lo_x, lo_y = int(self.cell_lo[0]), int(self.cell_lo[1])
+        hi_x, hi_y = int(self.cell_hi[0]), int(self.cell_hi[1])
+        chunks = []
+        for x in range(max(cx - ring, lo_x), min(cx + ring, hi_x) + 1):
+            if x == cx - ring or x == cx + ring:
+                ys = range(max(cy - ring, lo_y), min(cy + ring, hi_y) + 1)
+            else:
+                ys = [y for y in (cy - ring, cy + ring) if lo_y <= y <= hi_y]
+            for y in ys:
+                cell = self.cells.get(((x + CELL_KEY_OFFSET) << 32) + (y + CELL_KEY_OFFSET))
+                if cell is not None:
+                    chunks.append(self.ids[cell[0]:cell[1]])
+        return chunks
+
+    def _get_nearest(self, point, ids, k):
+        distances = get_box_distances(self.bounds[ids], point)
+        order = np.argsort(distances, kind='stable')[:k]
+        return ids[order], distances[order]
+
+    def query_knn(self, point, k=1):
+        """Ids of the k nearest live items to a point, nearest first, and their distances."""
+        point = np.asarray(point, dtype=float)
+        self._flush()
+        if self.live_count == 0:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        k = min(k, self.live_count)
+        cx = math.floor(point[0] / self.cell_size)
+        cy = math.floor(point[1] / self.cell_size)
+        last_ring = max(abs(cx - self.cell_lo[0]), abs(cx - self.cell_hi[0]), abs(cy - self.cell_lo[1]), abs(cy - self.cell_hi[1]))
+        # Past this many cells a vectorized pass over every item is cheaper.
+        budget = max(64, self.live_count // 8)
+        chunks = []
+        visited = 0
+        for ring in range(int(last_ring) + 1):
+            visited += max(1, 8 * ring)
+            if visited > budget:
+                break
+            chunks.extend(self._get_ring_chunks(cx, cy, ring))
+            if len(chunks) == 0:
+                continue
+            ids = np.unique(np.concatenate(chunks))
+            ids = ids[self.alive[ids]]
+            if len(ids) < k:
+                continue
+            ids, distances = self._get_nearest(point, ids, k)
+            # Cells beyond this ring are at least ring cells away, so nearer hits are final.
+            if ring == last_ring or distances[-1] <= ring * self.cell_size:
+                return ids, distances
+        return self._get_nearest(point, np.nonzero(self.alive)[0], k)
+
+    def query_radius_pairs(self, points, radius):
+        """All (query index, item id) pairs with the item within radius of the query point."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        boxes = np.stack([points[:, 0] - radius, points[:, 0] + radius, points[:, 1] - radius, points[:, 1] + radius], axis=1)
+        queries, items = self.query_boxes(boxes)
+        b = self.bounds[items]
+        p = points[queries]
+        dx = np.maximum(np.maximum(b[:, 0] - p[:, 0], p[:, 0] - b[:, 1]), 0.0)
+        dy = np.maximum(np.maximum(b[:, 2] - p[:, 1], p[:, 1] - b[:, 3]), 0.0)
+        keep = np.hypot(dx, dy) <= radius
+        return queries[keep], items[keep]
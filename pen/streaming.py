@@ -0,0 +1,276 @@
+import collections
+import itertools
+import re
+import time
+
+import numpy as np
+
+from .eleksdraw import State
+from .eleksdraw import Status
+from .gcodewords import GCode
+from .grbl import GRBL
+from .grbl import GRBL_PLANNER_BLOCKS
+from .grbl import GRBL_RX_BUFFER_SIZE
+
+DEFAULT_ENCODE_CHUNK = 4096
+POLL_INTERVAL = 0.001
+# How often to ask for a status report while waiting for GRBL to hold at a pause.
+PAUSE_POLL_INTERVAL = 0.05
+# Lines that may hold an M0 word, GCode.is_pause_command decides which of them pause.
+PAUSE_CANDIDATE_RE = re.compile(rb'[Mm][ \t]*[-+]?0*\.?0*(?![1-9])')
+
+
+class EncodedProgram:
+    """Program lines encoded once into a single buffer.
+
+    Line i, with its newline, is data[offsets[i]:offsets[i + 1]]. Sending slices the buffer through a
+    memoryview, so streaming allocates nothing per line.
+    """
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        self.view = memoryview(data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_line(self, index):
+        return str(self.view[int(self.offsets[index]):int(self.offsets[index + 1]) - 1], 'utf-8')
+
+    def get_line_bytes(self, index):
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def get_pause_lines(self):
+        """Indices of the M0 pause lines, found with one scan of the buffer."""
+        starts = [match.start() for match in PAUSE_CANDIDATE_RE.finditer(self.data)]
+        candidates = set((np.searchsorted(self.offsets, starts, side='right') - 1).tolist())
+        return set(index for index in candidates if GCode.is_pause_command(self.get_line(index)))
+
+    @classmethod
+    def from_commands(cls, commands, chunk_size=DEFAULT_ENCODE_CHUNK):
+        """Encode any iterable of lines, a chunk of lines at a time."""
+        data = bytearray()
+        offsets = [np.zeros(1, dtype=np.int64)]
+        commands = iter(commands)
+        while True:
+            chunk = list(itertools.islice(commands, chunk_size))
+            if len(chunk) == 0:
+                break
+            encoded = ('\n'.join(chunk) + '\n').encode('utf-8')
+            newlines = np.flatnonzero(np.frombuffer(encoded, dtype=np.uint8) == ord('\n'))
+            if len(newlines) != len(chunk):
+                raise RuntimeError('Program lines may not contain newlines')
+            offsets.append(len(data) + newlines + 1)
+            data += encoded
+        return cls(data, np.concatenate(offsets))
+
+
+class ProgramWindow:
+    """A program encoded a chunk of lines at a time, as streaming reaches it.
+
+    Only the chunks from the oldest unacknowledged line on are kept, so a job or G-code file streamed
+    from disk is never held in memory whole. Lines keep their index in the whole program.
+    """
+    def __init__(self, commands, chunk_size=DEFAULT_ENCODE_CHUNK):
+        self.chunk_size = chunk_size
+        self.chunks = collections.deque()
+        self.end = 0
+        self.encoded_bytes = 0
+        self.pause_lines = set()
+        if isinstance(commands, EncodedProgram):
+            self._add(commands)
+            commands = []
+        self.commands = iter(commands)
+        self.exhausted = False
+
+    def _add(self, program):
+        self.pause_lines.update(self.end + index for index in program.get_pause_lines())
+        self.chunks.append((self.end, program))
+        self.end += len(program)
+        self.encoded_bytes += len(program.data)
+
+    def has_line(self, index):
+        """Whether the program has a line index, encoding chunks up to it as needed."""
+        while index >= self.end and not self.exhausted:
+            chunk = list(itertools.islice(self.commands, self.chunk_size))
+            if len(chunk) == 0:
+                self.exhausted = True
+            else:
+                self._add(EncodedProgram.from_commands(chunk, chunk_size=len(chunk)))
+        return index < self.end
+
+    def get_line_count(self):
+        """The number of lines, None until every line has been encoded."""
+        return self.end if self.exhausted else None
+
+    def get_chunk(self, index):
+        """The first line index and encoded program of the chunk holding line index."""
+        for first, program in self.chunks:
+            if index < first + len(program):
+                return first, program
+        raise IndexError('Line {} is not in the program window'.format(index))
+
+    def get_line(self, index):
+        first, program = self.get_chunk(index)
+        return program.get_line(index - first)
+
+    def get_line_bytes(self, index):
+        first, program = self.get_chunk(index)
+        return program.get_line_bytes(index - first)
+
+    def release(self, index):
+        """Drop the chunks whose lines all come before line index."""
+        while len(self.chunks) > 0 and self.chunks[0][0] + len(self.chunks[0][1]) <= index:
+            self.chunks.popleft()
+
+
+class GCodeStreamer:
+    """Stream a program to GRBL with its character counting protocol.
+
+    The program is an EncodedProgram or any iterable of lines, encoded a chunk at a time through a
+    ProgramWindow. Every next line that fits in the free space of the RX buffer is written in one
+    memoryview slice, and each 'ok' frees the bytes of the oldest line in flight. Status reports asked
+    for while streaming arrive in the same response stream and are handed to on_status.
+
+    GRBL holds at an M0 pause once the motion before it is done, and only acknowledges the M0 after a
+    cycle start. Once every line before a pause is acknowledged the streamer polls the status, and
+    when GRBL reports Hold it calls on_pause(index), e.g. to wait for a pen change, and sends a cycle
+    start once it returns.
+    """
+    def __init__(self, device, program, rx_buffer_size=GRBL_RX_BUFFER_SIZE):
+        self.device = device
+        self.program = program if isinstance(program, ProgramWindow) else ProgramWindow(program)
+        self.rx_buffer_size = rx_buffer_size
+        self.sent = 0
+        self.acked = 0
+        self.rx_bytes = 0
+        self.response = bytearray()
+        self.status_pending = False
+        self.status_time = 0.0
+        self.resumed_pause = None
+
+    @property
+    def pause_lines(self):
+        return self.program.pause_lines
+
+    def send(self, on_send=None):
+        """Write every next line that fits in the free RX buffer space, returning how many were sent."""
+        count = 0
+        while self.program.has_line(self.sent):
+            sent = self.send_chunk(on_send)
+            if sent == 0:
+                break
+            count += sent
+        return count
+
+    def send_chunk(self, on_send=None):
+        """Write the next lines of the chunk holding the next line that fit in the RX buffer."""
+        first, chunk = self.program.get_chunk(self.sent)
+        offsets = chunk.offsets
+        sent = self.sent - first
+        start = int(offsets[sent])
+        free = self.rx_buffer_size - self.rx_bytes
+        end = int(np.searchsorted(offsets, start + free, side='right')) - 1
+        if end <= sent and self.sent == self.acked:
+            # A line longer than the buffer can only go on its own.
+            end = sent + 1
+        end = min(end, len(chunk))
+        for index in self.pause_lines:
+            if self.acked <= index < first + end and index != self.resumed_pause:
+                # Nothing after a pause goes out before it is resumed, a cancelled job must not draw
+                # the next layer with the old pen.
+                end = index + 1 - first
+        if end <= sent:
+            return 0
+        stop = int(offsets[end])
+        if on_send is not None:
+            rx_bytes = self.rx_bytes
+            for index in range(sent, end):
+                rx_bytes += chunk.get_line_bytes(index)
+                on_send(first + index, rx_bytes)
+        self.device.serial.write(chunk.view[start:stop])
+        self.rx_bytes += stop - start
+        count = end - sent
+        self.sent += count
+        return count
+
+    def read_responses(self):
+        """Complete response lines received so far, waiting briefly when there are none."""
+        waiting = self.device.serial.in_waiting
+        if waiting == 0:
+            time.sleep(POLL_INTERVAL)
+            return []
+        self.response += self.device.serial.read(waiting)
+        lines = self.response.split(b'\n')
+        self.response = lines.pop()
+        return [line.strip() for line in lines]
+
+    def handle_response(self, line, on_ack=None, on_status=None, on_pause=None):
+        if line == b'ok':
+            index = self.acked
+            self.rx_bytes -= self.program.get_line_bytes(index)
+            self.acked += 1
+            if on_ack is not None:
+                on_ack(index)
+            self.program.release(self.acked)
+        elif line.startswith(b'error'):
+            raise RuntimeError('{} at line {}: {}'.format(line.decode('utf-8'), self.acked, self.program.get_line(self.acked)))
+        elif line.startswith(b'ALARM'):
+            # An alarm resets GRBL and flushes its RX buffer, so the lines in flight will never be acknowledged.
+            raise RuntimeError(line.decode('utf-8'))
+        elif line.startswith(b'<'):
+            self.status_pending = False
+            status = Status.parse(line.decode('utf-8'))
+            if on_status is not None:
+                on_status(status)
+            # A feed hold before the pause still has motion planned, GRBL only holds at M0 once it is done.
+            planner_empty = status.planner_free is None or status.planner_free == GRBL_PLANNER_BLOCKS
+            if status.state == State.HOLD and planner_empty and on_pause is not None and self.is_at_pause():
+                index = self.acked
+                on_pause(index)
+                self.resumed_pause = index
+                self.device.send_realtime(GRBL.cycle_start())
+        # Anything else, such as [MSG:...] or a blank line, carries nothing to act on.
+
+    def request_status(self):
+        if not self.status_pending:
+            self.device.send_realtime(GRBL.query_state())
+            self.status_pending = True
+            self.status_time = time.monotonic()
+
+    def is_at_pause(self):
+        """Whether every line before a pause is acknowledged and the pause is waiting to be resumed."""
+        return self.acked in self.pause_lines and self.sent > self.acked and self.resumed_pause != self.acked
+
+    def poll_pause(self, on_pause):
+        if not self.is_at_pause():
+            return
+        if on_pause is None:
+            raise RuntimeError('Program pauses at line {} with nothing to resume it'.format(self.acked))
+        if time.monotonic() - self.status_time > PAUSE_POLL_INTERVAL:
+            self.request_status()
+
+    def run(self, on_send=None, on_ack=None, wants_status=None, on_status=None, on_pause=None):
+        """Stream the whole program, calling on_send(index, rx_bytes) before a line is written and
+        on_ack(index) once it is acknowledged. A status report is asked for whenever wants_status() is True.
+        A program with pauses needs on_pause, a pen change should not be skipped silently.
+        """
+        while self.program.has_line(self.acked) or self.status_pending:
+            self.send(on_send)
+            for line in self.read_responses():
+                self.handle_response(line, on_ack, on_status, on_pause)
+            self.poll_pause(on_pause)
+            if wants_status is not None and self.program.has_line(self.acked) and wants_status():
+                self.request_status()
+
+    def drain(self, on_ack=None):
+        """Wait for the lines already sent, and any status report, without sending more. Pauses
+        among them resume straight away.
+        """
+        def on_pause(index):
+            pass
+
+        while self.acked < self.sent or self.status_pending:
+            for line in self.read_responses():
+                self.handle_response(line, on_ack, on_pause=on_pause)
+            self.poll_pause(on_pause)
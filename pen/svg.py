@@ -1,9 +1,13 @@
+from collections import deque
 from xml.dom import minidom
+import multiprocessing
+import os
 import re
 
 import numpy as np
 
 from .bezier import CubicBezier
+from .profiling import stage
 
 # TODO(emmett):
 #  * SVG gets generated from GCode (or viz code)
@@ -78,19 +82,39 @@ class VectorViz:
 # === New Hotness === #
 
 
+# Command letters and numbers, which may run together as in '10-5' or '.5.5'.
+PATH_TOKEN_RE = re.compile(r'[A-Za-z]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[^\s,]')
+PATH_INVALID_RE = re.compile(r'[^MmZzLlHhVvCcSsQqTtAa\d.eE+\-\s,]')
+# Arcs with radii this close, relative to their size, are circular.
+CIRCULAR_ARC_TOLERANCE = 1e-9
+
+
 class CubicBezierLineCommand:
-    def __init__(self, dp2, dp3, p4):
-        # These are relative coordinates:
-        self.dp2 = dp2
-        self.dp3 = dp3
+    def __init__(self, p2, p3, p4, absolute=False):
+        # p2 is None for a smooth curve, which reflects the previous curve's control point.
+        self.p2 = p2
+        self.p3 = p3
         self.p4 = p4
+        self.absolute = absolute
 
 
 class QuadraticBezierLineCommand:
-    def __init__(self, dp2, p3):
-        # These are relative coordinates:
-        self.dp2 = dp2
+    def __init__(self, p2, p3, absolute=False):
+        # p2 is None for a smooth curve, which reflects the previous curve's control point.
+        self.p2 = p2
         self.p3 = p3
+        self.absolute = absolute
+
+
+class ArcCommand:
+    def __init__(self, rx, ry, rotation, large_arc, sweep, point, absolute=False):
+        self.rx = rx
+        self.ry = ry
+        self.rotation = rotation
+        self.large_arc = large_arc
+        self.sweep = sweep
+        self.point = point
+        self.absolute = absolute
 
 
 class LineCommand:
@@ -121,290 +145,422 @@ class HLineCommand:
         self.absolute = absolute
 
 
+class CircularArc:
+    """A circular piece of a flattened path, spanning points[first:last + 1] of one of its polylines."""
+    def __init__(self, segment_index, first, last, center, sweep):
+        self.segment_index = segment_index
+        self.first = first
+        self.last = last
+        self.center = center
+        # True when the arc runs towards increasing angles in SVG coordinates.
+        self.sweep = sweep
+
+
+def flatten_elliptical_arc(start, end, rx, ry, rotation, large_arc, sweep, distance_tolerance=0.5):
+    """Points along an SVG elliptical arc after start, and its center when the arc is circular.
+
+    Follows the endpoint to center conversion of the SVG spec, with chords deviating at most
+    distance_tolerance from the curve.
+    """
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    rx, ry = abs(rx), abs(ry)
+    if np.all(start == end):
+        return np.zeros((0, 2)), None
+    if rx == 0.0 or ry == 0.0:
+        return end[None, :], None
+
+    phi = np.radians(rotation)
+    cos_phi, sin_phi = np.cos(phi), np.sin(phi)
+    hx, hy = (start - end) / 2.0
+    x1 = cos_phi * hx + sin_phi * hy
+    y1 = -sin_phi * hx + cos_phi * hy
+    # Scale up radii too small to reach the end point.
+    scale = x1 ** 2 / rx ** 2 + y1 ** 2 / ry ** 2
+    if scale > 1.0:
+        rx, ry = rx * np.sqrt(scale), ry * np.sqrt(scale)
+    numerator = rx ** 2 * ry ** 2 - rx ** 2 * y1 ** 2 - ry ** 2 * x1 ** 2
+    denominator = rx ** 2 * y1 ** 2 + ry ** 2 * x1 ** 2
+    coefficient = np.sqrt(max(0.0, numerator / denominator))
+    if large_arc == sweep:
+        coefficient = -coefficient
+    cx1 = coefficient * rx * y1 / ry
+    cy1 = -coefficient * ry * x1 / rx
+    center = np.array([
+        cos_phi * cx1 - sin_phi * cy1 + (start[0] + end[0]) / 2.0,
+        sin_phi * cx1 + cos_phi * cy1 + (start[1] + end[1]) / 2.0,
+    ])
+
+    start_theta = np.arctan2((y1 - cy1) / ry, (x1 - cx1) / rx)
+    end_theta = np.arctan2((-y1 - cy1) / ry, (-x1 - cx1) / rx)
+    width = np.mod(end_theta - start_theta, 2.0 * np.pi)
+    if not sweep and width > 0.0:
+        width -= 2.0 * np.pi
+
+    # The chord of a step of angle a strays r (1 - cos(a / 2)) from a circle of radius r.
+    radius = max(rx, ry)
+    step = 2.0 * np.arccos(max(-1.0, 1.0 - distance_tolerance / radius))
+    count = max(1, int(np.ceil(abs(width) / max(step, 1e-3))))
+    thetas = start_theta + width * np.arange(1, count + 1) / count
+    points = np.stack([
+        center[0] + rx * cos_phi * np.cos(thetas) - ry * sin_phi * np.sin(thetas),
+        center[1] + rx * sin_phi * np.cos(thetas) + ry * cos_phi * np.sin(thetas),
+    ], axis=1)
+    points[-1] = end
+    circular = abs(rx - ry) <= CIRCULAR_ARC_TOLERANCE * radius
+    return points, center if circular else None
+
+
 class SVGPathDataParser:
     def __init__(self):
         self.commands = []
-        self.tokens = []
+        self.tokens = deque()
+        self.arcs = []
 
     def peek_token(self):
         if len(self.tokens) == 0:
             return None
-        return self.tokens[0].strip()
+        return self.tokens[0]
 
     def pop_token(self):
         if len(self.tokens) == 0:
             return None
-        token = self.tokens.pop(0)
-        return token.strip()
+        return self.tokens.popleft()
 
     def parse_scalar(self):
-        return float(self.pop_token())
+        # The hot loop of parsing, so tokens are popped directly.
+        try:
+            token = self.tokens.popleft()
+            return float(token)
+        except IndexError:
+            raise RuntimeError('Expected a number, got the end of the path')
+        except ValueError:
+            raise RuntimeError('Expected a number, got: {}'.format(token))
 
     def parse_point(self):
         x = self.parse_scalar()
         y = self.parse_scalar()
         return x, y
 
-    def parse_points(self):
-        points = []
-
-        while True:
-            token = self.peek_token()
-            if token is None:
-                break
-            if token.isalpha():
-                break
-            point = self.parse_point()
-            points.append(point)
-
-        return points
-
-    def parse_bicubic_point(self):
-        return self.parse_point(), self.parse_point(), self.parse_point()
-
-    def parse_quadratic_point(self):
-        return self.parse_point(), self.parse_point()
+    def parse_flag(self):
+        # Flags are single digits and may run into what follows, as in 'a5 5 0 0110 10'.
+        token = self.pop_token()
+        if token is None or token[0] not in '01':
+            raise RuntimeError('Expected an arc flag, got: {}'.format(token))
+        if len(token) > 1:
+            self.tokens.appendleft(token[1:])
+        return token[0] == '1'
+
+    @staticmethod
+    def tokenize(data):
+        invalid = PATH_INVALID_RE.search(data)
+        if invalid is not None:
+            raise RuntimeError('Unsupported token: {} "{}"'.format(invalid.group(), data))
+        return deque(PATH_TOKEN_RE.findall(data))
+
+    def parse_command(self, command, data):
+        absolute = command.isupper()
+        kind = command.lower()
+        if kind == 'm':
+            return MoveCommand(self.parse_point(), absolute=absolute)
+        if kind == 'l':
+            return LineCommand([self.parse_point()], absolute=absolute)
+        if kind == 'h':
+            return HLineCommand(self.parse_scalar(), absolute=absolute)
+        if kind == 'v':
+            return VLineCommand(self.parse_scalar(), absolute=absolute)
+        if kind == 'c':
+            return CubicBezierLineCommand(self.parse_point(), self.parse_point(), self.parse_point(), absolute=absolute)
+        if kind == 's':
+            return CubicBezierLineCommand(None, self.parse_point(), self.parse_point(), absolute=absolute)
+        if kind == 'q':
+            return QuadraticBezierLineCommand(self.parse_point(), self.parse_point(), absolute=absolute)
+        if kind == 't':
+            return QuadraticBezierLineCommand(None, self.parse_point(), absolute=absolute)
+        if kind == 'a':
+            rx = self.parse_scalar()
+            ry = self.parse_scalar()
+            rotation = self.parse_scalar()
+            large_arc = self.parse_flag()
+            sweep = self.parse_flag()
+            return ArcCommand(rx, ry, rotation, large_arc, sweep, self.parse_point(), absolute=absolute)
+        raise RuntimeError('Unsupported token: {} "{}"'.format(command, data))
 
     def parse_commands(self, data):
         self.commands = []
-        STATE_START = 0
-        STATE_MOVE = 1
-        STATE_LINE = 2
-        STATE_CUBIC_BEZIER = 3
-        STATE_QUADRATIC_BEZIER = 4
-        STATE_ARC = 5
-        STATE_CLOSE = 6
-        STATE_PARSE_POINT = 7
-        STATE_HLINE = 8
-        STATE_VLINE = 9
-        STATE_DRAW = 10
-
-        self.tokens = re.split('[ ,]', data)
-        state = STATE_START
-
-        is_absolute = False
-
-        while True:
-            if len(self.tokens) == 0:
-                break
-            if state == STATE_START:
-                token = self.pop_token()
-                if token.lower() == 'm':
-                    is_absolute = token.isupper()
-                    command = MoveCommand(self.parse_point(), absolute=is_absolute)
-                    self.commands.append(command)
-                    state = STATE_MOVE
-                else:
-                    raise RuntimeError('Unknown start token: {} "{}"'.format(token, data))
-            elif state == STATE_DRAW:
-                token = self.peek_token()
-                if token.lower() == 'm':
-                    state = STATE_START
-                    continue
-                token = self.pop_token()
-                if token.lower() == 'l':
-                    is_absolute = token.isupper()
-                    command = LineCommand(self.parse_points(), absolute=is_absolute)
-                    self.commands.append(command)
-                    state = STATE_LINE
-                elif token == 'c':
-                    dp2, dp3, p4 = self.parse_bicubic_point()
-                    command = CubicBezierLineCommand(dp2, dp3, p4)
-                    self.commands.append(command)
-                    state = STATE_CUBIC_BEZIER
-                elif token == 'q':
-                    dp2, p3 = self.parse_quadratic_point()
-                    command = QuadraticBezierLineCommand(dp2, p3)
-                    self.commands.append(command)
-                    state = STATE_QUADRATIC_BEZIER
-                elif token == 'z':
+        self.tokens = self.tokenize(data)
+        command = None
+        while len(self.tokens) != 0:
+            token = self.peek_token()
+            if token.isalpha():
+                command = self.pop_token()
+                if len(self.commands) == 0 and command.lower() != 'm':
+                    raise RuntimeError('Unknown start token: {} "{}"'.format(command, data))
+                if command.lower() == 'z':
                     self.commands.append(ClosePathCommand())
-                elif token.lower() == 'v':
-                    v = self.parse_scalar()
-                    is_absolute = token.isupper()
-                    command = VLineCommand(v, absolute=is_absolute)
-                    self.commands.append(command)
-                    state = STATE_VLINE
-                elif token.lower() == 'h':
-                    v = self.parse_scalar()
-                    is_absolute = token.isupper()
-                    command = HLineCommand(v, absolute=is_absolute)
-                    self.commands.append(command)
-                    state = STATE_HLINE
-                elif token == '':
-                    continue
-                else:
-                    raise RuntimeError('Unsupported token: {} "{}" {}'.format(token, data, self.commands[-1]))
-            elif state == STATE_MOVE:
-                token = self.peek_token()
-                if token.isalpha():
-                    state = STATE_DRAW
                     continue
-                else:
-                    # Implicit transition to line
-                    command = LineCommand(self.parse_points(), absolute=is_absolute)
-                    self.commands.append(command)
-                    state = STATE_LINE
-            elif state == STATE_CUBIC_BEZIER:
-                token = self.peek_token()
-                if token.isalpha():
-                    state = STATE_DRAW
-                    continue
-                else:
-                    dp2, dp3, p4 = self.parse_bicubic_point()
-                    command = CubicBezierLineCommand(dp2, dp3, p4)
-                    self.commands.append(command)
-            elif state == STATE_QUADRATIC_BEZIER:
-                token = self.peek_token()
-                if token.isalpha():
-                    state = STATE_DRAW
-                    continue
-                else:
-                    dp2, p3 = self.parse_quadratic_point()
-                    command = QuadraticBezierLineCommand(dp2, p3)
-                    self.commands.append(command)
-            elif state == STATE_CUBIC_BEZIER:
-                token = self.peek_token()
-                if token.isalpha():
-                    state = STATE_DRAW
-                    continue
-                else:
-                    dp2, dp3, p4 = self.parse_bicubic_point()
-                    command = CubicBezierLineCommand(dp2, dp3, p4)
-                    self.commands.append(command)
-            elif state == STATE_VLINE:
-                token = self.peek_token()
-                if token.isalpha():
-                    state = STATE_DRAW
-                    continue
-                else:
-                    v = self.parse_scalar()
-                    command = VLineCommand(v, absolute=is_absolute)
-                    self.commands.append(command)
-            elif state == STATE_HLINE:
-                token = self.peek_token()
-                if token.isalpha():
-                    state = STATE_DRAW
-                    continue
-                else:
-                    v = self.parse_scalar()
-                    command = HLineCommand(v, absolute=is_absolute)
-                    self.commands.append(command)
-            elif state == STATE_LINE:
-                state = STATE_DRAW
-            else:
-                raise RuntimeError('Unsupported state: {}'.format(state))
-
+            elif command is None or command.lower() == 'z':
+                raise RuntimeError('Unknown start token: {} "{}"'.format(token, data))
+            self.commands.append(self.parse_command(command, data))
+            # Coordinates repeating a moveto are implicit linetos.
+            if command == 'M':
+                command = 'L'
+            elif command == 'm':
+                command = 'l'
         return self.commands
 
     def data_to_segments(self, data, bezier_distance_tolerance=0.5):
+        """Flatten path data into polylines, one per subpath.
+
+        Circular arcs are also recorded in self.arcs so callers can draw them exactly.
+        """
         commands = self.parse_commands(data)
-        position = np.array([0, 0])
+        self.arcs = []
+        origin = np.zeros(2)
+        position = origin
         segments = []
         points = []
+        # The previous command's last control point, for smooth curves to reflect.
+        cubic_control = None
+        quadratic_control = None
         for command in commands:
+            offset = origin if getattr(command, 'absolute', True) else position
+            next_cubic_control = None
+            next_quadratic_control = None
             if type(command) == MoveCommand:
                 if len(points) != 0:
                     segments.append(np.array(points))
                     points = []
-                if command.absolute:
-                    position = np.array(command.point)
-                else:
-                    position = np.array(command.point) + position
+                position = offset + command.point
                 points.append(position)
             elif type(command) == CubicBezierLineCommand:
-                p1 = np.array(position)
-                p2 = p1 + command.dp2
-                p3 = p1 + command.dp3
-                p4 = command.p4 + p1
+                p1 = position
+                if command.p2 is not None:
+                    p2 = offset + command.p2
+                elif cubic_control is not None:
+                    p2 = 2.0 * position - cubic_control
+                else:
+                    p2 = position
+                p3 = offset + command.p3
+                p4 = offset + command.p4
                 cubic_bezier = CubicBezier(p1, p2, p3, p4, distance_tolerance=bezier_distance_tolerance)
-                for point in cubic_bezier.to_points():
-                    points.append(point)
+                points += list(cubic_bezier.to_points()[1:])
                 position = p4
+                next_cubic_control = p3
             elif type(command) == QuadraticBezierLineCommand:
-                qp1 = np.array(position)
-                qp2 = qp1 + command.dp2
-                qp3 = qp1 + command.p3
-                cubic_bezier = CubicBezier.from_quadratic(qp1, qp2, qp3)
-                for point in cubic_bezier.to_points():
-                    points.append(point)
+                qp1 = position
+                if command.p2 is not None:
+                    qp2 = offset + command.p2
+                elif quadratic_control is not None:
+                    qp2 = 2.0 * position - quadratic_control
+                else:
+                    qp2 = position
+                qp3 = offset + command.p3
+                cubic_bezier = CubicBezier.from_quadratic(qp1, qp2, qp3, distance_tolerance=bezier_distance_tolerance)
+                points += list(cubic_bezier.to_points()[1:])
                 position = qp3
+                next_quadratic_control = qp2
+            elif type(command) == ArcCommand:
+                end = offset + command.point
+                arc_points, center = flatten_elliptical_arc(
+                    position,
+                    end,
+                    command.rx,
+                    command.ry,
+                    command.rotation,
+                    command.large_arc,
+                    command.sweep,
+                    distance_tolerance=bezier_distance_tolerance,
+                )
+                if center is not None:
+                    self.arcs.append(CircularArc(
+                        segment_index=len(segments),
+                        first=len(points) - 1,
+                        last=len(points) - 1 + len(arc_points),
+                        center=center,
+                        sweep=command.sweep,
+                    ))
+                points += list(arc_points)
+                position = end
             elif type(command) == LineCommand:
-                if command.absolute:
-                    for point in command.points:
-                        pabs = point
-                        points.append(pabs)
-                        position = pabs
-                else:
-                    for point in command.points:
-                        pabs = point + np.array(position)
-                        points.append(pabs)
-                        position = pabs
+                for point in command.points:
+                    position = offset + point
+                    points.append(position)
             elif type(command) == VLineCommand:
-                if command.v == 0:
-                    continue
-                if command.absolute:
-                    pabs = np.copy(position)
-                    pabs[1] = command.v
-                else:
-                    vector = np.array([0, 1]) * command.v
-                    pabs = position + vector
-                points.append(pabs)
+                pabs = np.array(position, dtype=float)
+                pabs[1] = command.v + offset[1]
+                if np.any(pabs != position):
+                    points.append(pabs)
                 position = pabs
             elif type(command) == HLineCommand:
-                if command.h == 0:
-                    continue
-                if command.absolute:
-                    pabs = np.copy(position)
-                    pabs[0] = command.h
-                else:
-                    vector = np.array([1, 0]) * command.h
-                    pabs = position + vector
-                points.append(pabs)
+                pabs = np.array(position, dtype=float)
+                pabs[0] = command.h + offset[0]
+                if np.any(pabs != position):
+                    points.append(pabs)
                 position = pabs
             elif type(command) == ClosePathCommand:
                 points.append(points[0])
                 position = points[-1]
             else:
                 raise RuntimeError('Unknown type: {}'.format(type(command)))
+            cubic_control = next_cubic_control
+            quadratic_control = next_quadratic_control
         if len(points) != 0:
             segments.append(np.array(points))
         return segments
 
 
-class SVGEllipse:
-    def __init__(self, cx, cy, rx, ry, style=None):
+def parse_style(style):
+    """Parse an inline style such as 'fill:#000;stroke:none' into a dict."""
+    properties = {}
+    if style is None:
+        return properties
+    for declaration in style.split(';'):
+        if ':' not in declaration:
+            continue
+        key, value = declaration.split(':', 1)
+        properties[key.strip().lower()] = value.strip()
+    return properties
+
+
+class SVGShape:
+    # SVG paints shapes with a black fill and no stroke unless told otherwise.
+    DEFAULT_FILL = 'black'
+    DEFAULT_STROKE = 'none'
+
+    def __init__(self, style=None, fill=None, stroke=None, group=None):
+        self.style = style
+        self.fill = fill
+        self.stroke = stroke
+        # Name of the top level <g> the shape is in, e.g. an Inkscape layer, None outside any group.
+        self.group = group
+
+    def _get_paint(self, name, attribute, default):
+        value = parse_style(self.style).get(name, attribute)
+        if value is None:
+            value = default
+        if value.lower() in ('none', 'transparent'):
+            return None
+        return value
+
+    def get_fill(self):
+        return self._get_paint('fill', self.fill, self.DEFAULT_FILL)
+
+    def get_stroke(self):
+        return self._get_paint('stroke', self.stroke, self.DEFAULT_STROKE)
+
+
+class SVGEllipse(SVGShape):
+    def __init__(self, cx, cy, rx, ry, style=None, fill=None, stroke=None, group=None):
+        super(SVGEllipse, self).__init__(style=style, fill=fill, stroke=stroke, group=group)
         self.cx = cx
         self.cy = cy
         self.rx = rx
         self.ry = ry
-        self.style = style
 
 
-class SVGRect:
-    def __init__(self, x, y, width, height, style=None):
+class SVGRect(SVGShape):
+    def __init__(self, x, y, width, height, style=None, fill=None, stroke=None, group=None):
+        super(SVGRect, self).__init__(style=style, fill=fill, stroke=stroke, group=group)
         self.x = x
         self.y = y
         self.width = width
         self.height = height
-        self.style = style
 
 
-class SVGPath:
-    def __init__(self, data, style=None):
+class SVGPath(SVGShape):
+    def __init__(self, data, style=None, fill=None, stroke=None, group=None):
+        super(SVGPath, self).__init__(style=style, fill=fill, stroke=stroke, group=group)
         self.data = data
-        self.style = style
 
     def to_segments(self, bezier_distance_tolerance=0.5):
         # A path can annoyingly contain more than one segment.
-        parser = SVGPathDataParser()
-        segments = parser.data_to_segments(self.data, bezier_distance_tolerance=bezier_distance_tolerance)
+        with stage('svg.to_segments') as span:
+            parser = SVGPathDataParser()
+            segments = parser.data_to_segments(self.data, bezier_distance_tolerance=bezier_distance_tolerance)
+            span.count('segments', len(segments))
+            span.count('points_out', sum(len(segment) for segment in segments))
         return segments
 
 
+# Paths sent to a worker at a time, enough to amortize the pickling round trip.
+DEFAULT_CHUNK_PATHS = 512
+
+
+def _data_to_buffer(job):
+    datas, bezier_distance_tolerance = job
+    parser = SVGPathDataParser()
+    polylines = []
+    polyline_counts = np.zeros(len(datas), dtype=int)
+    arc_polylines, arc_ranges, arc_centers, arc_sweeps = [], [], [], []
+    for i, data in enumerate(datas):
+        segments = parser.data_to_segments(data, bezier_distance_tolerance=bezier_distance_tolerance)
+        for arc in parser.arcs:
+            arc_polylines.append(len(polylines) + arc.segment_index)
+            arc_ranges.append((arc.first, arc.last))
+            arc_centers.append(arc.center)
+            arc_sweeps.append(arc.sweep)
+        polyline_counts[i] = len(segments)
+        polylines += [np.asarray(segment, dtype=float).reshape(-1, 2) for segment in segments]
+    lengths = np.array([len(polyline) for polyline in polylines], dtype=int)
+    points = np.concatenate([np.zeros((0, 2))] + polylines)
+    # Arc point ranges become indices into this chunk's point buffer.
+    starts = np.cumsum(lengths) - lengths
+    arc_ranges = np.array(arc_ranges, dtype=int).reshape(-1, 2) + starts[np.array(arc_polylines, dtype=int)][:, None]
+    arcs = (arc_ranges, np.array(arc_centers, dtype=float).reshape(-1, 2), np.array(arc_sweeps, dtype=bool))
+    return points, lengths, polyline_counts, arcs
+
+
+def paths_to_segments(paths, bezier_distance_tolerance=0.5, workers=None, chunk_size=DEFAULT_CHUNK_PATHS, return_arcs=False):
+    """Flatten many SVGPaths, tokenizing and flattening chunks of paths in a process pool.
+
+    Returns (points, offsets, path_offsets) where polyline i is points[offsets[i]:offsets[i + 1]] and
+    path j owns polylines path_offsets[j] to path_offsets[j + 1]. workers defaults to the CPU count,
+    1 converts in this process.
+
+    With return_arcs, circular arcs are added as (ranges, centers, sweeps): arc k was flattened into
+    points[ranges[k, 0]:ranges[k, 1] + 1] around centers[k], towards increasing SVG angles if sweeps[k].
+    """
+    with stage('svg.paths_to_segments') as span:
+        span.count('paths', len(paths))
+        results = _paths_to_buffers(paths, bezier_distance_tolerance, workers, chunk_size, return_arcs)
+        span.count('points_out', len(results[0]))
+    return results
+
+
+def _paths_to_buffers(paths, bezier_distance_tolerance, workers, chunk_size, return_arcs):
+    datas = [path.data for path in paths]
+    jobs = [(datas[start:start + chunk_size], bezier_distance_tolerance) for start in range(0, len(datas), chunk_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        results = [_data_to_buffer(job) for job in jobs]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(_data_to_buffer, jobs)
+
+    points = np.concatenate([np.zeros((0, 2))] + [points for points, _, _, _ in results])
+    lengths = np.concatenate([np.zeros(0, dtype=int)] + [lengths for _, lengths, _, _ in results])
+    polyline_counts = np.concatenate([np.zeros(0, dtype=int)] + [counts for _, _, counts, _ in results])
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+    path_offsets = np.concatenate([[0], np.cumsum(polyline_counts)]).astype(int)
+    if not return_arcs:
+        return points, offsets, path_offsets
+
+    chunk_starts = np.cumsum([len(points) for points, _, _, _ in results]) - [len(points) for points, _, _, _ in results]
+    arcs = (
+        np.concatenate([np.zeros((0, 2), dtype=int)] + [
+            arcs[0] + chunk_start for (_, _, _, arcs), chunk_start in zip(results, chunk_starts)]),
+        np.concatenate([np.zeros((0, 2))] + [arcs[1] for _, _, _, arcs in results]),
+        np.concatenate([np.zeros(0, dtype=bool)] + [arcs[2] for _, _, _, arcs in results]),
+    )
+    return points, offsets, path_offsets, arcs
+
+
 class SVGParser:
     def __init__(self):
-        pass
+        self.group_names = {}
 
     def handle_ellipse(self, ellipse):
         pass
@@ -415,18 +571,63 @@ class SVGParser:
     def handle_path(self, path):
         pass
 
-    def parse(self, path):
-        doc = minidom.parse(path)
-        svg, = doc.getElementsByTagName('svg')
-
-        for element in svg.getElementsByTagName('rect'):
-            self.handle_rect(self.element_to_rect(element))
+    def handle_paths(self, paths):
+        # Subclasses can override this to convert every path in one batch.
+        for path in paths:
+            self.handle_path(path)
 
-        for element in svg.getElementsByTagName('ellipse'):
-            self.handle_ellipse(self.element_to_ellipse(element))
-
-        for element in svg.getElementsByTagName('path'):
-            self.handle_path(self.element_to_path(element))
+    def parse(self, path):
+        with stage('svg.parse') as span:
+            with stage('svg.parse_xml'):
+                doc = minidom.parse(path)
+            svg, = doc.getElementsByTagName('svg')
+
+            rects = svg.getElementsByTagName('rect')
+            span.count('rects', len(rects))
+            for element in rects:
+                self.handle_rect(self.element_to_rect(element))
+
+            ellipses = svg.getElementsByTagName('ellipse')
+            span.count('ellipses', len(ellipses))
+            for element in ellipses:
+                self.handle_ellipse(self.element_to_ellipse(element))
+
+            paths = svg.getElementsByTagName('path')
+            span.count('paths', len(paths))
+            self.handle_paths([self.element_to_path(element) for element in paths])
+
+    @staticmethod
+    def get_attribute(element, name):
+        attrs = element.attributes
+        if name in attrs:
+            return attrs[name].value
+        return None
+
+    def get_paint_attributes(self, element):
+        return {
+            'style': self.get_attribute(element, 'style'),
+            'fill': self.get_attribute(element, 'fill'),
+            'stroke': self.get_attribute(element, 'stroke'),
+            'group': self.get_group(element),
+        }
+
+    def get_group(self, element):
+        """Name of the outermost <g> holding element, by its Inkscape layer label, id or position."""
+        group = None
+        node = element.parentNode
+        while node is not None and node.nodeType == node.ELEMENT_NODE and node.tagName != 'svg':
+            if node.tagName == 'g':
+                group = node
+            node = node.parentNode
+        if group is None:
+            return None
+        if group not in self.group_names:
+            name = self.get_attribute(group, 'inkscape:label') or self.get_attribute(group, 'id')
+            if name is None:
+                siblings = [child for child in group.parentNode.childNodes if child.nodeType == child.ELEMENT_NODE and child.tagName == 'g']
+                name = 'g{}'.format(siblings.index(group))
+            self.group_names[group] = name
+        return self.group_names[group]
 
     def element_to_rect(self, element):
         attrs = element.attributes
@@ -435,7 +636,7 @@ class SVGParser:
             y=attrs['y'].value,
             width=attrs['width'].value,
             height=attrs['height'].value,
-            style=attrs['style'].value,
+            **self.get_paint_attributes(element)
         )
 
     def element_to_ellipse(self, element):
@@ -445,15 +646,12 @@ class SVGParser:
             cy=attrs['cy'].value,
             rx=attrs['rx'].value,
             ry=attrs['ry'].value,
-            style=attrs['style'].value,
+            **self.get_paint_attributes(element)
         )
 
     def element_to_path(self, element):
         attrs = element.attributes
-        style = None
-        if 'style' in attrs:
-            style = attrs['style'].value
         return SVGPath(
             data=attrs['d'].value,
-            style=style,
+            **self.get_paint_attributes(element)
         )
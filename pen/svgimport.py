@@ -0,0 +1,141 @@
+import copy
+
+import numpy as np
+
+from .hatch import DEFAULT_HATCH_ANGLE
+from .hatch import fill_polygons
+from .penviz import PenViz
+from .svg import SVGParser
+from .svg import paths_to_segments
+
+# Chord length used to flatten ellipses.
+ELLIPSE_STEP_MM = 0.5
+
+# How shapes are put on pen layers: one per paint colour, or one per top level <g>.
+LAYER_MODES = ('color', 'group')
+
+
+def normalize_color(color):
+    """Lower case with #rgb written as #rrggbb, so one colour written two ways is one layer."""
+    color = color.strip().lower()
+    if len(color) == 4 and color.startswith('#'):
+        color = '#' + ''.join(c * 2 for c in color[1:])
+    return color
+
+
+class PenVizSVGParser(SVGParser):
+    """Build a PenViz from an SVG, drawing stroked outlines and hatching filled shapes.
+
+    SVG user units are taken as mm and y is flipped so the drawing keeps its orientation. With layers
+    set to 'color', outlines and hatching go on a layer per stroke or fill colour drawn by a pen of that
+    colour, with 'group' on a layer per top level <g>.
+    """
+    def __init__(self, pen, fill=True, hatch_angle=DEFAULT_HATCH_ANGLE, bezier_distance_tolerance=0.5, workers=1, layers=None):
+        super(PenVizSVGParser, self).__init__()
+        if layers is not None and layers not in LAYER_MODES:
+            raise RuntimeError('Unknown layer mode: {}'.format(layers))
+        self.pen = pen
+        self.layers = layers
+        self.fill = fill
+        self.hatch_angle = hatch_angle
+        self.bezier_distance_tolerance = bezier_distance_tolerance
+        self.workers = workers
+        self.viz = PenViz()
+
+    def add_shape(self, shape, rings, arcs=None):
+        """Hatch and outline a shape given as rings in SVG coordinates.
+
+        arcs optionally lists, per ring, (first, last, center, sweep) for circular pieces spanning
+        ring[first:last + 1] that should be outlined as exact arcs.
+        """
+        if arcs is None:
+            arcs = [[] for _ in rings]
+        kept = [i for i, ring in enumerate(rings) if len(ring) >= 2]
+        rings = [self.pen.translate_points_svg(rings[i]) for i in kept]
+        arcs = [arcs[i] for i in kept]
+        fill = shape.get_fill()
+        if self.fill and fill is not None:
+            self.set_layer(shape, fill)
+            fill_polygons(self.viz, rings, self.pen, angle=self.hatch_angle)
+        stroke = shape.get_stroke()
+        if stroke is not None:
+            self.set_layer(shape, stroke)
+            for ring, ring_arcs in zip(rings, arcs):
+                self.draw_outline(ring, ring_arcs)
+
+    def set_layer(self, shape, paint):
+        if self.layers == 'color':
+            layer = normalize_color(paint)
+        elif self.layers == 'group':
+            layer = shape.group
+        else:
+            return
+        if layer is not None and layer not in self.viz.pens:
+            pen = copy.copy(self.pen)
+            if self.layers == 'color':
+                pen.color = layer
+            self.viz.set_layer(layer, pen)
+        else:
+            self.viz.set_layer(layer)
+
+    def draw_outline(self, ring, arcs):
+        cursor = 0
+        for first, last, center, sweep in arcs:
+            if first > cursor:
+                self.viz.draw_path(ring[cursor:first + 1])
+            center = self.pen.translate_points_svg(center)[0]
+            # y is flipped, so arcs towards increasing SVG angles run clockwise here.
+            if sweep:
+                self.viz.draw_arc(ring[last], ring[first], center)
+            else:
+                self.viz.draw_arc(ring[first], ring[last], center)
+            cursor = last
+        if cursor < len(ring) - 1:
+            self.viz.draw_path(ring[cursor:])
+
+    def handle_path(self, path):
+        self.handle_paths([path])
+
+    def handle_paths(self, paths):
+        points, offsets, path_offsets, (arc_ranges, arc_centers, arc_sweeps) = paths_to_segments(
+            paths,
+            bezier_distance_tolerance=self.bezier_distance_tolerance,
+            workers=self.workers,
+            return_arcs=True,
+        )
+        # Arcs of polyline i are the ones starting within its points, they come in buffer order.
+        arc_offsets = np.searchsorted(arc_ranges[:, 0], offsets)
+        for path, first, last in zip(paths, path_offsets[:-1], path_offsets[1:]):
+            rings = []
+            arcs = []
+            for i in range(first, last):
+                rings.append(points[offsets[i]:offsets[i + 1]])
+                arcs.append([
+                    (arc_ranges[k, 0] - offsets[i], arc_ranges[k, 1] - offsets[i], arc_centers[k], arc_sweeps[k])
+                    for k in range(arc_offsets[i], arc_offsets[i + 1])
+                ])
+            self.add_shape(path, rings, arcs=arcs)
+
+    def handle_rect(self, rect):
+        x, y, width, height = [float(value) for value in [rect.x, rect.y, rect.width, rect.height]]
+        self.add_shape(rect, [np.array([
+            [x, y],
+            [x + width, y],
+            [x + width, y + height],
+            [x, y + height],
+            [x, y],
+        ])])
+
+    def handle_ellipse(self, ellipse):
+        cx, cy, rx, ry = [float(value) for value in [ellipse.cx, ellipse.cy, ellipse.rx, ellipse.ry]]
+        # Ramanujan's approximation of the perimeter is plenty to pick a step count.
+        perimeter = np.pi * (3.0 * (rx + ry) - np.sqrt((3.0 * rx + ry) * (rx + 3.0 * ry)))
+        count = max(16, int(np.ceil(perimeter / ELLIPSE_STEP_MM)))
+        thetas = np.linspace(0.0, 2.0 * np.pi, count + 1)
+        self.add_shape(ellipse, [np.stack([cx + rx * np.cos(thetas), cy + ry * np.sin(thetas)], axis=1)])
+
+
+def import_svg(path, pen, fill=True, hatch_angle=DEFAULT_HATCH_ANGLE, workers=1, layers=None):
+    parser = PenVizSVGParser(pen, fill=fill, hatch_angle=hatch_angle, workers=workers, layers=layers)
+    parser.parse(path)
+    return parser.viz
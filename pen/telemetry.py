@@ -0,0 +1,181 @@
+import csv
+import json
+import time
+
+import numpy as np
+
+from .eleksdraw import State
+from .gcode import GCodeState
+
+DEFAULT_STATUS_INTERVAL = 0.5
+PERCENTILES = [50, 90, 99]
+
+# Heuristics for naming what limited a run.
+MOTION_BOUND_PLANNER_FILL = 0.75
+STARVED_FRACTION = 0.1
+
+
+class RunTelemetry:
+    """Record how a job streamed: per-line send to ack latency, buffer occupancy and pen time.
+
+    The sender calls send_line before writing a command and ack_line once it is acknowledged, and
+    polls status reports while streaming whenever wants_status returns True.
+    """
+    def __init__(self, status_interval=DEFAULT_STATUS_INTERVAL):
+        self.status_interval = status_interval
+        self.gcode_state = GCodeState()
+        self.send_times = []
+        self.ack_times = []
+        self.rx_bytes = []
+        self.pen_down = []
+        self.commands = []
+        self.status_times = []
+        self.planner_fill = []
+        self.rx_fill = []
+        self.idle = []
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.last_status_time = None
+
+    def send_line(self, command, rx_bytes):
+        self.send_times.append(time.monotonic())
+        self.rx_bytes.append(rx_bytes)
+        self.commands.append(command)
+
+    def ack_line(self):
+        self.ack_times.append(time.monotonic())
+        self.gcode_state.handle_command(self.commands[len(self.ack_times) - 1])
+        self.pen_down.append(self.gcode_state.is_pen_down())
+
+    def wants_status(self):
+        return self.last_status_time is None or time.monotonic() - self.last_status_time > self.status_interval
+
+    def record_status(self, status):
+        self.last_status_time = time.monotonic()
+        self.status_times.append(self.last_status_time)
+        planner_fill = status.get_planner_fill()
+        self.planner_fill.append(np.nan if planner_fill is None else planner_fill)
+        self.rx_fill.append(np.nan if status.rx_free is None else status.rx_free)
+        self.idle.append(status.state == State.IDLE)
+
+    def finish(self):
+        self.end_time = time.monotonic()
+
+    def get_latencies(self):
+        count = len(self.ack_times)
+        return np.array(self.ack_times) - np.array(self.send_times[:count])
+
+    def get_idle_gaps(self):
+        # Host time between an acknowledgement and sending the next line. Streamed lines are often
+        # sent before the previous one is acknowledged, which is no gap at all.
+        count = min(len(self.ack_times), len(self.send_times) - 1)
+        return np.maximum(np.array(self.send_times[1:count + 1]) - np.array(self.ack_times[:count]), 0.0)
+
+    def get_summary(self):
+        end_time = self.end_time if self.end_time is not None else time.monotonic()
+        latencies = self.get_latencies()
+        idle_gaps = self.get_idle_gaps()
+
+        # Attribute the time between consecutive acks to the pen state of the acked line.
+        ack_times = np.array([self.start_time] + self.ack_times)
+        intervals = np.diff(ack_times)
+        pen_down = np.array(self.pen_down, dtype=bool)
+
+        planner_fill = np.array(self.planner_fill, dtype=float)
+        planner_fill = planner_fill[~np.isnan(planner_fill)]
+        # Status is only polled mid-job, so an idle machine means the host could not keep up.
+        starved_fraction = float(np.mean(self.idle)) if len(self.idle) != 0 else 0.0
+
+        summary = {
+            'lines': len(self.ack_times),
+            'duration': end_time - self.start_time,
+            'pen_down_time': float(intervals[pen_down].sum()),
+            'pen_up_time': float(intervals[~pen_down].sum()),
+            'idle_gap_total': float(idle_gaps.sum()),
+            'mean_rx_bytes': float(np.mean(self.rx_bytes)) if len(self.rx_bytes) != 0 else 0.0,
+            'status_reports': len(self.status_times),
+            'mean_planner_fill': float(planner_fill.mean()) if len(planner_fill) != 0 else None,
+            'starved_fraction': starved_fraction,
+        }
+        for name, values in [('latency', latencies), ('idle_gap', idle_gaps)]:
+            for percentile in PERCENTILES:
+                key = '{}_p{}'.format(name, percentile)
+                summary[key] = float(np.percentile(values, percentile)) if len(values) != 0 else None
+            summary[name + '_max'] = float(values.max()) if len(values) != 0 else None
+        summary['bottleneck'] = self.get_bottleneck(summary)
+        return summary
+
+    @staticmethod
+    def get_bottleneck(summary):
+        if summary['mean_planner_fill'] is None:
+            return 'unknown'
+        if summary['mean_planner_fill'] >= MOTION_BOUND_PLANNER_FILL:
+            return 'motion'
+        if summary['starved_fraction'] >= STARVED_FRACTION:
+            return 'planner starvation'
+        return 'usb latency'
+
+    def get_line_records(self):
+        latencies = self.get_latencies()
+        return [
+            {
+                'index': index,
+                'command': self.commands[index],
+                'send_time': self.send_times[index] - self.start_time,
+                'latency': float(latencies[index]),
+                'rx_bytes': self.rx_bytes[index],
+                'pen_down': self.pen_down[index],
+            }
+            for index in range(len(latencies))
+        ]
+
+    def get_status_records(self):
+        return [
+            {
+                'time': status_time - self.start_time,
+                'planner_fill': None if np.isnan(planner_fill) else planner_fill,
+                'rx_free': None if np.isnan(rx_free) else int(rx_free),
+                'idle': idle,
+            }
+            for status_time, planner_fill, rx_free, idle
+            in zip(self.status_times, self.planner_fill, self.rx_fill, self.idle)
+        ]
+
+    def save_report(self, path):
+        """Write a JSON report, or per-line CSV records if the path ends in .csv"""
+        if path.endswith('.csv'):
+            records = self.get_line_records()
+            with open(path, 'w', newline='') as w:
+                writer = csv.DictWriter(w, fieldnames=['index', 'command', 'send_time', 'latency', 'rx_bytes', 'pen_down'])
+                writer.writeheader()
+                writer.writerows(records)
+            return
+        report = {
+            'summary': self.get_summary(),
+            'lines': self.get_line_records(),
+            'status': self.get_status_records(),
+        }
+        with open(path, 'w') as w:
+            json.dump(report, w, indent=2)
+
+    def print_summary(self):
+        summary = self.get_summary()
+
+        def ms(value):
+            return 'n/a' if value is None else '{:.1f} ms'.format(1e3 * value)
+
+        print('Lines: {} in {:.1f} s'.format(summary['lines'], summary['duration']))
+        print('Pen down {:.1f} s, pen up {:.1f} s'.format(summary['pen_down_time'], summary['pen_up_time']))
+        print('Ack latency: p50 {} p90 {} p99 {} max {}'.format(
+            ms(summary['latency_p50']),
+            ms(summary['latency_p90']),
+            ms(summary['latency_p99']),
+            ms(summary['latency_max']),
+        ))
+        print('Idle gaps: total {:.2f} s, p99 {}'.format(summary['idle_gap_total'], ms(summary['idle_gap_p99'])))
+        if summary['mean_planner_fill'] is not None:
+            print('Planner fill: mean {:.0%}, starved {:.0%} of reports'.format(
+                summary['mean_planner_fill'],
+                summary['starved_fraction'],
+            ))
+        print('Likely bottleneck: {}'.format(summary['bottleneck']))
@@ -1,40 +1,301 @@
 import argparse
-
+import collections
+import itertools
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+from pen import profiling
+from pen.daemon import DEFAULT_DAEMON_SOCKET
+from pen.daemon import DaemonDevice
+from pen.daemon import connect_daemon
+from pen.defaults import DEFAULT_API_PORT
+from pen.defaults import DEFAULT_DEDUP_TOLERANCE
+from pen.defaults import DEFAULT_HATCH_ANGLE
+from pen.defaults import DEFAULT_JOIN_TOLERANCE
+from pen.defaults import DEFAULT_SIMPLIFY_TOLERANCE
 from pen.eleksdraw import DEFAULT_SERIAL_PORT
 from pen.eleksdraw import DRAW_HEIGHT_EU
 from pen.eleksdraw import DRAW_WIDTH_EU
-from pen.gcode import GCode
-from pen.plotter import run_gcode, soft_reset
-from pen.gcode import get_gcode_bounds
+from pen.gcodewords import DEFAULT_MOVE_RATE
+from pen.gcodewords import GCode
+from pen.gcodewords import RESOLUTION_EU
+
+# Each subcommand imports the modules it needs when it runs. Most of them load numpy, and the small
+# device commands such as up, down and move are scripted often enough that startup time matters.
+
+
+@contextmanager
+def open_text(path, mode='r'):
+    from pen.gcodeio import open_gcode
+
+    # '-' streams from stdin or to stdout so commands can be piped together.
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+        return
+    # Compressed files are decoded and encoded as they stream.
+    with open_gcode(path, mode) as f:
+        yield f
+
+
+def read_gcode(path):
+    commands = []
+    with open_text(path) as r:
+        for line in r:
+            commands.append(line.strip())
+    return commands
+
+
+def read_commands(path):
+    from pen.gcodeio import GCodeFile
+    from pen.jobfile import JobFile
+    from pen.jobfile import is_job_path
+
+    # Job files are memory mapped and decoded to text only as lines are sent, programs on disk are
+    # streamed from the file on each pass rather than read into memory.
+    if path == '-':
+        return read_gcode(path)
+    if is_job_path(path):
+        return JobFile(path)
+    return GCodeFile(path)
+
+
+def get_commands_bounds(commands):
+    from pen.gcode import get_gcode_bounds
+    from pen.jobfile import JobFile
+
+    if isinstance(commands, JobFile):
+        return commands.get_rect()
+    return get_gcode_bounds(commands)
+
+
+def send_commands(args, commands):
+    # A running daemon already holds the device open and set up, so the commands go through it.
+    client = connect_daemon(args.socket)
+    if client is not None:
+        with client:
+            client.run_commands(commands)
+        return
+
+    from pen.plotter import run_commands
+
+    run_commands(commands, device=args.device)
 
 
 def up_main(args):
-    run_gcode([GCode.pen_up()], device=args.device)
+    send_commands(args, [GCode.pen_up()])
 
 
 def down_main(args):
-    run_gcode([GCode.pen_down()], device=args.device)
+    send_commands(args, [GCode.pen_down()])
 
 
 def move_main(args):
-    run_gcode([GCode.move_fast([args.x, args.y])], device=args.device)
+    send_commands(args, [GCode.move_fast([args.x, args.y])])
+
+
+@contextmanager
+def open_jog_device(args):
+    client = connect_daemon(args.socket)
+    if client is not None:
+        with client:
+            yield DaemonDevice(client)
+        return
+
+    from pen.eleksdraw import open_device
+    from pen.plotter import start_device
+
+    with open_device(args.device) as device:
+        start_device(device)
+        yield device
+
+
+# Arrow keys arrive as three byte escape sequences.
+JOG_KEYS = {
+    'w': (0, 1),
+    's': (0, -1),
+    'a': (-1, 0),
+    'd': (1, 0),
+    '\x1b[A': (0, 1),
+    '\x1b[B': (0, -1),
+    '\x1b[C': (1, 0),
+    '\x1b[D': (-1, 0),
+}
+
+
+def jog_keyboard(jogger, hold):
+    import select
+    import termios
+    import tty
+
+    fd = sys.stdin.fileno()
+    direction = None
+    release_time = 0.0
+    stopped = False
+
+    def get_direction():
+        nonlocal direction, release_time, stopped
+        while select.select([fd], [], [], 0)[0]:
+            data = os.read(fd, 64).decode('latin-1')
+            while data:
+                key, data = (data[:3], data[3:]) if data.startswith('\x1b[') else (data[0], data[1:])
+                if key in JOG_KEYS:
+                    direction = JOG_KEYS[key]
+                    release_time = time.monotonic() + hold
+                elif key == ' ':
+                    direction = None
+                elif key in ('q', '\x1b', '\x03'):
+                    stopped = True
+        # A held key repeats, so the jog stops once the repeats do.
+        if time.monotonic() > release_time:
+            direction = None
+        return direction
+
+    print('Arrow keys or WASD to jog, space to stop, q to quit')
+    settings = termios.tcgetattr(fd)
+    tty.setcbreak(fd)
+    try:
+        jogger.run(get_direction, should_stop=lambda: stopped)
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, settings)
+
+
+def jog_main(args):
+    from pen.jog import Jogger
+    from pen.plotter import wait_for_idle
+
+    with open_jog_device(args) as device:
+        jogger = Jogger(device, feed_rate=args.feed_rate)
+        if args.x is None and args.y is None:
+            jog_keyboard(jogger, args.hold)
+        elif args.absolute:
+            if args.x is None or args.y is None:
+                raise RuntimeError('An absolute jog needs both --x and --y')
+            jogger.jog_to([args.x, args.y])
+        else:
+            jogger.jog([args.x or 0.0, args.y or 0.0])
+        wait_for_idle(device, interval=0.05)
 
 
 def reset_main(args):
+    client = connect_daemon(args.socket)
+    if client is not None:
+        with client:
+            client.reset()
+        return
+
+    from pen.plotter import soft_reset
+
     soft_reset(args.device)
 
 
-def draw_main(args):
-    commands = []
-    with open(args.gcode) as r:
-        for line in r:
-            commands.append(line.strip())
+def get_feed_policy(args):
+    from pen.override import SegmentLengthFeedPolicy
+
+    if not args.adaptive_feed:
+        return None
+    return SegmentLengthFeedPolicy(min_percent=args.min_feed_override, max_percent=args.max_feed_override)
+
+
+def run_job(args, commands, checkpoint=None, telemetry=None, line_count=None):
+    client = connect_daemon(args.socket)
+    if client is None:
+        from pen.plotter import run_gcode
+
+        run_gcode(
+            commands,
+            device=args.device,
+            checkpoint=checkpoint,
+            feed_policy=get_feed_policy(args),
+            telemetry=telemetry,
+            line_count=line_count,
+        )
+        return
+
+    if telemetry is not None or args.adaptive_feed:
+        raise RuntimeError('--report and --adaptive_feed need the device itself, stop the daemon on {} first'.format(args.socket))
+
+    import tqdm
+
+    from pen.plotter import prompt_pen_change
+
+    if line_count is None and hasattr(commands, '__len__'):
+        line_count = len(commands)
+    progress = tqdm.tqdm(total=line_count)
+    acked = 0
+    # Lines handed to the daemon but not yet acknowledged, for the checkpoint.
+    pending = collections.deque()
+
+    def iter_commands():
+        for command in commands:
+            pending.append(command)
+            yield command
+
+    def on_progress(count):
+        nonlocal acked
+        for index in range(acked, count):
+            command = pending.popleft()
+            if checkpoint is not None:
+                checkpoint.ack(index, command)
+        progress.update(count - acked)
+        acked = count
+
+    def on_pause(index):
+        progress.clear()
+        prompt_pen_change(index)
+        progress.refresh()
+
+    try:
+        with client:
+            result = client.run_job(iter_commands(), on_progress=on_progress, on_pause=on_pause)
+    finally:
+        progress.close()
+        if checkpoint is not None and not checkpoint.is_complete():
+            checkpoint.save()
+            print('Checkpoint at line {} of {}: {}'.format(checkpoint.line, checkpoint.line_count, checkpoint.path))
+    print('Sent {} of {} lines in {:.1f} s{}'.format(
+        result['acked'],
+        # A cancelled job never reads the lines after the ones sent.
+        result['lines'] if result['lines'] is not None else progress.total,
+        result['duration'],
+        ', cancelled' if result['cancelled'] else '',
+    ))
+    print('Final state: {}'.format(result['state']))
 
-    gcode_rect = get_gcode_bounds(commands)
+
+def draw_main(args):
+    from pen.checkpoint import JobCheckpoint
+    from pen.checkpoint import get_checkpoint_path
+    from pen.clipping import clip_gcode
+    from pen.gcode import get_gcode_bounds
+    from pen.mathscene import Rectangle
+    from pen.telemetry import RunTelemetry
+
+    commands = read_commands(args.gcode)
+
+    gcode_rect = get_commands_bounds(commands)
+    if gcode_rect is None:
+        print('Nothing to draw')
+        return
     x_min, x_max, y_min, y_max = gcode_rect.to_xxyy()
 
     print('Bounds: {} {} {} {}'.format(x_min, x_max, y_min, y_max))
 
+    draw_rect = Rectangle(0.0, DRAW_WIDTH_EU, 0.0, DRAW_HEIGHT_EU)
+    if args.clip and not draw_rect.contains_rect(gcode_rect):
+        # Crop to the drawable area rather than rejecting the job. Clipping is deterministic, so
+        # --resume with --clip lines up with the checkpoint.
+        commands = clip_gcode(commands, draw_rect)
+        gcode_rect = get_gcode_bounds(commands)
+        if gcode_rect is None:
+            print('Nothing left to draw inside the drawable area')
+            return
+        x_min, x_max, y_min, y_max = gcode_rect.to_xxyy()
+        print('Clipped bounds: {} {} {} {}'.format(x_min, x_max, y_min, y_max))
+
     # Maybe in the future we support some sort of 'glitch mode?'
     if not args.skip_bounds_check:
         if x_min < 0.0 or x_max > DRAW_WIDTH_EU:
@@ -42,6 +303,21 @@ def draw_main(args):
         if y_min < 0.0 or y_max > DRAW_HEIGHT_EU:
             raise RuntimeError('Invalid y boundaries: {} {}'.format(y_min, y_max))
 
+    if args.resume:
+        checkpoint = JobCheckpoint.load(get_checkpoint_path(args.gcode), args.gcode, len(commands))
+        resume_commands = checkpoint.get_resume_commands()
+        checkpoint.command_offset = len(resume_commands)
+        print('Resuming at line {} of {}'.format(checkpoint.line, len(commands)))
+        all_commands = itertools.chain(resume_commands, commands[checkpoint.line:], [GCode.move_home()])
+        telemetry = RunTelemetry() if args.report else None
+        line_count = len(resume_commands) + len(commands) - checkpoint.line + 1
+        run_job(args, all_commands, checkpoint=checkpoint, telemetry=telemetry, line_count=line_count)
+        if checkpoint.is_complete():
+            checkpoint.remove()
+        if telemetry is not None:
+            telemetry.save_report(args.report)
+        return
+
     trace_bounds_commands = [
         GCode.move_fast([0, 0]),
         GCode.move_fast([x_min, y_min]),
@@ -67,20 +343,237 @@ def draw_main(args):
             GCode.pen_up(),
         ]
 
-    if not args.test:
-        all_commands += commands
-
-    all_commands.append(GCode.move_home())
+    preamble_count = len(all_commands)
+    job_commands = commands if not args.test else []
+    line_count = len(all_commands) + len(job_commands) + 1
+    all_commands = itertools.chain(all_commands, job_commands, [GCode.move_home()])
 
+    checkpoint = None
     if args.no_pen:
         all_commands = [command for command in commands if not GCode.is_pen_down_command(command)]
-
-    run_gcode(all_commands, device=args.device)
+        line_count = len(all_commands)
+    elif not args.test and args.gcode != '-':
+        checkpoint = JobCheckpoint(
+            get_checkpoint_path(args.gcode),
+            args.gcode,
+            len(commands),
+            command_offset=preamble_count,
+        )
+
+    telemetry = RunTelemetry() if args.report else None
+    run_job(args, all_commands, checkpoint=checkpoint, telemetry=telemetry, line_count=line_count)
+
+    if checkpoint is not None and checkpoint.is_complete():
+        checkpoint.remove()
+    if telemetry is not None:
+        telemetry.save_report(args.report)
+
+
+def optimize_main(args):
+    from pen.dedup import dedup_gcode
+    from pen.gcode import compact_gcode
+    from pen.gcode import get_gcode_bytes
+    from pen.jobfile import is_job_path
+    from pen.jobfile import write_job
+    from pen.optimizer import get_gcode_stats
+    from pen.optimizer import optimize_gcode
+
+    commands = read_commands(args.input)
+    deduped = commands
+    if args.dedup:
+        deduped, saved = dedup_gcode(commands, tolerance=args.dedup_tolerance)
+
+    optimized = optimize_gcode(
+        deduped,
+        simplify_tolerance=args.simplify_tolerance,
+        join_tolerance=args.join_tolerance,
+    )
+    if args.compact:
+        optimized = compact_gcode(optimized, resolution=args.resolution)
+
+    if is_job_path(args.output):
+        write_job(args.output, optimized)
+    else:
+        with open_text(args.output, 'w') as w:
+            w.write('\n'.join(optimized))
+
+    before = get_gcode_stats(commands)
+    after = get_gcode_stats(optimized)
+    # Keep stdout clean when the program itself is written there.
+    out = sys.stderr if args.output == '-' else sys.stdout
+    print('{:<18} {:>14} {:>14}'.format('', 'before', 'after'), file=out)
+    print('{:<18} {:>14} {:>14}'.format('lines', before['lines'], after['lines']), file=out)
+    print('{:<18} {:>14} {:>14}'.format('bytes', get_gcode_bytes(commands), get_gcode_bytes(optimized)), file=out)
+    print('{:<18} {:>14.1f} {:>14.1f}'.format('pen up distance', before['pen_up_distance'], after['pen_up_distance']), file=out)
+    print('{:<18} {:>14.1f} {:>14.1f}'.format('pen down distance', before['pen_down_distance'], after['pen_down_distance']), file=out)
+    print('{:<18} {:>14.1f} {:>14.1f}'.format('estimated time (s)', before['time'], after['time']), file=out)
+    if args.dedup:
+        print('Removed {:.1f} mm of retraced strokes'.format(saved), file=out)
+
+
+def convert_main(args):
+    from pen.jobfile import is_job_path
+    from pen.jobfile import write_job
+
+    # Text to a job file or back, picked by the output extension.
+    if is_job_path(args.output):
+        write_job(args.output, read_commands(args.input))
+        return
+    with open_text(args.output, 'w') as w:
+        for command in read_commands(args.input):
+            w.write(command + '\n')
+
+
+def translate_main(args):
+    from pen.gcode import translate_ngc
+
+    with open_text(args.input) as r, open_text(args.output, 'w') as w:
+        for command in translate_ngc(r):
+            w.write(command + '\n')
+
+
+def get_layer_name(layer):
+    return 'default' if layer is None else str(layer)
+
+
+def get_layer_path(path, layer):
+    # drawing.gcode.gz -> drawing.red.gcode.gz, with the layer name made safe for a file name.
+    name = re.sub(r'[^\w-]+', '_', get_layer_name(layer)).strip('_')
+    head, tail = os.path.split(path)
+    stem, dot, extensions = tail.partition('.')
+    return os.path.join(head, stem + '.' + name + dot + extensions)
+
+
+def write_svg_output(args, path, viz, pen, commands):
+    from pen.gcode import compact_gcode
+    from pen.gcode import get_gcode_bytes
+    from pen.jobfile import is_job_path
+    from pen.jobfile import write_job
+
+    if is_job_path(path):
+        write_job(path, commands, pen)
+        return
+    with open_text(path, 'w') as w:
+        if path.endswith('.svg'):
+            w.write(viz.to_svg(pen))
+            return
+        if args.compact:
+            compacted = compact_gcode(commands, resolution=args.resolution)
+            saved = get_gcode_bytes(commands) - get_gcode_bytes(compacted)
+            out = sys.stderr if args.output == '-' else sys.stdout
+            print('Saved {} bytes ({:.0f}%) by compacting'.format(saved, 100.0 * saved / max(1, get_gcode_bytes(commands))), file=out)
+            commands = compacted
+        w.write('\n'.join(commands))
+
+
+def svg_main(args):
+    from pen.dedup import dedup_penviz
+    from pen.gcode import join_pauses
+    from pen.optimizer import get_gcode_stats
+    from pen.penviz import Pen
+    from pen.svgimport import import_svg
+
+    if args.split_layers and args.output == '-':
+        raise RuntimeError('--split_layers writes a file per layer, give an output path')
+    pen = Pen(stroke_width_mm=args.stroke_width)
+    workers = args.workers if args.workers > 0 else None
+    viz = import_svg(args.input, pen, fill=not args.no_fill, hatch_angle=args.hatch_angle, workers=workers, layers=args.layers)
+    out = sys.stderr if args.output == '-' else sys.stdout
+    if args.dedup:
+        viz, saved = dedup_penviz(viz, tolerance=args.dedup_tolerance)
+        print('Removed {:.1f} mm of retraced strokes'.format(saved), file=out)
+
+    programs = viz.to_layer_gcode(pen, optimize=args.optimize)
+    if len(programs) > 1:
+        for layer, commands in programs:
+            stats = get_gcode_stats(commands)
+            print('Layer {}: {} lines, {:.1f} mm pen down, estimated time {:.1f} s'.format(
+                get_layer_name(layer), stats['lines'], stats['pen_down_distance'], stats['time']), file=out)
+
+    if args.split_layers:
+        for layer, commands in programs:
+            path = get_layer_path(args.output, layer)
+            write_svg_output(args, path, viz.get_layer(layer), viz.get_pen(layer, pen), commands)
+            print('Wrote layer {} to {}'.format(get_layer_name(layer), path), file=out)
+        return
+    # One job for every layer, pausing for a pen change in between.
+    write_svg_output(args, args.output, viz, pen, join_pauses([commands for _, commands in programs]))
+
+
+def daemon_main(args):
+    from pen.daemon import serve_device
+
+    print('Holding {} open on {}'.format(args.device, args.socket))
+    try:
+        serve_device(args.device, args.socket)
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_main(args):
+    from pen.scheduler import JobScheduler
+    from pen.scheduler import SchedulerServer
+    from pen.scheduler import discover_devices
+
+    ports = args.devices if args.devices else discover_devices()
+    if len(ports) == 0:
+        raise RuntimeError('No plotters found')
+    scheduler = JobScheduler(ports)
+    server = SchedulerServer(scheduler, (args.host, args.port))
+    print('Scheduling for {} on http://{}:{}'.format(', '.join(ports), args.host, server.server_port))
+    scheduler.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scheduler.stop()
+
+
+def submit_main(args):
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+
+    with open_text(args.gcode) as r:
+        data = r.read().encode('utf-8')
+    name = args.name if args.name else args.gcode
+    url = '{}/jobs?{}'.format(args.server, urllib.parse.urlencode({'name': name}))
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, method='POST')) as response:
+            job = json.load(response)
+    except urllib.error.HTTPError as e:
+        # The scheduler says why it refused the job, e.g. a pause for a pen change.
+        raise RuntimeError('Job refused: {}'.format(json.load(e).get('error', e.reason))) from None
+    print('Submitted job {} ({:.0f} s estimated)'.format(job['id'], job['estimated_duration']))
+
+
+def jobs_main(args):
+    import urllib.request
+
+    with urllib.request.urlopen('{}/jobs'.format(args.server)) as response:
+        jobs = json.load(response)
+    for job in jobs:
+        print('{:>4} {:<8} {:<16} {:>7}/{:<7} {}'.format(
+            job['id'],
+            job['status'],
+            job['device'] or '',
+            job['lines_sent'],
+            job['lines'],
+            job['name'] or '',
+        ))
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--device', default=DEFAULT_SERIAL_PORT)
+    parser.add_argument('--socket', default=DEFAULT_DAEMON_SOCKET, help='Device daemon socket, used when a daemon is running')
+    parser.add_argument(
+        '--profile',
+        default=os.environ.get(profiling.PROFILE_ENV),
+        help='Print stage timings: 1 for the summary only, or a .json Chrome trace or .prof cProfile path to also write',
+    )
 
     subparsers = parser.add_subparsers()
 
@@ -96,24 +589,112 @@ def main():
     move_parser.add_argument('--y', type=float)
     move_parser.set_defaults(main=move_main)
 
+    jog_parser = subparsers.add_parser('jog', help='Jog by --x/--y, to them with --absolute, or from the keyboard')
+    jog_parser.add_argument('--x', type=float)
+    jog_parser.add_argument('--y', type=float)
+    jog_parser.add_argument('--absolute', action='store_true')
+    jog_parser.add_argument('--feed_rate', default=DEFAULT_MOVE_RATE, type=float)
+    jog_parser.add_argument('--hold', default=0.5, type=float, help='Seconds a key press keeps jogging, longer than the key repeat delay')
+    jog_parser.set_defaults(main=jog_main)
+
     reset_parser = subparsers.add_parser('reset')
     reset_parser.set_defaults(main=reset_main)
 
     draw_parser = subparsers.add_parser('draw')
     draw_parser.add_argument('--gcode')
     draw_parser.add_argument('--skip_bounds_check', action='store_true')
+    draw_parser.add_argument('--clip', action='store_true', help='Crop strokes to the drawable area')
     draw_parser.add_argument('--feed_rate', default=1000, type=int)
     draw_parser.add_argument('--test', action='store_true')
     draw_parser.add_argument('--frame', action='store_true')
     draw_parser.add_argument('--no_pen', action='store_true')
+    draw_parser.add_argument('--resume', action='store_true')
+    draw_parser.add_argument('--adaptive_feed', action='store_true')
+    draw_parser.add_argument('--min_feed_override', default=70, type=int)
+    draw_parser.add_argument('--max_feed_override', default=150, type=int)
+    draw_parser.add_argument('--report', help='Write a streaming report, .json or .csv')
     draw_parser.set_defaults(main=draw_main)
 
+    optimize_parser = subparsers.add_parser('optimize')
+    optimize_parser.add_argument('input')
+    optimize_parser.add_argument('output')
+    optimize_parser.add_argument('--simplify_tolerance', default=DEFAULT_SIMPLIFY_TOLERANCE, type=float)
+    optimize_parser.add_argument('--join_tolerance', default=DEFAULT_JOIN_TOLERANCE, type=float)
+    optimize_parser.add_argument('--dedup', action='store_true', help='Drop strokes that retrace earlier ones')
+    optimize_parser.add_argument('--dedup_tolerance', default=DEFAULT_DEDUP_TOLERANCE, type=float)
+    optimize_parser.add_argument('--compact', action='store_true', help='Quantize coordinates and leave out unchanged modal words')
+    optimize_parser.add_argument('--resolution', default=RESOLUTION_EU, type=float, help='Coordinate resolution with --compact')
+    optimize_parser.set_defaults(main=optimize_main)
+
+    convert_parser = subparsers.add_parser('convert', help='Convert G-code to a binary .rpj job or back')
+    convert_parser.add_argument('input')
+    convert_parser.add_argument('output', nargs='?', default='-')
+    convert_parser.set_defaults(main=convert_main)
+
+    translate_parser = subparsers.add_parser('translate')
+    translate_parser.add_argument('input')
+    translate_parser.add_argument('output', nargs='?', default='-')
+    translate_parser.set_defaults(main=translate_main)
+
+    svg_parser = subparsers.add_parser('svg', help='Convert an SVG to G-code, a .rpj job or a .svg preview')
+    svg_parser.add_argument('input')
+    svg_parser.add_argument('output', nargs='?', default='-')
+    svg_parser.add_argument('--stroke_width', default=0.3, type=float, help='Pen width in mm, sets the hatch spacing')
+    svg_parser.add_argument('--hatch_angle', default=DEFAULT_HATCH_ANGLE, type=float)
+    svg_parser.add_argument('--no_fill', action='store_true', help='Draw outlines only')
+    svg_parser.add_argument('--optimize', action='store_true')
+    svg_parser.add_argument('--workers', default=1, type=int, help='Processes flattening paths, 0 for one per CPU')
+    svg_parser.add_argument('--dedup', action='store_true', help='Drop strokes that retrace earlier ones')
+    svg_parser.add_argument('--dedup_tolerance', default=DEFAULT_DEDUP_TOLERANCE, type=float)
+    svg_parser.add_argument('--compact', action='store_true', help='Quantize coordinates and leave out unchanged modal words')
+    svg_parser.add_argument('--resolution', default=RESOLUTION_EU, type=float, help='Coordinate resolution with --compact')
+    svg_parser.add_argument('--layers', choices=['color', 'group'], help='Draw each paint colour or top level <g> with its own pen')
+    svg_parser.add_argument('--split_layers', action='store_true', help='Write a file per layer instead of pausing for pen changes')
+    svg_parser.set_defaults(main=svg_main)
+
+    daemon_parser = subparsers.add_parser('daemon', help='Hold the device open and set up for other commands')
+    daemon_parser.set_defaults(main=daemon_main)
+
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('--devices', nargs='*', help='Serial ports, discovered when not given')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', default=DEFAULT_API_PORT, type=int)
+    serve_parser.set_defaults(main=serve_main)
+
+    server_url = 'http://127.0.0.1:{}'.format(DEFAULT_API_PORT)
+
+    submit_parser = subparsers.add_parser('submit')
+    submit_parser.add_argument('gcode')
+    submit_parser.add_argument('--name')
+    submit_parser.add_argument('--server', default=server_url)
+    submit_parser.set_defaults(main=submit_main)
+
+    jobs_parser = subparsers.add_parser('jobs')
+    jobs_parser.add_argument('--server', default=server_url)
+    jobs_parser.set_defaults(main=jobs_main)
+
     args = parser.parse_args()
 
+    try:
+        profile_path = profiling.parse_profile_value(args.profile)
+    except RuntimeError as e:
+        parser.error(str(e))
     if not hasattr(args, 'main'):
         parser.print_help()
         return -1
-    args.main(args)
+    if profile_path is None:
+        args.main(args)
+        return
+
+    profiling.enable(use_cprofile=profile_path.endswith(profiling.PSTATS_EXTENSIONS))
+    try:
+        args.main(args)
+    finally:
+        profiler = profiling.disable()
+        profiler.print_summary()
+        if profile_path:
+            profiler.save(profile_path)
+            print('Wrote profile to {}'.format(profile_path), file=sys.stderr)
 
 
 if __name__ == '__main__':
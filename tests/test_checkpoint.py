@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from pen.checkpoint import JobCheckpoint
+from pen.gcode import GCode
+from pen.gcode import GCodeState
+
+
+class TestCheckpoint(unittest.TestCase):
+    def test_gcode_state(self):
+        state = GCodeState()
+        for command in ['G21', 'G90', 'M3S40', 'G1X10Y5F500', 'G3X12Y7I1J1F500']:
+            state.handle_command(command)
+        self.assertListEqual([12, 7], state.position.tolist())
+        self.assertEqual(500, state.feed_rate)
+        expected = [
+            GCode.set_units_mm(),
+            GCode.set_coordinates_absolute(),
+            GCode.set_feed_rate(500.0),
+            GCode.pen_up(),
+            GCode.move_fast([12.0, 7.0]),
+            'M3S40',
+        ]
+        self.assertListEqual(expected, state.to_commands())
+
+    def test_resume(self):
+        commands = ['M5', 'G0X1Y1', 'M3S60', 'G1X2Y1F1000', 'G1X3Y1F1000', 'G1X4Y1F1000', 'M5']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gcode_path = os.path.join(tmp_dir, 'job.gcode')
+            checkpoint_path = gcode_path + '.checkpoint'
+            checkpoint = JobCheckpoint(checkpoint_path, gcode_path, len(commands), command_offset=1, margin=2)
+            sent = ['G0X0Y0'] + commands[:5]
+            for index, command in enumerate(sent):
+                checkpoint.ack(index, command)
+            checkpoint.save()
+            self.assertEqual(5, checkpoint.line)
+
+            resumed = JobCheckpoint.load(checkpoint_path, gcode_path, len(commands))
+            self.assertEqual(3, resumed.line)
+            self.assertListEqual([1, 1], resumed.resume_state.position.tolist())
+            self.assertEqual('M3S60', resumed.get_resume_commands()[-1])
+
+            with self.assertRaises(RuntimeError):
+                JobCheckpoint.load(checkpoint_path, gcode_path, len(commands) + 1)
@@ -0,0 +1,94 @@
+import unittest
+
+import numpy as np
+
+from pen.clipping import PolygonMask
+from pen.clipping import clip_arcs
+from pen.clipping import clip_gcode
+from pen.clipping import clip_penviz
+from pen.clipping import clip_polylines
+from pen.clipping import clip_segment_intervals
+from pen.gcode import GCode
+from pen.gcode import get_gcode_bounds
+from pen.mathscene import ArcArray
+from pen.mathscene import Rectangle
+from pen.penviz import PenViz
+
+
+class TestClipping(unittest.TestCase):
+    def test_rectangle_segments(self):
+        rect = Rectangle(0, 10, 0, 10)
+        index, t0, t1 = clip_segment_intervals(
+            starts=[[-5, 5], [1, 1], [20, 20], [5, -5]],
+            ends=[[15, 5], [2, 2], [30, 30], [5, 5]],
+            mask=rect,
+        )
+        self.assertListEqual([0, 1, 3], index.tolist())
+        np.testing.assert_allclose([0.25, 0.0, 0.5], t0)
+        np.testing.assert_allclose([0.75, 1.0, 1.0], t1)
+
+        # The polygon path agrees with Liang-Barsky for rectangles.
+        polygon_index, polygon_t0, polygon_t1 = clip_segment_intervals(
+            starts=[[-5, 5], [1, 1], [20, 20], [5, -5]],
+            ends=[[15, 5], [2, 2], [30, 30], [5, 5]],
+            mask=PolygonMask([[0, 0], [10, 0], [10, 10], [0, 10]]),
+        )
+        self.assertListEqual(index.tolist(), polygon_index.tolist())
+        np.testing.assert_allclose(t0, polygon_t0)
+        np.testing.assert_allclose(t1, polygon_t1)
+
+    def test_polyline_split(self):
+        # A zigzag leaving and re-entering the rectangle becomes two polylines.
+        points = np.array([[1, 1], [5, 1], [5, 15], [8, 15], [8, 1], [9, 1]], dtype=float)
+        clipped, offsets = clip_polylines(points, [0, len(points)], Rectangle(0, 10, 0, 10))
+        self.assertListEqual([0, 3, 6], offsets.tolist())
+        np.testing.assert_allclose([[1, 1], [5, 1], [5, 10]], clipped[0:3])
+        np.testing.assert_allclose([[8, 10], [8, 1], [9, 1]], clipped[3:6])
+
+        # The outside is what remains when inverted.
+        inverted, offsets = clip_polylines(points, [0, len(points)], Rectangle(0, 10, 0, 10), invert=True)
+        self.assertListEqual([0, 4], offsets.tolist())
+        np.testing.assert_allclose([[5, 10], [5, 15], [8, 15], [8, 10]], inverted)
+
+    def test_concave_polygon(self):
+        # A U shape, a horizontal line through both arms is split in two.
+        mask = PolygonMask([[0, 0], [9, 0], [9, 9], [6, 9], [6, 3], [3, 3], [3, 9], [0, 9]])
+        clipped, offsets = clip_polylines([[-1, 5], [10, 5]], [0, 2], mask)
+        self.assertListEqual([0, 2, 4], offsets.tolist())
+        np.testing.assert_allclose([[0, 5], [3, 5], [6, 5], [9, 5]], clipped)
+
+    def test_arcs(self):
+        circles = ArcArray.from_circles([[0, 0], [20, 20]], 1.0)
+        clipped = clip_arcs(circles, Rectangle(0, 10, 0, 10))
+        self.assertEqual(1, len(clipped))
+        np.testing.assert_allclose([0.5 * np.pi], clipped.get_lengths())
+        np.testing.assert_allclose([0, 1, 0, 1], clipped.get_aabb().get_rect().to_xxyy(), atol=1e-9)
+
+    def test_penviz(self):
+        viz = PenViz()
+        viz.draw_path([[-5, 5], [5, 5]])
+        viz.draw_circle(np.array([10.0, 0.0]), 1.0)
+        clipped = clip_penviz(viz, Rectangle(0, 10, 0, 10))
+        np.testing.assert_allclose([0, 10, 0, 5], clipped.get_aabb().get_rect().to_xxyy(), atol=1e-9)
+
+    def test_gcode(self):
+        commands = [
+            GCode.pen_up(),
+            GCode.move_fast([-5, 5]),
+            GCode.pen_down(),
+            GCode.move_linear([5, 5], 1000),
+            GCode.move_arc([5, 5], [5, 15], [5, 10], 1000),
+            GCode.pen_up(),
+            GCode.move_fast([20, 20]),
+            GCode.pen_down(),
+            GCode.move_linear([30, 30], 1000),
+            GCode.pen_up(),
+        ]
+        clipped = clip_gcode(commands, Rectangle(0, 10, 0, 10))
+        self.assertEqual(1, clipped.count(GCode.pen_down()))
+        np.testing.assert_allclose([0, 10, 0, 10], get_gcode_bounds(clipped).to_xxyy(), atol=1e-9)
+        self.assertTrue(clipped[-2].startswith('G3'))
+
+        # Strokes entirely outside leave nothing to draw, which has no bounds.
+        self.assertListEqual([], clip_gcode(commands[6:], Rectangle(0, 10, 0, 10)))
+        self.assertIsNone(get_gcode_bounds([]))
@@ -0,0 +1,151 @@
+import json
+import os
+import socket
+import stat
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from pen.daemon import DaemonServer
+from pen.daemon import DeviceDaemon
+from pen.daemon import connect_daemon
+from pen.fakegrbl import get_fake_grbl
+from pen.gcode import GCode
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'robopen.sock')
+        self.grbl = get_fake_grbl('daemon', time_scale=0.001)
+        self.daemon = DeviceDaemon('fakegrbl://daemon')
+        self.daemon.start()
+        self.server = DaemonServer(self.daemon, self.path)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.daemon.stop()
+        self.tmp_dir.cleanup()
+
+    def test_commands_and_jobs(self):
+        resets = len(self.grbl.realtime)
+        for x in [10, 20, 30]:
+            # Each command is a new client, like separate robopen.py move calls.
+            with connect_daemon(self.path) as client:
+                self.assertEqual('IDLE', client.run_commands([GCode.move_fast([x, 5])])['state'])
+        with connect_daemon(self.path) as client:
+            self.assertEqual([30.0, 5.0], client.get_status()['position'])
+
+            commands = [GCode.pen_down()] + [GCode.move_linear([i % 7, i % 5]) for i in range(200)] + [GCode.pen_up()]
+            progress = []
+            result = client.run_job(commands, on_progress=progress.append)
+            self.assertEqual(len(commands), result['acked'])
+            self.assertFalse(result['cancelled'])
+            self.assertEqual(len(commands), progress[-1])
+            self.assertListEqual(sorted(progress), progress)
+
+            with self.assertRaises(RuntimeError):
+                client.request('jump')
+        # The device was set up once, not per client.
+        self.assertEqual(resets, len(self.grbl.realtime))
+
+    def test_socket_permissions(self):
+        # Only the daemon's owner may connect, even with the socket in /tmp.
+        self.assertEqual(0, stat.S_IMODE(os.stat(self.path).st_mode) & 0o077)
+        self.assertEqual(os.getuid(), os.stat(self.path).st_uid)
+
+    def test_job_chunks(self):
+        commands = [GCode.pen_down()] + [GCode.move_linear([i % 7, i % 5]) for i in range(300)] + [GCode.pen_up()]
+        received = []
+
+        def iter_commands():
+            for command in commands:
+                received.append(len(self.grbl.lines))
+                yield command
+
+        start = len(self.grbl.lines)
+        with mock.patch('pen.daemon.JOB_CHUNK_LINES', 16), connect_daemon(self.path) as client:
+            result = client.run_job(iter_commands())
+        self.assertEqual(len(commands), result['acked'])
+        self.assertEqual(len(commands), result['lines'])
+        self.assertListEqual(commands, [line for line in self.grbl.lines[start:] if line != ''])
+        # The client reads the program as the daemon asks for it, not all up front.
+        self.assertGreater(received[-1] - start, len(commands) // 2)
+
+    def test_pause_job(self):
+        commands = [GCode.pen_down(), GCode.move_linear([10, 0]), GCode.pen_up(), GCode.pause(), GCode.move_fast([20, 0])]
+        paused = []
+        with connect_daemon(self.path) as client:
+
+            def on_pause(index):
+                with connect_daemon(self.path) as other:
+                    paused.append((index, other.get_status()['state']))
+
+            result = client.run_job(commands, on_pause=on_pause)
+        # The client resumes once on_pause returns.
+        self.assertListEqual([(3, 'HOLD')], paused)
+        self.assertEqual(len(commands), result['acked'])
+        self.assertEqual('IDLE', result['state'])
+
+        # Without anyone to change the pen the job is cancelled at the pause, not drawn on.
+        with connect_daemon(self.path) as client:
+            with self.assertRaises(RuntimeError):
+                client.run_job(commands)
+            self.assertEqual('IDLE', client.get_status()['state'])
+        self.assertNotIn('G0X20Y0', self.grbl.lines[-3:])
+        self.assertListEqual(['M5', 'G0X0Y0'], self.grbl.lines[-2:])
+
+    def test_failed_jobs(self):
+        commands = [GCode.pen_down()] + [GCode.move_linear([100 * (i % 2), i]) for i in range(200)]
+
+        def check_ready(x):
+            # The next client's commands get their own answers, not the old job's, with the pen up.
+            with connect_daemon(self.path) as client:
+                self.assertEqual('IDLE', client.run_commands([GCode.move_fast([x, 5])])['state'])
+                self.assertEqual([float(x), 5.0], client.get_status()['position'])
+                self.assertListEqual(['M5', GCode.move_fast([x, 5])], [line for line in self.grbl.lines if line != ''][-2:])
+
+        # A client that goes away mid-job, with the pen down and lines in flight.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        reader = sock.makefile('rb')
+        sock.sendall(b'{"op": "job"}\n')
+        self.assertEqual({'more': True}, json.loads(reader.readline()))
+        sock.sendall((json.dumps({'commands': commands}) + '\n').encode('utf-8'))
+        self.assertEqual({'more': True}, json.loads(reader.readline()))
+        reader.close()
+        sock.close()
+        check_ready(10)
+
+        # A job GRBL rejects part way through.
+        with connect_daemon(self.path) as client:
+            with self.assertRaises(RuntimeError):
+                client.run_job(commands[:50] + ['G7X2'] + commands[50:])
+        check_ready(20)
+
+        with connect_daemon(self.path) as client:
+            result = client.run_job(commands + [GCode.pen_up()])
+        self.assertEqual(len(commands) + 1, result['acked'])
+
+    def test_cancel_job(self):
+        commands = [GCode.pen_down()] + [GCode.move_linear([100 * (i % 2), i]) for i in range(2000)] + [GCode.pen_up()]
+        results = []
+        started = threading.Event()
+        with connect_daemon(self.path) as client:
+            thread = threading.Thread(target=lambda: results.append(client.run_job(commands, on_progress=lambda acked: started.set())))
+            thread.start()
+            self.assertTrue(started.wait(timeout=10.0))
+            with connect_daemon(self.path) as other:
+                self.assertEqual('RUN', other.get_status()['state'])
+                self.assertTrue(other.cancel()['running'])
+            thread.join()
+        result, = results
+        self.assertTrue(result['cancelled'])
+        self.assertLess(result['acked'], len(commands))
+        # The pen is lifted and sent home.
+        self.assertListEqual(['M5', 'G0X0Y0'], [line for line in self.grbl.lines if line != ''][-2:])
+        self.assertIsNone(connect_daemon(os.path.join(self.tmp_dir.name, 'missing.sock')))
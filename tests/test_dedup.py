@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+
+from pen.dedup import dedup_gcode
+from pen.dedup import dedup_penviz
+from pen.dedup import get_redundant_arc_intervals
+from pen.dedup import get_redundant_segment_intervals
+from pen.mathscene import ArcArray
+from pen.optimizer import get_gcode_stats
+from pen.penviz import DrawArcs
+from pen.penviz import Pen
+from pen.penviz import PenViz
+
+
+class TestDedup(unittest.TestCase):
+    def test_segments(self):
+        index, t0, t1 = get_redundant_segment_intervals(
+            starts=[[0, 0], [10, 0], [5, 0.01], [10, 0], [0, 5]],
+            ends=[[10, 0], [0, 0], [15, 0.01], [10, -5], [10, 6]],
+        )
+        # The reversed copy goes whole, the offset one along the first segment only. Segments that
+        # just meet end to end or cross lose nothing.
+        order = np.argsort(index)
+        self.assertListEqual([1, 2], index[order].tolist())
+        np.testing.assert_allclose([0.0, 0.0], t0[order])
+        np.testing.assert_allclose([1.0, 0.5], t1[order])
+
+    def test_arcs(self):
+        arcs = ArcArray(
+            centers=[[0, 0], [0, 0], [0, 0.01], [0, 0]],
+            radii=[1, 1, 1, 2],
+            start_thetas=[0, 0, 1.5 * np.pi, 0],
+            widths=[np.pi, np.pi, np.pi, 2 * np.pi],
+        )
+        index, u0, u1 = get_redundant_arc_intervals(arcs)
+        order = np.lexsort([u0, index])
+        self.assertListEqual([1, 2], index[order].tolist())
+        np.testing.assert_allclose([0.0, 0.5], u0[order])
+        np.testing.assert_allclose([1.0, 1.0], u1[order])
+
+    def test_penviz(self):
+        viz = PenViz()
+        square = np.array([[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]])
+        viz.draw_path(square)
+        viz.draw_path(square[::-1])
+        viz.draw_path([[5, 10], [15, 10], [15, 20]])
+        viz.draw_circle([20, 20], 5)
+        viz.draw_circle([20, 20], 5)
+
+        deduped, saved = dedup_penviz(viz)
+        self.assertAlmostEqual(40.0 + 5.0 + 10.0 * np.pi, saved)
+        self.assertEqual(3, len(deduped.drawables))
+        np.testing.assert_allclose(square, deduped.drawables[0].path.points)
+        np.testing.assert_allclose([[10, 10], [15, 10], [15, 20]], deduped.drawables[1].path.points)
+        self.assertEqual(DrawArcs, type(deduped.drawables[2]))
+        self.assertEqual(1, len(deduped.drawables[2].arcs))
+
+    def test_gcode(self):
+        viz = PenViz()
+        viz.draw_path([[0, 0], [10, 0], [10, 10]])
+        viz.draw_path([[10, 10], [10, 0], [0, 0]])
+        viz.draw_arc([5, 0], [0, 5], [0, 0])
+        viz.draw_arc([5, 0], [0, 5], [0, 0])
+        commands = viz.to_gcode(Pen())
+
+        deduped, saved = dedup_gcode(commands)
+        before = get_gcode_stats(commands)['pen_down_distance']
+        after = get_gcode_stats(deduped)['pen_down_distance']
+        # Everything was drawn twice.
+        self.assertAlmostEqual(before / 2.0, saved)
+        self.assertAlmostEqual(before / 2.0, after)
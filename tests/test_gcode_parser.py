@@ -3,8 +3,15 @@ import unittest
 import numpy as np
 
 from pen.gcode import GCode
+from pen.gcode import GCodeParser
+from pen.gcode import GCodeState
 from pen.gcode import PenMode
+from pen.gcode import compact_gcode
+from pen.gcode import get_gcode_bytes
+from pen.gcode import get_gcode_bounds
 from pen.gcode import parse_gcode
+from pen.gcode import parse_ngc_words
+from pen.gcode import translate_ngc
 
 
 class TestGCodeParser(unittest.TestCase):
@@ -35,3 +42,139 @@ class TestGCodeParser(unittest.TestCase):
         op = parse_gcode(GCode.move_arc([1, 1], [2, 2], [1, 2]), current_position=[1, 1])
         self.assertEqual(0.5 * np.pi, op.get_pen_distance())
         self.assertListEqual([1, 2, 1, 2], op.get_aabb().get_rect().to_xxyy())
+
+    def test_clockwise_arc(self):
+        op = parse_gcode(GCode.move_arc_cw([2, 2], [1, 1], [1, 2]), current_position=[2, 2])
+        self.assertAlmostEqual(0.5 * np.pi, op.get_pen_distance())
+        self.assertListEqual([1, 1], op.get_end_position().tolist())
+        self.assertListEqual([1, 2, 1, 2], op.get_aabb().get_rect().to_xxyy())
+
+    def test_modal_words(self):
+        parser = GCodeParser()
+        ops = [parser.parse(command) for command in ['G21', 'G1X1Y1F500', 'X2', 'Y3F800', 'F1000', 'G0X0']]
+        self.assertIsNone(ops[0])
+        self.assertListEqual([2, 1], ops[2].get_end_position().tolist())
+        self.assertEqual(500, ops[2].rate_eu)
+        self.assertListEqual([2, 3], ops[3].get_end_position().tolist())
+        self.assertEqual(800, ops[3].rate_eu)
+        self.assertIsNone(ops[4])
+        self.assertListEqual([0, 3], ops[5].get_end_position().tolist())
+        with self.assertRaises(RuntimeError):
+            GCodeParser().parse('X1Y1')
+
+    def test_relative_and_inches(self):
+        parser = GCodeParser()
+        commands = ['G91', 'G1X1Y2F500', 'X1', 'G90', 'G20X1Y0F10', 'G91', 'G3X1I.5', 'G21', 'G90', 'G0X5']
+        ops = [op for op in [parser.parse(command) for command in commands] if op is not None]
+        self.assertListEqual([1, 2], ops[0].get_end_position().tolist())
+        self.assertListEqual([2, 2], ops[1].get_end_position().tolist())
+        # Inch values, feed rates included, come out in mm.
+        np.testing.assert_allclose([25.4, 0], ops[2].get_end_position())
+        self.assertAlmostEqual(254.0, ops[2].rate_eu)
+        np.testing.assert_allclose([50.8, 0], ops[3].get_end_position())
+        self.assertAlmostEqual(0.5 * np.pi * 25.4, ops[3].get_pen_distance())
+        self.assertListEqual([5, 0], ops[4].get_end_position().tolist())
+
+    def test_several_g_words(self):
+        # Units and distance mode apply before the motion whatever order the words come in.
+        self.assertListEqual([21, 91, 1], parse_ngc_words('G1 G91 G21 X1 Y1')['G'])
+        parser = GCodeParser()
+        commands = ['G21 G91 G1 X1 Y1', 'X1 Y1', 'G20 G90', 'G0 X1 Y0']
+        ops = [op for op in [parser.parse(command) for command in commands] if op is not None]
+        self.assertListEqual([1, 1], ops[0].get_end_position().tolist())
+        self.assertListEqual([2, 2], ops[1].get_end_position().tolist())
+        np.testing.assert_allclose([25.4, 0], ops[2].get_end_position())
+
+        state = GCodeState()
+        for command in commands:
+            state.handle_command(command)
+        self.assertFalse(state.units_mm)
+        self.assertTrue(state.absolute)
+        self.assertEqual(0, state.motion_mode)
+
+    def test_compact_gcode(self):
+        commands = [
+            'G21',
+            GCode.move_fast([10.000001, 0.5]),
+            GCode.pen_down(),
+            GCode.move_linear([12.345678901234, 0.5]),
+            GCode.move_linear([12.345681, 0.5]),
+            GCode.move_linear([12.345681, -0.25]),
+            GCode.move_arc([12.345681, -0.25], [12.345681, -0.25], [12.345681, 1.75]),
+            GCode.move_linear([20, -0.25], feed_rate=800),
+            GCode.pen_up(),
+        ]
+        compact = compact_gcode(commands)
+        expected = ['G21', 'G0X10Y.5', 'M3S60', 'G1X12.34568F1000', 'Y-.25', 'G3X12.34568Y-.25J2', 'G1X20F800', 'M5']
+        self.assertListEqual(expected, compact)
+        self.assertLess(get_gcode_bytes(compact), 0.6 * get_gcode_bytes(commands))
+        self.assertListEqual(compact, compact_gcode(compact))
+        # The rounded program moves the same way.
+        np.testing.assert_allclose(get_gcode_bounds(commands).to_xxyy(), get_gcode_bounds(compact).to_xxyy(), atol=1e-5)
+        self.assertListEqual(['G1X12.3Y.5F1000', 'Y-.2'], compact_gcode(commands[3:6], resolution=0.1))
+
+    def test_compact_relative(self):
+        # Relative moves are kept as they are, and what follows sets the motion mode and feed rate again.
+        commands = ['G90', 'G1X0Y0F1000', 'G91', 'G0X1Y1', 'G90', 'G1X5Y5F1000']
+        compact = compact_gcode(commands)
+        self.assertListEqual(['G90', 'G1X0Y0F1000', 'G91', 'G0X1Y1', 'G90', 'G1X5Y5'], compact)
+        commands = ['G1X2Y0F800', 'G0X3Y0F500', 'G1', 'G91', 'X1', 'G0', 'Y1', 'G90 G1X5Y5', 'X6']
+        compact = compact_gcode(commands)
+        self.assertListEqual(['G1X2Y0F800', 'G0X3', 'G91', 'G1F500X1', 'G0', 'Y1', 'G90 G1X5Y5', 'X6Y5'], compact)
+        for program in [commands, compact]:
+            state = GCodeState()
+            for command in program:
+                state.handle_command(command)
+            self.assertListEqual([6.0, 5.0], list(state.position))
+        np.testing.assert_allclose(get_gcode_bounds(commands).to_xxyy(), get_gcode_bounds(compact).to_xxyy())
+
+
+class TestNGCTranslation(unittest.TestCase):
+    def test_translate_ngc(self):
+        lines = [
+            '%',
+            'G21 (All units in mm)',
+            'G00 Z5.000000',
+            'G00 X10.0 Y20.0',
+            'G01 Z-0.125000 F100.0(Penetrate)',
+            'G01 X11.0 Y20.0 Z-0.125000 F400.000000',
+            'G01 Y21.0',
+            'G02 X12.0 Y20.0 Z-0.125000 I0.0 J-1.0',
+            'G00 Z5.000000',
+            'M2',
+        ]
+        commands = list(translate_ngc(lines))
+        expected = [
+            GCode.pen_up(),
+            GCode.move_fast([10.0, 20.0]),
+            GCode.pen_down(),
+            GCode.move_linear([11.0, 20.0], feed_rate=400),
+            GCode.move_linear([11.0, 21.0], feed_rate=400),
+            GCode.move_arc_cw([11.0, 21.0], [12.0, 20.0], [11.0, 20.0], feed_rate=400),
+            GCode.pen_up(),
+        ]
+        self.assertListEqual(expected, commands)
+        self.assertListEqual([0, 12, 0, 21], get_gcode_bounds(commands).to_xxyy())
+
+    def test_translate_ngc_modal_moves(self):
+        lines = [
+            'G00 Z5.0',
+            'G00 X1.0 Y1.0',
+            'G01 Z-0.1 F300',
+            'G01 X2.0 Y1.0',
+            # Axis words alone keep moving with G01.
+            'X2.0 Y2.0',
+            'Y3.0',
+            'Z5.0 (Still G01, not a pen up)',
+            'G00 Z5.0',
+        ]
+        expected = [
+            GCode.pen_up(),
+            GCode.move_fast([1.0, 1.0]),
+            GCode.pen_down(),
+            GCode.move_linear([2.0, 1.0], feed_rate=300),
+            GCode.move_linear([2.0, 2.0], feed_rate=300),
+            GCode.move_linear([2.0, 3.0], feed_rate=300),
+            GCode.pen_up(),
+        ]
+        self.assertListEqual(expected, list(translate_ngc(lines)))
@@ -0,0 +1,34 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from pen.gcodeio import GCodeFile
+from pen.gcodeio import open_gcode
+from pen.penviz import Pen
+from pen.penviz import PenViz
+
+
+class TestGCodeIO(unittest.TestCase):
+    def test_compressed_round_trip(self):
+        viz = PenViz()
+        viz.draw_path([[10, 10], [50, 10], [50, 40]])
+        viz.draw_circle([30, 80], 10)
+        pen = Pen()
+        commands = viz.to_gcode(pen)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for extension in ['', '.gz', '.xz', '.bz2']:
+                path = os.path.join(tmp_dir, 'job.gcode' + extension)
+                viz.save_gcode(path, pen)
+                program = GCodeFile(path)
+                self.assertListEqual(commands, list(program))
+                self.assertEqual(len(commands), len(program))
+                self.assertListEqual(commands[2:5], list(program[2:5]))
+                self.assertListEqual(commands[4:], list(program[2:][2:]))
+
+            # The codec follows the extension, not the file contents.
+            with gzip.open(os.path.join(tmp_dir, 'job.gcode.gz'), 'rt') as r:
+                self.assertEqual(commands[0], r.readline().strip())
+            with open_gcode(os.path.join(tmp_dir, 'job.gcode'), 'rb') as r:
+                self.assertEqual(commands[0].encode(), r.readline().strip())
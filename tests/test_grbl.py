@@ -0,0 +1,115 @@
+import unittest
+
+from pen.eleksdraw import State
+from pen.eleksdraw import Status
+from pen.fakegrbl import get_fake_grbl
+from pen.gcode import GCode
+from pen.grbl import GRBL
+from pen.grbl import GRBL_PLANNER_BLOCKS
+from pen.grbl import GRBL_RX_BUFFER_SIZE
+from pen import eleksdraw
+from pen.override import SegmentLengthFeedPolicy
+from pen.plotter import run_gcode
+from pen.streaming import EncodedProgram
+from pen.streaming import GCodeStreamer
+from pen.streaming import ProgramWindow
+from pen.telemetry import RunTelemetry
+
+
+class TestGRBL(unittest.TestCase):
+    def test_feed_override_steps(self):
+        self.assertListEqual([], GRBL.feed_override_steps(100, 100))
+        self.assertListEqual([GRBL.feed_override_reset()], GRBL.feed_override_steps(130, 100))
+        self.assertListEqual(
+            [GRBL.feed_override_coarse_plus()] * 2 + [GRBL.feed_override_fine_plus()] * 3,
+            GRBL.feed_override_steps(100, 123),
+        )
+        self.assertListEqual([GRBL.feed_override_coarse_minus()] * 9, GRBL.feed_override_steps(100, 5))
+
+    def test_segment_length_policy(self):
+        policy = SegmentLengthFeedPolicy(short_length=1.0, long_length=11.0, min_percent=50, max_percent=150)
+        self.assertEqual(100, policy.get_override([]))
+        self.assertEqual(50, policy.get_override([0.1, 0.2]))
+        self.assertEqual(150, policy.get_override([20.0]))
+        self.assertEqual(100, policy.get_override([6.0]))
+
+    def test_run_gcode_feed_override(self):
+        class AlwaysFast(SegmentLengthFeedPolicy):
+            def get_override(self, segment_lengths):
+                return 150
+
+        commands = [GCode.pen_down()] + [GCode.move_linear([x, 0]) for x in range(1, 50)] + [GCode.pen_up()]
+        run_gcode(commands, 'fakegrbl://feed_override', feed_policy=AlwaysFast())
+
+        grbl = get_fake_grbl('feed_override')
+        start = grbl.lines.index(commands[0])
+        self.assertListEqual(commands, grbl.lines[start:start + len(commands)])
+        self.assertIn(ord(GRBL.feed_override_coarse_plus()), grbl.realtime)
+        # The override is handed back once the job finishes.
+        self.assertEqual(100, grbl.feed_override)
+
+    def test_encoded_program(self):
+        commands = ['G21', '', GCode.move_linear([1.5, 2]), 'M5']
+        program = EncodedProgram.from_commands(iter(commands), chunk_size=3)
+        self.assertEqual(len(commands), len(program))
+        self.assertEqual(('\n'.join(commands) + '\n').encode(), bytes(program.data))
+        self.assertListEqual(commands, [program.get_line(i) for i in range(len(program))])
+        self.assertEqual(len(commands[2]) + 1, program.get_line_bytes(2))
+        with self.assertRaises(RuntimeError):
+            EncodedProgram.from_commands(['G21\nG90'])
+
+    def test_run_gcode_streaming(self):
+        commands = [GCode.pen_down()] + [GCode.move_linear([x, x / 2.0]) for x in range(1, 200)] + [GCode.pen_up()]
+        telemetry = RunTelemetry(status_interval=0.0)
+        run_gcode(commands, 'fakegrbl://streaming', telemetry=telemetry)
+
+        grbl = get_fake_grbl('streaming')
+        start = grbl.lines.index(commands[0])
+        self.assertListEqual(commands, grbl.lines[start:start + len(commands)])
+        self.assertFalse(grbl.overflowed)
+        # Several lines share the RX buffer, never more than it holds.
+        self.assertGreater(max(telemetry.rx_bytes), len(commands[1]) + 1)
+        self.assertLessEqual(max(telemetry.rx_bytes), GRBL_RX_BUFFER_SIZE)
+
+    def test_program_window(self):
+        commands = [GCode.pen_down()] + [GCode.move_linear([x, x / 2.0]) for x in range(1, 100)] + [GCode.pen_up()]
+        read = []
+
+        def iter_commands():
+            for command in commands:
+                read.append(command)
+                yield command
+
+        program = ProgramWindow(iter_commands(), chunk_size=8)
+        chunks = []
+        with eleksdraw.open_device('fakegrbl://window') as device:
+            streamer = GCodeStreamer(device, program)
+
+            def on_ack(index):
+                self.assertEqual(commands[index], program.get_line(index))
+                # Lines are read as they are sent, and only the chunks still in flight are kept.
+                self.assertLessEqual(len(read), streamer.sent + 8)
+                chunks.append(len(program.chunks))
+
+            self.assertIsNone(program.get_line_count())
+            streamer.run(on_ack=on_ack)
+
+        grbl = get_fake_grbl('window')
+        start = grbl.lines.index(commands[0])
+        self.assertListEqual(commands, grbl.lines[start:start + len(commands)])
+        self.assertEqual(len(commands), program.get_line_count())
+        self.assertLessEqual(max(chunks), 3)
+        self.assertEqual(0, len(program.chunks))
+
+    def test_parse_status(self):
+        status = Status.parse('<Run|MPos:1.000,2.000,0.000|Bf:12,100|FS:1000,0>')
+        self.assertEqual(State.RUN, status.state)
+        self.assertListEqual([1.0, 2.0], status.position)
+        self.assertEqual(12, status.planner_free)
+        self.assertEqual(100, status.rx_free)
+
+        status = Status.parse('<Idle,MPos:0.000,1.000,0.000,WPos:0.000,1.000,0.000,Buf:3,RX:28>')
+        self.assertEqual(State.IDLE, status.state)
+        self.assertListEqual([0.0, 1.0], status.position)
+        self.assertEqual(GRBL_PLANNER_BLOCKS - 3, status.planner_free)
+        self.assertEqual(GRBL_RX_BUFFER_SIZE - 28, status.rx_free)
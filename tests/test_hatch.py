@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from pen.hatch import get_hatch_spans
+from pen.hatch import hatch_polygons
+from pen.penviz import Pen
+from pen.svg import SVGPath
+from pen.svg import parse_style
+from pen.svgimport import import_svg
+
+SQUARE = [[0, 0], [10, 0], [10, 10], [0, 10]]
+HOLE = [[3, 3], [7, 3], [7, 7], [3, 7]]
+
+
+class TestHatch(unittest.TestCase):
+    def test_square_is_one_serpentine_stroke(self):
+        points, offsets = hatch_polygons([SQUARE], spacing=1.0, angle=0.0)
+        self.assertListEqual([0, 20], offsets.tolist())
+        np.testing.assert_allclose([[0, 0.5], [10, 0.5], [10, 1.5], [0, 1.5]], points[:4])
+        np.testing.assert_allclose([0, 10, 0.5, 9.5], [
+            points[:, 0].min(), points[:, 0].max(), points[:, 1].min(), points[:, 1].max()])
+
+    def test_hole_even_odd(self):
+        lines, x0, x1, ys = get_hatch_spans([SQUARE, HOLE], spacing=1.0, angle=0.0)
+        through_hole = ys[lines] == 5.5
+        np.testing.assert_allclose([0, 7], x0[through_hole])
+        np.testing.assert_allclose([3, 10], x1[through_hole])
+
+        points, offsets = hatch_polygons([SQUARE, HOLE], spacing=1.0, angle=0.0)
+        # Above, left of, right of and below the hole.
+        self.assertEqual(4, len(offsets) - 1)
+        inside_hole = (points[:, 0] > 3) & (points[:, 0] < 7) & (points[:, 1] > 3) & (points[:, 1] < 7)
+        self.assertFalse(np.any(inside_hole))
+
+    def test_angle(self):
+        points, offsets = hatch_polygons([SQUARE], spacing=0.3, angle=45.0)
+        self.assertEqual(2, len(offsets))
+        self.assertTrue(np.all(points > -1e-9) and np.all(points < 10 + 1e-9))
+        directions = np.diff(points[offsets[0]:offsets[0] + 2], axis=0)[0]
+        self.assertAlmostEqual(np.pi / 4.0, np.arctan2(abs(directions[1]), abs(directions[0])))
+
+
+class TestSVGFill(unittest.TestCase):
+    def test_paint(self):
+        self.assertDictEqual({'fill': '#000', 'stroke': 'none'}, parse_style('fill:#000; stroke:none'))
+        self.assertEqual('black', SVGPath('M0 0').get_fill())
+        self.assertIsNone(SVGPath('M0 0').get_stroke())
+        self.assertIsNone(SVGPath('M0 0', style='fill:none').get_fill())
+        self.assertEqual('red', SVGPath('M0 0', style='stroke:red', fill='blue').get_stroke())
+        self.assertEqual('blue', SVGPath('M0 0', fill='blue').get_fill())
+
+    def test_import(self):
+        svg = (
+            '<svg xmlns="http://www.w3.org/2000/svg">'
+            '<path d="M 0 0 L 10 0 L 10 10 L 0 10 Z" style="fill:black;stroke:black"/>'
+            '<path d="M 20 0 L 30 10" style="fill:none;stroke:black"/>'
+            '</svg>'
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'fill.svg')
+            with open(path, 'w') as w:
+                w.write(svg)
+            pen = Pen(stroke_width_mm=1.0)
+            filled = import_svg(path, pen)
+            outlines = import_svg(path, pen, fill=False)
+        self.assertEqual(2, len(outlines.drawables))
+        self.assertEqual(3, len(filled.drawables))
+        # y is flipped into plotter space.
+        np.testing.assert_allclose([0, 30, pen.draw_height - 10, pen.draw_height], filled.get_aabb().get_rect().to_xxyy(), atol=1e-9)
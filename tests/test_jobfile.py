@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from pen.gcode import get_gcode_bounds
+from pen.gcode import parse_ngc_words
+from pen.jobfile import JobFile
+from pen.jobfile import gcode_to_records
+from pen.jobfile import iter_records_gcode
+from pen.jobfile import write_job
+from pen.optimizer import get_gcode_stats
+from pen.penviz import Pen
+from pen.penviz import PenViz
+
+
+class TestJobFile(unittest.TestCase):
+    def test_round_trip(self):
+        commands = ['G21', 'G90', 'F1000', 'M5', 'G0X1.5Y2', 'M3S40', 'G1X10.25Y2F800', 'G2X10.25Y12I0J5F800', 'M5', 'G4 P250', 'G28']
+        records = gcode_to_records(['(comment)'] + commands)
+        self.assertEqual(len(commands), len(records))
+        self.assertListEqual(commands, list(iter_records_gcode(records, chunk_size=4)))
+
+        # Records hold positions as given, with bounds in mm.
+        for program in [['G91'], ['G20', 'G0X1Y1', 'G1X8Y8F40'], ['G90 G20']]:
+            with self.assertRaises(RuntimeError):
+                gcode_to_records(program)
+
+    def test_save_job(self):
+        viz = PenViz()
+        viz.draw_path([[10, 10], [50, 10], [50, 40.125]])
+        viz.draw_arc([80, 50], [60, 50], [70, 50])
+        viz.draw_circle(np.array([30, 80]), 10)
+        pen = Pen(servo_down=45)
+        commands = viz.to_gcode(pen)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'job.rpj')
+            viz.save_job(path, pen)
+            job = JobFile(path)
+            self.assertEqual(len(commands), len(job))
+            self.assertEqual(45, job.header['servo_down'])
+            self.assertEqual(3, job.header['stroke_count'])
+
+            # The header answers bounds and stats without decoding a line.
+            np.testing.assert_allclose(get_gcode_bounds(commands).to_xxyy(), job.get_rect().to_xxyy(), atol=1e-4)
+            expected = get_gcode_stats(commands)
+            stats = job.get_stats()
+            for key in ['lines', 'pen_up_distance', 'pen_down_distance', 'time']:
+                self.assertAlmostEqual(expected[key], stats[key], places=3)
+
+            # Lines decode lazily, from any slice, to the same program up to number formatting.
+            words = [parse_ngc_words(command) for command in commands]
+            self.assertListEqual(words, [parse_ngc_words(command) for command in job])
+            self.assertListEqual(words[3:7], [parse_ngc_words(command) for command in job[3:7]])
+            self.assertEqual(commands[-1], job[-1])
+
+            empty_path = os.path.join(tmp_dir, 'empty.rpj')
+            write_job(empty_path, [])
+            self.assertEqual([], list(JobFile(empty_path)))
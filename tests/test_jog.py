@@ -0,0 +1,111 @@
+import threading
+import time
+import unittest
+
+from pen import eleksdraw
+from pen.fakegrbl import get_fake_grbl
+from pen.grbl import GRBL
+from pen.jog import Jogger
+from pen.plotter import start_device
+from pen.plotter import wait_for_idle
+
+
+class TestJog(unittest.TestCase):
+    def test_jogs(self):
+        with eleksdraw.open_device('fakegrbl://jog_steps') as device:
+            start_device(device)
+            jogger = Jogger(device, feed_rate=1000)
+            jogger.jog([10, 5])
+            jogger.jog([-2, 1])
+            self.assertEqual([8.0, 6.0], device.get_status().position)
+            jogger.jog_to([1, 2])
+            self.assertEqual([1.0, 2.0], device.get_status().position)
+            # Jogs leave the modal feed rate alone.
+            self.assertEqual(1000, get_fake_grbl('jog_steps').gcode_state.feed_rate)
+
+            with self.assertRaises(RuntimeError):
+                device.run_command('$J=G91X1')
+            with self.assertRaises(RuntimeError):
+                device.run_command('$J=G1X1F100')
+
+    def test_cancel(self):
+        with eleksdraw.open_device('fakegrbl://jog_cancel?time_scale=1') as device:
+            start_device(device)
+            jogger = Jogger(device)
+            # A minute long jog, and more queued behind it.
+            jogger.jog([100, 0], feed_rate=100)
+            jogger.jog([0, 100], feed_rate=100)
+            self.assertEqual(eleksdraw.State.JOG, device.get_state())
+            time.sleep(0.05)
+            jogger.cancel()
+            status = device.get_status()
+            self.assertEqual(eleksdraw.State.IDLE, status.state)
+            self.assertGreater(status.position[0], 0.0)
+            self.assertLess(status.position[0], 1.0)
+            self.assertEqual(0.0, status.position[1])
+
+    def test_jog_after_cancel(self):
+        with eleksdraw.open_device('fakegrbl://jog_after_cancel?time_scale=5') as device:
+            start_device(device)
+            grbl = get_fake_grbl('jog_after_cancel')
+            jogger = Jogger(device)
+            jogger.jog([100, 0], feed_rate=600)
+            time.sleep(0.02)
+
+            # GRBL flushes its RX buffer once the cancel completes, a jog sent before then is lost.
+            def cancel_and_jog():
+                jogger.cancel()
+                jogger.jog([0, 1], feed_rate=600)
+
+            thread = threading.Thread(target=cancel_and_jog, daemon=True)
+            thread.start()
+            thread.join(timeout=5.0)
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(GRBL.jog([0, 1], 600), grbl.lines[-1])
+            wait_for_idle(device, interval=0.01)
+            x, y = device.get_status().position
+            self.assertLess(x, 10.0)
+            self.assertAlmostEqual(1.0, y)
+
+            # Lines sent while it decelerates get no response.
+            jogger.jog([100, 0], feed_rate=600)
+            device.send_realtime(GRBL.jog_cancel())
+            device.serial.write(b'G0X1\n')
+            jogger.cancel()
+            self.assertNotIn('G0X1', grbl.lines)
+            self.assertEqual(0, len(grbl.rx))
+
+    def test_continuous(self):
+        with eleksdraw.open_device('fakegrbl://jog_continuous?time_scale=1') as device:
+            start_device(device)
+            grbl = get_fake_grbl('jog_continuous')
+            jogger = Jogger(device, feed_rate=1200, interval=0.02, max_queued=2)
+            directions = [(1, 0)] * 10 + [(0, 2)] * 10
+            max_queued = 0
+
+            def get_direction():
+                nonlocal max_queued
+                max_queued = max(max_queued, len(grbl.planner))
+                return directions.pop(0)
+
+            jogger.run(get_direction, should_stop=lambda: len(directions) == 0)
+            # Stopping cancels what is queued instead of running it out.
+            self.assertEqual(eleksdraw.State.IDLE, device.get_state())
+            self.assertLessEqual(max_queued, 2)
+            x, y = device.get_status().position
+            # About 10 intervals at 20 mm/s each way, what was queued at the turn was dropped.
+            self.assertGreater(x, 2.0)
+            self.assertLess(x, 5.0)
+            self.assertGreater(y, 2.0)
+            self.assertEqual(GRBL.jog_cancel(), chr(grbl.realtime[-1]))
+
+            # From input to the new motion at the head of the planner.
+            jogger.set_direction((1, 0))
+            jogger.step()
+            start_time = time.monotonic()
+            jogger.set_direction((-1, 0))
+            jogger.step()
+            self.assertLess(time.monotonic() - start_time, 0.05)
+            self.assertLess(grbl.planner[0][1][0], device.get_status().position[0])
+            jogger.set_direction(None)
+            wait_for_idle(device, interval=0.01)
@@ -0,0 +1,203 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from pen import eleksdraw
+from pen.dedup import dedup_penviz
+from pen.fakegrbl import get_fake_grbl
+from pen.gcode import GCode
+from pen.gcode import split_pauses
+from pen.grbl import GRBL
+from pen.jobfile import gcode_to_records
+from pen.jobfile import iter_records_gcode
+from pen.optimizer import optimize_gcode
+from pen.penviz import Pen
+from pen.penviz import PenViz
+from pen.plotter import run_gcode
+from pen.plotter import start_device
+from pen.plotter import wait_for_idle
+from pen.streaming import EncodedProgram
+from pen.streaming import GCodeStreamer
+from pen.svgimport import import_svg
+
+LAYERS_SVG = '''<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape">
+  <g inkscape:label="Outline" id="layer1">
+    <path d="M0,0 L10,0" stroke="#F00" fill="none"/>
+    <g><rect x="20" y="20" width="5" height="5" stroke="blue" fill="none"/></g>
+  </g>
+  <g id="details">
+    <path d="M0,10 L10,10" stroke="#ff0000" fill="none"/>
+  </g>
+  <path d="M0,20 L10,20" stroke="blue" fill="none"/>
+</svg>
+'''
+
+
+def draw_layers():
+    viz = PenViz()
+    viz.set_layer('red', Pen(color='red', servo_down=40))
+    viz.draw_path([[0, 0], [10, 0]])
+    viz.set_layer('blue', Pen(color='blue', servo_down=50))
+    viz.draw_path([[10, 0], [20, 0]])
+    viz.set_layer('red')
+    viz.draw_path([[30, 0], [40, 0]])
+    return viz
+
+
+class TestLayers(unittest.TestCase):
+    def test_penviz_layers(self):
+        pen = Pen()
+        viz = draw_layers()
+        self.assertListEqual(['red', 'blue'], viz.get_layers())
+        programs = viz.to_layer_gcode(pen, optimize=True)
+        self.assertListEqual(['red', 'blue'], [layer for layer, _ in programs])
+        # Each layer is drawn with its own pen and ordered among its own strokes.
+        self.assertIn('M3S40', programs[0][1])
+        self.assertNotIn('M3S50', programs[0][1])
+        self.assertEqual(2, programs[0][1].count('M3S40'))
+
+        commands = viz.to_gcode(pen, optimize=True)
+        self.assertEqual(1, commands.count(GCode.pause()))
+        pause = commands.index(GCode.pause())
+        self.assertListEqual([GCode.pen_up(), GCode.move_home()], commands[pause - 2:pause])
+        first, second = split_pauses(commands)
+        self.assertListEqual(programs[0][1], first[:len(programs[0][1])])
+        self.assertListEqual(programs[1][1], second)
+
+        stats = dict(viz.get_layer_stats(pen))
+        self.assertAlmostEqual(20.0, stats['red']['pen_down_distance'])
+        self.assertAlmostEqual(10.0, stats['blue']['pen_down_distance'])
+        self.assertIn('stroke="blue"', viz.to_svg(pen))
+
+        # Without layers the program is the same as ever, with no pauses.
+        plain = PenViz()
+        plain.draw_path([[0, 0], [10, 0]])
+        plain.draw_circle(np.array([5.0, 5.0]), 2.0)
+        self.assertListEqual(
+            plain.drawables[0].to_gcode(pen) + plain.drawables[1].to_gcode(pen),
+            plain.to_gcode(pen),
+        )
+
+    def test_dedup_keeps_layers(self):
+        viz = draw_layers()
+        # The same stroke with another pen is not a retrace.
+        viz.set_layer('blue')
+        viz.draw_path([[0, 0], [10, 0]])
+        viz.set_layer('red')
+        viz.draw_path([[0, 0], [5, 0]])
+        deduped, saved = dedup_penviz(viz)
+        self.assertAlmostEqual(5.0, saved)
+        self.assertListEqual(['red', 'blue'], deduped.get_layers())
+        self.assertEqual(40, deduped.get_pen('red', Pen()).servo_down)
+        self.assertEqual(2, len(deduped.get_layer('blue').drawables))
+
+    def test_pauses_in_programs(self):
+        viz = draw_layers()
+        commands = viz.to_gcode(Pen())
+        optimized = optimize_gcode(commands)
+        self.assertEqual(1, optimized.count(GCode.pause()))
+        first, second = split_pauses(optimized)
+        self.assertNotIn('M3S50', first)
+        self.assertIn('M3S50', second)
+
+        records = gcode_to_records(commands)
+        self.assertListEqual(commands, list(iter_records_gcode(records)))
+
+    def test_commented_pauses(self):
+        # An M0 with a comment pauses just the same, for the optimizer, the layers and the streamer.
+        for pause in ['M0 (swap pen)', 'M0 ; pen 2', 'm00', ' M0.0']:
+            commands = draw_layers().to_gcode(Pen())
+            index = commands.index(GCode.pause())
+            commands[index] = pause
+            self.assertTrue(GCode.is_pause_command(pause))
+            self.assertEqual(2, len(split_pauses(commands)))
+            self.assertEqual(1, optimize_gcode(commands).count(GCode.pause()))
+            self.assertSetEqual({index}, EncodedProgram.from_commands(commands).get_pause_lines())
+        for command in ['M3S40', 'M5', 'M05', '(M0)', '; M0', 'G0X10Y0']:
+            self.assertFalse(GCode.is_pause_command(command))
+        program = EncodedProgram.from_commands(['M3S40', 'G1X10Y0 (M0)', 'M05', 'M0.5'])
+        self.assertSetEqual(set(), program.get_pause_lines())
+
+    def test_import_layers(self):
+        pen = Pen()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'layers.svg')
+            with open(path, 'w') as w:
+                w.write(LAYERS_SVG)
+            by_color = import_svg(path, pen, layers='color')
+            by_group = import_svg(path, pen, layers='group')
+            single = import_svg(path, pen)
+
+        # #F00 and #ff0000 are the same pen, rects are parsed before paths.
+        self.assertListEqual(['blue', '#ff0000'], by_color.get_layers())
+        self.assertEqual('#ff0000', by_color.get_pen('#ff0000', pen).color)
+        self.assertEqual(2, len(by_color.get_layer('blue').drawables))
+        self.assertEqual('black', pen.color)
+
+        self.assertListEqual(['Outline', 'details', None], by_group.get_layers())
+        self.assertEqual(2, len(by_group.get_layer('Outline').drawables))
+        self.assertListEqual([None], single.get_layers())
+
+    def test_stream_pauses(self):
+        grbl = get_fake_grbl('layers', time_scale=0.001)
+        commands = draw_layers().to_gcode(Pen())
+        pause = commands.index(GCode.pause())
+        paused = []
+        errors = []
+        with eleksdraw.open_device('fakegrbl://layers') as device:
+            start_device(device)
+            streamer = GCodeStreamer(device, EncodedProgram.from_commands(commands))
+            self.assertSetEqual({pause}, streamer.pause_lines)
+
+            def on_pause(index):
+                # GRBL holds at the pause once the first layer is drawn and the pen parked, and only
+                # acknowledges the M0 after the cycle start.
+                paused.append((index, grbl.get_state_name(), list(grbl.position), streamer.acked))
+
+            def run():
+                try:
+                    streamer.run(on_pause=on_pause)
+                except RuntimeError as e:
+                    errors.append(e)
+
+            # A streamer waiting for the M0 'ok' before resuming would never finish.
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            thread.join(timeout=10.0)
+            self.assertFalse(thread.is_alive())
+            self.assertListEqual([], errors)
+            self.assertListEqual([(pause, 'Hold', [0.0, 0.0], pause)], paused)
+            self.assertEqual(len(commands), streamer.acked)
+            self.assertFalse(grbl.hold)
+
+            # Without anyone to change the pen the job stops at the pause.
+            wait_for_idle(device, interval=0.01)
+            start_device(device)
+            streamer = GCodeStreamer(device, commands)
+            with self.assertRaises(RuntimeError):
+                streamer.run()
+            self.assertEqual(pause, streamer.acked)
+            wait_for_idle(device, interval=0.01)
+            self.assertEqual('Hold', grbl.get_state_name())
+            device.send_realtime(GRBL.cycle_start())
+            streamer.drain()
+            self.assertFalse(grbl.hold)
+
+    def test_run_gcode_pauses(self):
+        grbl = get_fake_grbl('layers_run', time_scale=0.001)
+        commands = draw_layers().to_gcode(Pen())
+        paused = []
+
+        def on_pause(index):
+            paused.append((commands[index], grbl.get_state_name()))
+
+        thread = threading.Thread(target=run_gcode, args=(commands, 'fakegrbl://layers_run'), kwargs={'on_pause': on_pause}, daemon=True)
+        thread.start()
+        thread.join(timeout=10.0)
+        self.assertFalse(thread.is_alive())
+        self.assertListEqual([(GCode.pause(), 'Hold')], paused)
+        start = grbl.lines.index(commands[0])
+        self.assertListEqual(commands, grbl.lines[start:start + len(commands)])
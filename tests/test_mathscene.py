@@ -3,6 +3,12 @@ import unittest
 import numpy as np
 
 from pen.mathscene import AABB
+from pen.mathscene import Arc
+from pen.mathscene import ArcArray
+from pen.mathscene import RadianRange
+from pen.mathscene import arcs_bounds
+from pen.mathscene import points_bounds
+from pen.mathscene import polyline_length
 
 
 class TestMathScene(unittest.TestCase):
@@ -29,3 +35,62 @@ class TestMathScene(unittest.TestCase):
         self.assertListEqual([-1, -0.5, -1.5, -0.5], aabb2.get_rect().to_xxyy())
         aabb1.merge_aabb(aabb2)
         self.assertListEqual([-1, 1, -1.5, 1], aabb1.get_rect().to_xxyy())
+
+    def test_points_bounds(self):
+        points = np.array([[0, 1], [-2, 3], [4, -5]])
+        self.assertListEqual([-2, 4, -5, 3], points_bounds(points))
+        self.assertListEqual([-2, 4, -5, 3], AABB(points).get_rect().to_xxyy())
+
+    def test_polyline_length(self):
+        self.assertEqual(0.0, polyline_length([[1, 1]]))
+        self.assertEqual(7.0, polyline_length([[0, 0], [3, 4], [3, 6]]))
+
+    def test_arcs_bounds(self):
+        arcs = [
+            Arc.from_polar([0, 0], 1.0, 0.0, 2.0 * np.pi),
+            Arc.from_polar([1, 1], 2.0, 0.25 * np.pi, 0.75 * np.pi),
+            Arc.from_polar([0, 0], 1.0, 1.75 * np.pi, 0.25 * np.pi),
+        ]
+        bounds = arcs_bounds(
+            centers=[arc.center_position for arc in arcs],
+            radii=[arc.radius for arc in arcs],
+            start_thetas=[arc.radian_range.start_theta for arc in arcs],
+            widths=[arc.radian_range.get_width() for arc in arcs],
+        )
+        for arc, xxyy in zip(arcs, bounds):
+            np.testing.assert_allclose(arc.get_aabb().get_rect().to_xxyy(), xxyy, atol=1e-9)
+
+    def test_radian_range(self):
+        radian_range = RadianRange(1.75 * np.pi, 0.25 * np.pi)
+        self.assertAlmostEqual(0.5 * np.pi, radian_range.get_width())
+        self.assertTrue(radian_range.contains(0.0))
+        self.assertTrue(radian_range.contains(2.0 * np.pi))
+        self.assertFalse(radian_range.contains(np.pi))
+        self.assertAlmostEqual(2.0 * np.pi, RadianRange(5 * np.pi, np.pi).get_width())
+
+    def test_arc_array(self):
+        arcs = ArcArray.from_absolute_points(
+            starts=[[1, 0], [2, 1], [0, 1]],
+            ends=[[1, 0], [1, 2], [0, -1]],
+            centers=[[0, 0], [1, 1], [0, 0]],
+        )
+        np.testing.assert_allclose([2.0 * np.pi, 0.5 * np.pi, np.pi], arcs.get_lengths())
+        np.testing.assert_allclose([-1, 2, -1, 2], arcs.get_aabb().get_rect().to_xxyy(), atol=1e-9)
+        for i in range(len(arcs)):
+            np.testing.assert_allclose(arcs[i].get_aabb().get_rect().to_xxyy(), arcs.get_bounds()[i], atol=1e-9)
+
+        points, offsets = arcs.to_polylines(tolerance=0.01)
+        self.assertEqual(len(arcs) + 1, len(offsets))
+        for i, (start, end) in enumerate(zip(arcs.get_start_points(), arcs.get_end_points())):
+            polyline = points[offsets[i]:offsets[i + 1]]
+            np.testing.assert_allclose(start, polyline[0], atol=1e-9)
+            np.testing.assert_allclose(end, polyline[-1], atol=1e-9)
+            # Chords never stray further than the tolerance from the arc.
+            midpoints = 0.5 * (polyline[1:] + polyline[:-1])
+            distances = np.hypot(*(midpoints - arcs.centers[i]).T)
+            self.assertTrue(np.all(arcs.radii[i] - distances <= 0.01 + 1e-9))
+
+    def test_circle_array(self):
+        arcs = ArcArray.from_circles([[0, 0], [10, 5]], 2.0)
+        np.testing.assert_allclose([[0, 2], [10, 7]], arcs.get_start_points(), atol=1e-9)
+        np.testing.assert_allclose([-2, 12, -2, 7], arcs.get_aabb().get_rect().to_xxyy(), atol=1e-9)
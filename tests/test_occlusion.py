@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from pen.occlusion import remove_hidden_lines
+from pen.penviz import DrawArcs
+from pen.penviz import PenViz
+
+
+def draw_square(viz, x0, y0, size):
+    viz.draw_path([[x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size], [x0, y0]])
+
+
+class TestOcclusion(unittest.TestCase):
+    def test_later_square_hides_line(self):
+        viz = PenViz()
+        viz.draw_path([[0, 5], [20, 5]])
+        draw_square(viz, 5, 0, 10)
+        visible = remove_hidden_lines(viz)
+        self.assertEqual(3, len(visible.drawables))
+        np.testing.assert_allclose([[0, 5], [5, 5]], visible.drawables[0].path.points)
+        np.testing.assert_allclose([[15, 5], [20, 5]], visible.drawables[1].path.points)
+        # The occluding square itself is untouched.
+        self.assertEqual(5, len(visible.drawables[2].path.points))
+
+    def test_earlier_square_does_not_hide(self):
+        viz = PenViz()
+        draw_square(viz, 5, 0, 10)
+        viz.draw_path([[0, 5], [20, 5]])
+        visible = remove_hidden_lines(viz)
+        self.assertEqual(2, len(visible.drawables))
+        np.testing.assert_allclose([[0, 5], [20, 5]], visible.drawables[1].path.points)
+
+    def test_overlapping_squares(self):
+        viz = PenViz()
+        draw_square(viz, 0, 0, 10)
+        draw_square(viz, 5, 5, 10)
+        visible = remove_hidden_lines(viz)
+        # The corner of the first square inside the second is removed, leaving two open paths.
+        self.assertEqual(3, len(visible.drawables))
+        np.testing.assert_allclose([[0, 0], [10, 0], [10, 5]], visible.drawables[0].path.points)
+        np.testing.assert_allclose([[5, 10], [0, 10], [0, 0]], visible.drawables[1].path.points)
+
+    def test_circle_hides_arc(self):
+        viz = PenViz()
+        viz.draw_circles(np.array([[0.0, 0.0]]), [1.0])
+        viz.draw_circle(np.array([0.0, 0.0]), 2.0)
+        visible = remove_hidden_lines(viz, circle_tolerance=1e-4)
+        self.assertEqual(1, len(visible.drawables))
+        self.assertEqual(DrawArcs, type(visible.drawables[0]))
+        np.testing.assert_allclose([2.0], visible.drawables[0].arcs.radii)
+
+        viz = PenViz()
+        viz.draw_circle(np.array([0.0, 0.0]), 2.0)
+        viz.draw_circles(np.array([[2.0, 0.0]]), [1.0])
+        visible = remove_hidden_lines(viz, circle_tolerance=1e-4)
+        # The circles cross at x = 7/4.
+        hidden = 2.0 * np.pi * 2.0 - visible.drawables[0].arcs.get_lengths().sum()
+        self.assertAlmostEqual(2.0 * 2.0 * np.arccos(7.0 / 8.0), hidden, places=3)
@@ -1,6 +1,11 @@
 import unittest
 
+from pen.optimizer import PenPath
+from pen.optimizer import get_gcode_stats
+from pen.optimizer import greedy_tsp_reversible
+from pen.optimizer import optimize_gcode
 from pen.optimizer import remove_repeated_ops
+from pen.optimizer import simplify_polyline
 
 class TestOptimizer(unittest.TestCase):
     def test_remove_repeated_ops(self):
@@ -38,3 +43,44 @@ class TestOptimizer(unittest.TestCase):
             'M5'
         ]
         self.assertLessEqual(expected, remove_repeated_ops(ops))
+
+    def test_greedy_tsp_reversible(self):
+        paths = [
+            PenPath(start_pt=[10, 0], end_pt=[20, 0]),
+            PenPath(start_pt=[5, 0], end_pt=[0, 0]),
+        ]
+        order, reverse = greedy_tsp_reversible(paths)
+        self.assertListEqual([1, 0], order)
+        self.assertListEqual([True, False], reverse)
+
+    def test_simplify_polyline(self):
+        points = simplify_polyline([[0, 0], [1, 0.001], [2, 0], [2, 1]], tolerance=0.01)
+        self.assertListEqual([[0, 0], [2, 0], [2, 1]], points.tolist())
+
+    def test_optimize_gcode(self):
+        commands = [
+            'M5',
+            'G0X10Y0',
+            'M3S60',
+            'G1X20Y0F1000',
+            'M5',
+            'G0X5Y0',
+            'M3S60',
+            'G1X2Y0F1000',
+            'G1X0Y0F1000',
+            'M5',
+        ]
+        expected = [
+            'M5',
+            'G0X0.0Y0.0',
+            'M3S60',
+            'G1X5.0Y0.0F1000',
+            'M5',
+            'G0X10.0Y0.0',
+            'M3S60',
+            'G1X20.0Y0.0F1000',
+            'M5',
+        ]
+        optimized = optimize_gcode(commands)
+        self.assertListEqual(expected, optimized)
+        self.assertLess(get_gcode_stats(optimized)['pen_up_distance'], get_gcode_stats(commands)['pen_up_distance'])
@@ -0,0 +1,67 @@
+import json
+import os
+import pstats
+import tempfile
+import unittest
+
+from pen import profiling
+from pen.optimizer import optimize_gcode
+from pen.penviz import Pen
+from pen.svgimport import import_svg
+
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        profiling.disable()
+
+    def test_stages(self):
+        # Nothing is recorded while profiling is off.
+        self.assertIs(profiling.NULL_SPAN, profiling.stage('off'))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            svg_path = os.path.join(tmp_dir, 'scene.svg')
+            with open(svg_path, 'w') as w:
+                w.write('<svg><rect x="0" y="0" width="10" height="5" stroke="black" fill="none"/>'
+                        '<path d="M0,0 c5,10 15,10 20,0 M30,30 l5,5" stroke="black" fill="none"/></svg>')
+
+            profiler = profiling.enable(use_cprofile=True)
+            pen = Pen()
+            viz = import_svg(svg_path, pen)
+            viz.draw_circle([40, 40], 5)
+            commands = viz.to_gcode(pen, optimize=True)
+            optimize_gcode(commands)
+            self.assertIs(profiler, profiling.disable())
+
+            totals = profiler.get_totals()
+            self.assertEqual({'rects': 1, 'ellipses': 0, 'paths': 1}, totals['svg.parse']['counters'])
+            self.assertEqual(1, totals['svg.paths_to_segments']['counters']['paths'])
+            self.assertEqual(len(commands), totals['penviz.to_gcode']['counters']['lines'])
+            self.assertEqual(1, totals['optimizer.greedy_tsp']['calls'])
+            self.assertEqual(1, totals['optimizer.greedy_tsp_reversible']['calls'])
+            self.assertIn('strokes_out', totals['optimizer.optimize_gcode']['counters'])
+
+            trace_path = os.path.join(tmp_dir, 'trace.json')
+            profiler.save(trace_path)
+            with open(trace_path) as r:
+                events = json.load(r)['traceEvents']
+            self.assertEqual(len(profiler.spans), len(events))
+            parse, = [event for event in events if event['name'] == 'svg.parse']
+            xml, = [event for event in events if event['name'] == 'svg.parse_xml']
+            # Stages nest in time, which is how the trace viewer stacks them.
+            self.assertLessEqual(parse['ts'], xml['ts'])
+            self.assertGreaterEqual(parse['ts'] + parse['dur'], xml['ts'] + xml['dur'])
+
+            stats_path = os.path.join(tmp_dir, 'run.prof')
+            profiler.save(stats_path)
+            self.assertGreater(pstats.Stats(stats_path).total_calls, 0)
+
+    def test_profile_value(self):
+        self.assertIsNone(profiling.parse_profile_value(None))
+        self.assertIsNone(profiling.parse_profile_value('0'))
+        self.assertEqual('', profiling.parse_profile_value('1'))
+        self.assertEqual('run.prof', profiling.parse_profile_value('run.prof'))
+        self.assertEqual('trace.json', profiling.parse_profile_value('trace.json'))
+        # A subcommand taken for the path, or a format nothing can write, is refused before the run.
+        for value in ['up', 'out.txt']:
+            with self.assertRaises(RuntimeError):
+                profiling.parse_profile_value(value)
@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+from pen.fakegrbl import get_fake_grbl
+from pen.gcode import GCode
+from pen.scheduler import JobScheduler
+from pen.scheduler import PlotJob
+from pen.scheduler import SchedulerServer
+
+
+def make_job(length, count):
+    commands = [GCode.pen_up(), GCode.move_fast([0, 0]), GCode.pen_down()]
+    for i in range(count):
+        commands.append(GCode.move_linear([length * ((i + 1) % 2), i]))
+    return commands + [GCode.pen_up()]
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = None
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+
+    def start(self, ports):
+        self.scheduler = JobScheduler(ports)
+        self.server = SchedulerServer(self.scheduler, ('127.0.0.1', 0))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.scheduler.start()
+        return 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def wait_for(self, predicate, timeout=20.0):
+        start_time = time.monotonic()
+        while not predicate():
+            if time.monotonic() - start_time > timeout:
+                self.fail('Timed out waiting for scheduler')
+            time.sleep(0.01)
+
+    def test_jobs_over_api(self):
+        ports = ['fakegrbl://fleet_a?time_scale=0.01', 'fakegrbl://fleet_b?time_scale=0.01']
+        url = self.start(ports)
+
+        job_ids = []
+        for count in [10, 40, 20, 30]:
+            data = '\n'.join(make_job(10, count)).encode('utf-8')
+            request = urllib.request.Request(url + '/jobs?name=job{}'.format(count), data=data, method='POST')
+            with urllib.request.urlopen(request) as response:
+                job_ids.append(json.load(response)['id'])
+
+        def all_done():
+            return all(self.scheduler.get_job(job_id).status == PlotJob.DONE for job_id in job_ids)
+        self.wait_for(all_done)
+
+        with urllib.request.urlopen(url + '/jobs/{}'.format(job_ids[1])) as response:
+            job = json.load(response)
+        self.assertEqual('done', job['status'])
+        self.assertEqual(job['lines'], job['lines_sent'])
+        self.assertSetEqual(set(ports), set(self.scheduler.get_job(job_id).device for job_id in job_ids))
+
+    def test_bad_job(self):
+        url = self.start(['fakegrbl://bad_job'])
+        # The last two pause for a pen change, which nobody would make.
+        for text in ['X1Y1', 'G1X1\nM7', 'G1X1\nG7X2', b'G1X\xff', 'G1X1\nM5\nG28\nM0\nG1X2',
+                     'G1X1\nM0 (swap pen)\nG1X2']:
+            data = text if isinstance(text, bytes) else text.encode('utf-8')
+            request = urllib.request.Request(url + '/jobs', data=data, method='POST')
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(request)
+            self.assertEqual(400, context.exception.code)
+            self.assertIn('error', json.load(context.exception))
+        self.assertListEqual([], self.scheduler.get_status()['jobs'])
+
+    def test_requeue_on_alarm(self):
+        ports = ['fakegrbl://alarm_a?time_scale=0.05', 'fakegrbl://alarm_b?time_scale=0.05']
+        self.start(ports)
+        job = self.scheduler.submit(make_job(10, 60), name='long')
+        self.wait_for(lambda: job.status == PlotJob.RUNNING and job.lines_sent > 5)
+
+        first_port = job.device
+        get_fake_grbl(first_port.split('://')[1].split('?')[0]).trigger_alarm()
+        self.wait_for(lambda: job.status == PlotJob.DONE)
+        self.assertEqual(2, job.attempts)
+        self.assertNotEqual(first_port, job.device)
+
+        worker = [worker for worker in self.scheduler.workers if worker.port == first_port][0]
+        self.assertEqual('alarm', worker.status)
+        self.scheduler.unlock(first_port)
+        self.wait_for(lambda: worker.status == 'idle')
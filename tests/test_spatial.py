@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from pen.spatial import GridIndex
+
+
+def brute_force_knn(points, alive, point, k):
+    distances = np.hypot(*(points - point).T)
+    distances[~alive] = np.inf
+    order = np.argsort(distances, kind='stable')[:k]
+    return order, distances[order]
+
+
+class TestSpatial(unittest.TestCase):
+    def test_box_queries(self):
+        index = GridIndex.from_segments(
+            starts=[[0, 0], [5, 5], [20, 0], [0, 20]],
+            ends=[[10, 0], [6, 6], [30, 10], [0, 30]],
+        )
+        self.assertEqual(4, len(index))
+        self.assertListEqual([0, 1], sorted(index.query_box([4, 7, -1, 5.5]).tolist()))
+        self.assertListEqual([], index.query_box([11, 19, 11, 19]).tolist())
+
+        queries, items = index.query_boxes([[25, 26, 4, 5], [-1, 1, -1, 25], [100, 101, 100, 101]])
+        self.assertListEqual([0, 1, 1], queries.tolist())
+        self.assertListEqual([2, 0, 3], items.tolist())
+
+    def test_radius_and_knn(self):
+        rng = np.random.RandomState(0)
+        points = rng.rand(500, 2) * 100.0
+        index = GridIndex.from_points(points)
+        alive = np.ones(len(points), dtype=bool)
+
+        ids, distances = index.query_radius([50, 50], 10.0)
+        expected = np.hypot(*(points - [50, 50]).T)
+        self.assertListEqual(sorted(np.nonzero(expected <= 10.0)[0].tolist()), sorted(ids.tolist()))
+        self.assertTrue(np.all(np.diff(distances) >= 0.0))
+
+        for query in [[50, 50], [-40, 120], [0, 0]]:
+            ids, distances = index.query_knn(query, k=5)
+            expected_ids, expected_distances = brute_force_knn(points, alive, query, 5)
+            self.assertListEqual(expected_ids.tolist(), ids.tolist())
+            np.testing.assert_allclose(expected_distances, distances)
+
+        # Removing most items regrids the rest, queries still match a brute force search.
+        removed = rng.permutation(len(points))[:450]
+        index.remove(removed)
+        alive[removed] = False
+        self.assertEqual(50, len(index))
+        for query in rng.rand(20, 2) * 100.0:
+            ids, _ = index.query_knn(query, k=3)
+            self.assertListEqual(brute_force_knn(points, alive, query, 3)[0].tolist(), ids.tolist())
+        self.assertEqual(0, np.count_nonzero(~alive[index.query_box([0, 100, 0, 100])]))
+
+    def test_insert(self):
+        index = GridIndex(cell_size=1.0)
+        self.assertEqual(0, len(index.query_knn([0, 0])[0]))
+        self.assertListEqual([0, 1], index.insert_points([[0, 0], [10, 10]]).tolist())
+        self.assertListEqual([1], index.query_knn([8, 8])[0].tolist())
+        self.assertListEqual([2], index.insert_points([[7, 7]]).tolist())
+        self.assertListEqual([2], index.query_knn([8, 8])[0].tolist())
+        index.remove([2])
+        self.assertListEqual([1], index.query_knn([8, 8])[0].tolist())
+
+        queries, items = index.query_radius_pairs([[0, 1], [9, 9], [5, 5]], radius=1.5)
+        self.assertListEqual([0, 1], queries.tolist())
+        self.assertListEqual([0, 1], items.tolist())
+
@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules robopen.py up, down or move must not pay for before they touch the device. Checking what is
+# imported rather than timing it keeps the test steady on a loaded machine.
+HEAVY_MODULES = [
+    'numpy',
+    'halo',
+    'tqdm',
+    'urllib.request',
+    'http.server',
+    'xml.dom.minidom',
+    'pen.gcode',
+    'pen.streaming',
+    'pen.penviz',
+]
+
+STARTUP_SCRIPT = '''
+import json
+import sys
+
+import robopen
+from pen.plotter import run_commands
+print(json.dumps({'modules': sorted(sys.modules)}))
+'''
+
+
+def get_startup_modules():
+    output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT], cwd=ROOT_DIR)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])['modules']
+
+
+class TestStartup(unittest.TestCase):
+    def test_device_commands_import_little(self):
+        modules = get_startup_modules()
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, modules)
@@ -0,0 +1,84 @@
+import unittest
+
+import numpy as np
+
+from pen.penviz import DrawArc
+from pen.penviz import DrawPath
+from pen.penviz import Pen
+from pen.svg import SVGPath
+from pen.svg import SVGPathDataParser
+from pen.svg import paths_to_segments
+from pen.svgimport import PenVizSVGParser
+
+
+class TestSVG(unittest.TestCase):
+    def test_paths_to_segments(self):
+        paths = [
+            SVGPath('M 0,0 l 10,0 0,10 z'),
+            SVGPath('M 0,0 c 5,10 15,10 20,0 M 30,30 l 5,5'),
+            SVGPath('M 1,1'),
+            SVGPath('M 5,5 q 5,5 10,0 h 5 v -5'),
+        ]
+        expected = [path.to_segments() for path in paths]
+        for workers in [1, 2]:
+            points, offsets, path_offsets = paths_to_segments(paths, workers=workers, chunk_size=2)
+            self.assertListEqual([0, 1, 3, 4, 5], path_offsets.tolist())
+            for i, segments in enumerate(expected):
+                polylines = range(path_offsets[i], path_offsets[i + 1])
+                self.assertEqual(len(segments), len(polylines))
+                for segment, polyline in zip(segments, polylines):
+                    np.testing.assert_allclose(segment, points[offsets[polyline]:offsets[polyline + 1]])
+
+        points, offsets, path_offsets = paths_to_segments([], workers=2)
+        self.assertEqual((0, 2), points.shape)
+        self.assertListEqual([0], offsets.tolist())
+        self.assertListEqual([0], path_offsets.tolist())
+
+    def test_path_commands(self):
+        # Numbers run together, absolute and relative forms agree.
+        absolute, = SVGPath('M10-5L20-5H30V5L10,5Z').to_segments()
+        relative, = SVGPath('m10-5l10 0h10v10l-20 0z').to_segments()
+        expected = [[10, -5], [20, -5], [30, -5], [30, 5], [10, 5], [10, -5]]
+        np.testing.assert_allclose(expected, absolute)
+        np.testing.assert_allclose(expected, relative)
+
+        # Smooth curves reflect the previous control point, so S and T match their spelled out forms.
+        smooth, = SVGPath('M0,0 C0,10 10,10 10,0 S20,-10 20,0 Q25,10 30,0 T40,0').to_segments(0.01)
+        spelled, = SVGPath('M0,0 C0,10 10,10 10,0 C10,-10 20,-10 20,0 Q25,10 30,0 Q35,-10 40,0').to_segments(0.01)
+        np.testing.assert_allclose(spelled, smooth)
+
+        with self.assertRaises(RuntimeError):
+            SVGPath('M0,0 L10,10 X').to_segments()
+
+    def test_arcs(self):
+        parser = SVGPathDataParser()
+        # Flags may run into the end point.
+        circle, = parser.data_to_segments('M0,0 a5 5 0 0110 0', bezier_distance_tolerance=0.01)
+        np.testing.assert_allclose([0, 0], circle[0])
+        np.testing.assert_allclose([10, 0], circle[-1])
+        np.testing.assert_allclose(5.0, np.hypot(*(circle - [5, 0]).T))
+        # Sweeping towards increasing angles with y down passes over the top.
+        self.assertTrue(np.all(circle[1:-1, 1] < 0.0))
+        arc, = parser.arcs
+        self.assertEqual((0, len(circle) - 1), (arc.first, arc.last))
+        np.testing.assert_allclose([5, 0], arc.center)
+
+        # Elliptical arcs are only flattened, radii too small are scaled up to reach the end.
+        ellipse, = parser.data_to_segments('M0,0 A1 2 90 1 0 10,0', bezier_distance_tolerance=0.01)
+        self.assertEqual([], parser.arcs)
+        np.testing.assert_allclose([10, 0], ellipse[-1])
+        self.assertTrue(np.all(ellipse[1:-1, 1] > 0.0))
+        # The rotated ry axis lies along x and the end point is 10 away, so the ellipse is 5 by 2.5.
+        np.testing.assert_allclose(2.5, ellipse[:, 1].max(), atol=0.01)
+        np.testing.assert_allclose(1.0, np.hypot((ellipse[:, 0] - 5.0) / 5.0, ellipse[:, 1] / 2.5))
+
+    def test_import_arcs(self):
+        pen = Pen()
+        parser = PenVizSVGParser(pen, fill=False)
+        parser.handle_path(SVGPath('M0,50 L10,50 A10 10 0 0 1 30,50 L40,50', stroke='black'))
+        self.assertListEqual([DrawPath, DrawArc, DrawPath], [type(drawable) for drawable in parser.viz.drawables])
+        arc = parser.viz.drawables[1].arc
+        np.testing.assert_allclose([20, pen.draw_height - 50], arc.center_position)
+        np.testing.assert_allclose(np.pi, arc.radian_range.get_width())
+        # Counter clockwise from the right end goes over the top, which is up the page.
+        np.testing.assert_allclose([30, pen.draw_height - 50], arc.start_position)
@@ -0,0 +1,36 @@
+import json
+import os
+import tempfile
+import unittest
+
+from pen.gcode import GCode
+from pen.plotter import run_gcode
+from pen.telemetry import RunTelemetry
+
+
+class TestTelemetry(unittest.TestCase):
+    def test_run_report(self):
+        commands = [GCode.pen_down()] + [GCode.move_linear([x, x]) for x in range(1, 20)] + [GCode.pen_up()]
+        telemetry = RunTelemetry(status_interval=0.0)
+        run_gcode(commands, 'fakegrbl://telemetry', telemetry=telemetry)
+
+        summary = telemetry.get_summary()
+        self.assertEqual(len(commands), summary['lines'])
+        # Status is polled while lines stream, not once per line.
+        self.assertGreater(summary['status_reports'], 0)
+        self.assertLessEqual(summary['status_reports'], len(commands))
+        self.assertLessEqual(summary['latency_p50'], summary['latency_p99'])
+        self.assertGreater(summary['pen_down_time'], 0.0)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_path = os.path.join(tmp_dir, 'report.json')
+            telemetry.save_report(json_path)
+            with open(json_path) as r:
+                report = json.load(r)
+            self.assertEqual(len(commands), len(report['lines']))
+            self.assertEqual(commands[1], report['lines'][1]['command'])
+
+            csv_path = os.path.join(tmp_dir, 'report.csv')
+            telemetry.save_report(csv_path)
+            with open(csv_path) as r:
+                self.assertEqual(len(commands) + 1, len(r.readlines()))